@@ -0,0 +1,169 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, List
+
+import h5py
+import numpy as np
+
+from failgen.utils.h5_storage import EpisodeData, recursive_add_to_h5py
+from failgen.wrappers.record import BackgroundWriter
+
+
+def make_episodes(
+    num_episodes: int,
+    num_steps: int,
+    image_size: int,
+    rng: np.random.Generator,
+) -> List[EpisodeData]:
+    """Episodes shaped like the ones of `RecordEpisode`, with a camera
+    observation if `image_size` is positive"""
+    episodes = []
+    for _ in range(num_episodes):
+        T = num_steps
+        episode = dict(
+            actions=rng.standard_normal((T, 8)).astype(np.float32),
+            terminated=np.zeros(T, dtype=bool),
+            truncated=np.zeros(T, dtype=bool),
+            env_states=dict(
+                actors=dict(
+                    cube=rng.standard_normal((T + 1, 13)).astype(np.float32)
+                ),
+                articulations=dict(
+                    panda=rng.standard_normal((T + 1, 31)).astype(np.float32)
+                ),
+            ),
+        )
+        if image_size > 0:
+            # A static background with some noise, so that gzip has about
+            # as much work as with rendered frames
+            background = rng.integers(
+                0, 128, (1, image_size, image_size, 3), dtype=np.uint8
+            )
+            noise = rng.integers(
+                0, 8, (T + 1, image_size, image_size, 3), dtype=np.uint8
+            )
+            episode["obs"] = dict(
+                sensor_data=dict(base_camera=dict(rgb=background + noise))
+            )
+        episodes.append(episode)
+    return episodes
+
+
+def write_episode(
+    h5_file: h5py.File, episode_id: int, episode: EpisodeData
+) -> None:
+    group = h5_file.create_group(f"traj_{episode_id}", track_order=True)
+    for key, data in episode.items():
+        recursive_add_to_h5py(group, data, key)
+
+
+def step_holding_gil(seconds: float) -> None:
+    # Like the python code of the wrappers and the planners
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def step_releasing_gil(seconds: float) -> None:
+    # Like the simulation and the rendering, which run outside of python
+    time.sleep(seconds)
+
+
+def collect(
+    path: str,
+    episodes: List[EpisodeData],
+    step: Callable[[float], None],
+    step_seconds: float,
+    writer: BackgroundWriter = None,
+) -> float:
+    """The time to step and write every episode, in the background if a
+    writer is given"""
+    start = time.perf_counter()
+    with h5py.File(path, "w") as h5_file:
+        for episode_id, episode in enumerate(episodes):
+            step(step_seconds)
+            if writer is None:
+                write_episode(h5_file, episode_id, episode)
+            else:
+                writer.submit(write_episode, h5_file, episode_id, episode)
+        if writer is not None:
+            writer.close()
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num-episodes",
+        type=int,
+        default=20,
+        help="The number of episodes written in each run",
+    )
+    parser.add_argument(
+        "--num-steps",
+        type=int,
+        default=100,
+        help="The number of steps of each episode",
+    )
+    parser.add_argument(
+        "--image-sizes",
+        type=int,
+        nargs="+",
+        default=[0, 128],
+        help="The sizes of the camera observations, 0 for no camera",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=4,
+        help="The episodes that can wait for the background writer",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seeds the data of the episodes",
+    )
+
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(
+        f"{'image':>6} {'write ms':>9} {'stepping':>13} {'sync s':>7} "
+        + f"{'async s':>8} {'speedup':>8}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "trajectory.h5")
+        for image_size in args.image_sizes:
+            episodes = make_episodes(
+                args.num_episodes, args.num_steps, image_size, rng
+            )
+            # Stepping takes as long as writing, where the writer can save
+            # the most (half of the time)
+            write_time = collect(path, episodes, step_holding_gil, 0.0)
+            step_seconds = write_time / len(episodes)
+            for name, step in (
+                ("holds GIL", step_holding_gil),
+                ("releases GIL", step_releasing_gil),
+            ):
+                sync_time = collect(path, episodes, step, step_seconds)
+                async_time = collect(
+                    path,
+                    episodes,
+                    step,
+                    step_seconds,
+                    BackgroundWriter(args.max_pending),
+                )
+                print(
+                    f"{image_size:>6} {step_seconds * 1e3:9.1f} {name:>13} "
+                    + f"{sync_time:7.2f} {async_time:8.2f} "
+                    + f"{sync_time / async_time:7.2f}x"
+                )
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+import argparse
+import os
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import h5py
+import numpy as np
+from PIL import Image
+
+from failgen.utils.h5_storage import (
+    TRAJECTORY_STORAGES,
+    ChunkedTrajectoryStore,
+    CompressionPolicy,
+    EpisodeData,
+    available_compressors,
+    iter_leaves,
+    load_trajectory,
+    recursive_add_to_h5py,
+)
+
+CURRENT_DIR = Path(__file__).parent.resolve()
+DEFAULT_DATA_FOLDER = CURRENT_DIR.parent / "resources" / "test_data"
+VIEWS = ["front", "side", "wrist"]
+IMAGE_KEYS = ("rgb",)
+
+
+def load_views(data_folder: Path) -> Dict[str, np.ndarray]:
+    views = {}
+    for view in VIEWS:
+        png_files = sorted(
+            (data_folder / view).glob("*.png"), key=lambda x: int(x.stem)
+        )
+        views[view] = np.stack(
+            [np.asarray(Image.open(f).convert("RGB")) for f in png_files]
+        )
+    return views
+
+
+def make_episodes(
+    views: Dict[str, np.ndarray], num_episodes: int, rng: np.random.Generator
+) -> List[EpisodeData]:
+    """Episodes shaped like the ones of `RecordEpisode`, with the frames of
+    the test data as camera observations"""
+    num_frames = min(len(frames) for frames in views.values())
+    episodes = []
+    for _ in range(num_episodes):
+        # Episodes of different lengths, like the failures of a collection
+        T = int(rng.integers(num_frames // 2, num_frames))
+        episodes.append(
+            dict(
+                obs=dict(
+                    sensor_data={
+                        view: dict(rgb=frames[: T + 1])
+                        for view, frames in views.items()
+                    }
+                ),
+                actions=rng.standard_normal((T, 8)).astype(np.float32),
+                terminated=np.zeros(T, dtype=bool),
+                truncated=np.zeros(T, dtype=bool),
+                env_states=dict(
+                    actors=dict(
+                        cube=rng.standard_normal((T + 1, 13)).astype(np.float32)
+                    ),
+                    articulations=dict(
+                        panda=rng.standard_normal((T + 1, 31)).astype(
+                            np.float32
+                        )
+                    ),
+                ),
+            )
+        )
+    return episodes
+
+
+def episode_bytes(episode: EpisodeData) -> int:
+    return sum(array.nbytes for _, array in iter_leaves(episode))
+
+
+def write_episodes(
+    path: str,
+    storage: str,
+    compression: CompressionPolicy,
+    episodes: List[EpisodeData],
+) -> None:
+    with h5py.File(path, "w") as h5_file:
+        if storage == "chunked":
+            store = ChunkedTrajectoryStore(h5_file, compression)
+            for episode_id, episode in enumerate(episodes):
+                store.append(episode_id, episode)
+        else:
+            for episode_id, episode in enumerate(episodes):
+                group = h5_file.create_group(
+                    f"traj_{episode_id}", track_order=True
+                )
+                for key, data in episode.items():
+                    recursive_add_to_h5py(group, data, key, compression)
+
+
+def timeit(fn: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data-folder",
+        type=str,
+        default=str(DEFAULT_DATA_FOLDER),
+        help="The folder with the front, side and wrist frames of an episode",
+    )
+    parser.add_argument(
+        "--num-episodes",
+        type=int,
+        default=50,
+        help="The number of episodes written to each file",
+    )
+    parser.add_argument(
+        "--num-reads",
+        type=int,
+        default=100,
+        help="The number of random episodes read from each file",
+    )
+    parser.add_argument(
+        "--compressors",
+        type=str,
+        nargs="+",
+        default=list(available_compressors()),
+        help="The compressors of the images to run the benchmark with",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seeds the lengths of the episodes and the episodes read",
+    )
+
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    episodes = make_episodes(
+        load_views(Path(args.data_folder)), args.num_episodes, rng
+    )
+    total_bytes = sum(episode_bytes(episode) for episode in episodes)
+    read_ids = rng.integers(0, len(episodes), size=args.num_reads)
+    print(
+        f"{len(episodes)} episodes, {total_bytes / 1e6:.1f} MB, "
+        + f"{args.num_reads} random reads"
+    )
+    print(
+        f"{'storage':>8} {'images':>10} {'write MB/s':>11} {'size MB':>8} "
+        + f"{'open ms':>8} {'read ms':>8} {'p95 ms':>8}"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for storage in TRAJECTORY_STORAGES:
+            for compressor in args.compressors:
+                compression = CompressionPolicy(
+                    {key: compressor for key in IMAGE_KEYS}
+                )
+                path = os.path.join(tmp_dir, f"{storage}_{compressor}.h5")
+                write_time = timeit(
+                    lambda: write_episodes(path, storage, compression, episodes)
+                )
+                size = os.path.getsize(path)
+
+                with h5py.File(path, "r") as h5_file:
+                    # Loading the trajectory also builds the index of the
+                    # chunked storage, counted as the time to open the file
+                    open_time = timeit(lambda: load_trajectory(h5_file, 0))
+                    if storage == "chunked":
+                        store = ChunkedTrajectoryStore(h5_file)
+                        read_fn = store.read_episode
+                    else:
+                        read_fn = partial(load_trajectory, h5_file)
+                    read_times = np.array(
+                        [
+                            timeit(lambda: read_fn(int(episode_id)))
+                            for episode_id in read_ids
+                        ]
+                    )
+
+                print(
+                    f"{storage:>8} {compressor:>10} "
+                    + f"{total_bytes / 1e6 / write_time:11.1f} "
+                    + f"{size / 1e6:8.1f} "
+                    + f"{open_time * 1e3:8.2f} "
+                    + f"{read_times.mean() * 1e3:8.2f} "
+                    + f"{np.percentile(read_times, 95) * 1e3:8.2f}"
+                )
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
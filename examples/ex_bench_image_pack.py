@@ -0,0 +1,222 @@
+import argparse
+import time
+from math import floor
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from failgen.utils.image_manipulation import (
+    LABEL_OFFSET,
+    NUM_TIMESTEPS,
+    NUM_VIEWS,
+    annotate_image_packs,
+    clear_glyph_cache,
+    create_image_pack,
+    create_image_packs,
+    load_font,
+)
+
+CURRENT_DIR = Path(__file__).parent.resolve()
+DEFAULT_DATA_FOLDER = CURRENT_DIR.parent / "resources" / "test_data"
+VIEWS = ["front", "side", "wrist"]
+
+
+def load_views(data_folder: Path, image_size: int) -> List[np.ndarray]:
+    views = []
+    for view in VIEWS:
+        png_files = sorted(
+            (data_folder / view).glob("*.png"), key=lambda x: int(x.stem)
+        )
+        frames = [
+            np.asarray(
+                Image.open(png_file)
+                .convert("RGB")
+                .resize((image_size, image_size))
+            )
+            for png_file in png_files
+        ]
+        views.append(np.stack(frames))
+    return views
+
+
+def annotate_with_pil(
+    image_pack: np.ndarray,
+    img_height: int,
+    img_width: int,
+    separator_width: int,
+    font_size: int,
+) -> np.ndarray:
+    # The labeling path used before the glyph cache: load the font and let
+    # PIL rasterize every label on every call
+    image_pack_pil = Image.fromarray(image_pack)
+    draw = ImageDraw.Draw(image_pack_pil)
+    font = load_font(font_size)
+    for j in range(NUM_TIMESTEPS):
+        for i in range(NUM_VIEWS):
+            start_px = (i * img_height, j * img_width + j * separator_width)
+            text_px = (start_px[1] + LABEL_OFFSET, start_px[0] + LABEL_OFFSET)
+            draw.text(text_px, str(j + 1), fill="white", font=font)
+    return np.asarray(image_pack_pil)
+
+
+def timeit(fn: Callable[[], None], repeats: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data-folder",
+        type=str,
+        default=str(DEFAULT_DATA_FOLDER),
+        help="The folder with the front, side and wrist frames to pack",
+    )
+    parser.add_argument(
+        "--image-size",
+        type=int,
+        nargs="+",
+        default=[64, 128, 256],
+        help="The sizes of the frames to run the benchmark with",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=20,
+        help="The number of times each measurement is repeated",
+    )
+    parser.add_argument(
+        "--separator-width",
+        type=int,
+        default=10,
+        help="The width in pixels of the gap between timesteps",
+    )
+    parser.add_argument(
+        "--font-size",
+        type=int,
+        default=40,
+        help="The size of the font used for the timestep labels",
+    )
+
+    args = parser.parse_args()
+
+    for image_size in args.image_size:
+        front, side, wrist = load_views(Path(args.data_folder), image_size)
+        num_frames = len(front)
+        start_indices = list(range(floor(num_frames / NUM_TIMESTEPS)))
+        pack = np.asarray(
+            create_image_pack(
+                list(front),
+                list(side),
+                list(wrist),
+                end_idx=num_frames,
+                separator_width=args.separator_width,
+                font_size=args.font_size,
+                use_annotations=False,
+            )
+        )
+
+        pil_pack = annotate_with_pil(
+            pack,
+            image_size,
+            image_size,
+            args.separator_width,
+            args.font_size,
+        )
+        glyph_pack = pack.copy()
+        annotate_image_packs(
+            glyph_pack,
+            image_size,
+            image_size,
+            args.separator_width,
+            args.font_size,
+        )
+        assert (pil_pack == glyph_pack).all(), "Glyph labels differ from PIL"
+
+        time_pil = timeit(
+            lambda: annotate_with_pil(
+                pack,
+                image_size,
+                image_size,
+                args.separator_width,
+                args.font_size,
+            ),
+            args.repeats,
+        )
+        time_glyphs = timeit(
+            lambda: annotate_image_packs(
+                pack.copy(),
+                image_size,
+                image_size,
+                args.separator_width,
+                args.font_size,
+            ),
+            args.repeats,
+        )
+        clear_glyph_cache()
+        time_glyphs_cold = timeit(
+            lambda: (
+                clear_glyph_cache(),
+                annotate_image_packs(
+                    pack.copy(),
+                    image_size,
+                    image_size,
+                    args.separator_width,
+                    args.font_size,
+                ),
+            ),
+            args.repeats,
+        )
+        time_per_call = timeit(
+            lambda: [
+                create_image_pack(
+                    list(front),
+                    list(side),
+                    list(wrist),
+                    start_idx=k,
+                    end_idx=num_frames,
+                    separator_width=args.separator_width,
+                    font_size=args.font_size,
+                )
+                for k in start_indices
+            ],
+            args.repeats,
+        )
+        time_batched = timeit(
+            lambda: create_image_packs(
+                front,
+                side,
+                wrist,
+                start_indices=start_indices,
+                separator_width=args.separator_width,
+                font_size=args.font_size,
+            ),
+            args.repeats,
+        )
+
+        print(f"image size: {image_size}x{image_size}")
+        print(f"  labels, PIL ImageDraw     : {time_pil * 1e3:8.3f} ms/pack")
+        print(
+            "  labels, glyph cache (cold): "
+            + f"{time_glyphs_cold * 1e3:8.3f} ms/pack"
+        )
+        print(f"  labels, glyph cache (warm): {time_glyphs * 1e3:8.3f} ms/pack")
+        print(
+            f"  {len(start_indices)} packs, per call        : "
+            + f"{time_per_call * 1e3:8.3f} ms"
+        )
+        print(
+            f"  {len(start_indices)} packs, batched         : "
+            + f"{time_batched * 1e3:8.3f} ms"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,46 +1,8 @@
 import argparse
 
+from failgen.batched_env_wrapper import BatchedFailgenWrapper
 from failgen.env_wrapper import FailgenWrapper
-
-
-def run_get_failures(
-    task_name: str,
-    fail_type: str,
-    num_episodes: int,
-    save_video: bool,
-    headless: bool,
-    max_tries: int = 10,
-) -> None:
-    fail_wrapper = FailgenWrapper(
-        task_name=task_name,
-        headless=headless,
-        save_video=save_video,
-    )
-
-    fail_wrapper._fail_plan_wrapper.set_active_type(fail_type)
-    fail_obj = fail_wrapper._fail_plan_wrapper._active_fail
-
-    if fail_obj is None:
-        return
-
-    stages = fail_obj.stages
-
-    collected_episodes = 0
-    for stage in stages:
-        curr_tries = max_tries
-        fail_wrapper._fail_plan_wrapper.set_active_stage(stage)
-        while collected_episodes <= num_episodes and curr_tries > 0:
-            success = fail_wrapper.get_failure()
-            print(
-                f"stage: {stage}, success: {success}, fail_type: {fail_type}, num_ep: {collected_episodes}, curr_tries: {curr_tries}"
-            )
-            if not success:
-                curr_tries = max_tries
-                collected_episodes += 1
-                fail_wrapper.save_video(save=True, ep_idx=collected_episodes)
-            else:
-                fail_wrapper.save_video(save=False)
-                curr_tries -= 1
+from failgen.scheduler import Ledger, OutcomeCache, SeedScheduler
 
 
 def main() -> int:
@@ -68,12 +30,32 @@ def main() -> int:
         default=10,
         help="The number of episodes to run this demo",
     )
+    parser.add_argument(
+        "--num-envs",
+        type=int,
+        default=1,
+        help="The number of sub-environments collecting in parallel",
+    )
     parser.add_argument(
         "--fail-type",
         type=str,
         default="",
         help="The specific fail type to use for data collection",
     )
+    parser.add_argument(
+        "--ledger",
+        type=str,
+        default=None,
+        help="A file where to log every attempt, to resume the collection "
+        + "from it after a crash",
+    )
+    parser.add_argument(
+        "--outcome-cache",
+        type=str,
+        default=None,
+        help="A file with the outcomes of previous runs, used with --ledger "
+        + "to try first the seeds and noise ranges that failed before",
+    )
 
     args = parser.parse_args()
 
@@ -87,15 +69,59 @@ def main() -> int:
     if args.fail_type != "":
         FAIL_TYPES = [args.fail_type]
 
-    for fail_type in FAIL_TYPES:
-        run_get_failures(
+    scheduler = None
+    if args.ledger is not None:
+        cache = None
+        if args.outcome_cache is not None:
+            cache = OutcomeCache(args.outcome_cache)
+        scheduler = SeedScheduler(Ledger(args.ledger), cache=cache)
+
+    if args.num_envs > 1:
+        batched_wrapper = BatchedFailgenWrapper(
             task_name=args.task_name,
-            fail_type=fail_type,
-            num_episodes=args.num_episodes,
+            num_envs=args.num_envs,
+            headless=args.headless,
             save_video=args.save_video,
+        )
+        batched_wrapper.collect(
+            FAIL_TYPES,
+            stages=None,
+            num_episodes=args.num_episodes,
+            scheduler=scheduler,
+        )
+        batched_wrapper.close()
+    else:
+        # A single environment runs the whole plan of failure types and stages
+        fail_wrapper = FailgenWrapper(
+            task_name=args.task_name,
             headless=args.headless,
+            save_video=args.save_video,
+        )
+        fail_wrapper.collect(
+            FAIL_TYPES,
+            num_episodes=args.num_episodes,
+            scheduler=scheduler,
         )
+        setup_stats = fail_wrapper._fail_plan_wrapper.setup_stats
+        print(
+            f"planner setup: builds: {setup_stats.builds} "
+            + f"({1000 * setup_stats.mean_build_time:.2f} ms), "
+            + f"resyncs: {setup_stats.resyncs} "
+            + f"({1000 * setup_stats.mean_resync_time:.2f} ms)"
+        )
+        if fail_wrapper.plan_cache is not None:
+            stats = fail_wrapper.plan_cache.stats
+            print(
+                f"plan cache: hits: {stats.hits}, misses: {stats.misses}, "
+                + f"rejected: {stats.rejected}, "
+                + f"hit_rate: {stats.hit_rate:.2f}"
+            )
+        fail_wrapper.close()
 
+    if scheduler is not None:
+        if scheduler.cache is not None:
+            print(scheduler.cache.format_report())
+        scheduler.close()
     return 0
 
 
@@ -0,0 +1,384 @@
+import multiprocessing as mp
+import time
+import traceback
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from failgen.scheduler import (
+    OUTCOME_FAIL,
+    OUTCOME_SUCCESS,
+    AttemptRecord,
+    SeedScheduler,
+    noise_bucket,
+)
+from failgen.task_config import load_task_config
+
+# NOTE: The motion planner (mplib) and the task solutions plan and act for a
+# single robot, i.e. for the first sub-scene only, so the sub-environments of
+# a batch are separate single-scene simulations, each one living in its own
+# process, instead of the sub-scenes of a GPU-parallelized environment
+
+
+@dataclass(frozen=True)
+class FailurePlan:
+    """The failure to generate in one attempt of a sub-environment"""
+
+    fail_type: str
+    fail_stage: int
+    seed: int
+    ep_idx: Optional[int] = None
+    """index to save the episode with if it fails, defaults to the next one"""
+
+    noise_range: Optional[Tuple[float, float]] = None
+    """sub-range of [0, 1) to draw the fraction of the noise from"""
+
+
+@dataclass
+class AttemptResult:
+    env_idx: int
+    plan: FailurePlan
+    success: bool
+    ep_idx: Optional[int]
+    """index of the saved episode, None if the attempt was discarded"""
+
+    duration: float
+    noise_sample: Optional[float] = None
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+def load_fail_stages(task_name: str) -> Dict[str, List[int]]:
+    return load_task_config(task_name).fail_stages()
+
+
+def run_worker(
+    env_idx: int,
+    task_name: str,
+    headless: bool,
+    save_video: bool,
+    save_path: Optional[str],
+    trajectory_name: str,
+    seed: int,
+    episode_counter,
+    conn: Connection,
+) -> None:
+    # The perturbations are seeded per episode, this keeps anything else that
+    # draws from the global generator independent across sub-environments
+    np.random.seed(np.random.SeedSequence([seed, env_idx]).generate_state(1)[0])
+
+    from failgen.env_wrapper import FailgenWrapper
+
+    fail_wrapper = None
+    try:
+        fail_wrapper = FailgenWrapper(
+            task_name=task_name,
+            headless=headless,
+            save_video=save_video,
+            save_path=save_path,
+            trajectory_name=trajectory_name,
+        )
+        conn.send(None)
+        while True:
+            plan: Optional[FailurePlan] = conn.recv()
+            if plan is None:
+                break
+            start = time.perf_counter()
+            success = fail_wrapper.attempt(
+                plan.fail_type, plan.fail_stage, plan.seed, plan.noise_range
+            )
+            ep_idx = None
+            if not success:
+                ep_idx = plan.ep_idx
+                if ep_idx is None:
+                    # Episodes are numbered across all sub-environments, so
+                    # the folders of the saved episodes never collide
+                    with episode_counter.get_lock():
+                        ep_idx = episode_counter.value
+                        episode_counter.value += 1
+                fail_wrapper.save_video(save=True, ep_idx=ep_idx)
+            else:
+                fail_wrapper.save_video(save=False)
+            conn.send(
+                AttemptResult(
+                    env_idx=env_idx,
+                    plan=plan,
+                    success=success,
+                    ep_idx=ep_idx,
+                    duration=time.perf_counter() - start,
+                    noise_sample=fail_wrapper.noise_sample,
+                )
+            )
+    except Exception:
+        conn.send(WorkerError(traceback.format_exc()))
+    finally:
+        if fail_wrapper is not None:
+            fail_wrapper.close()
+        conn.close()
+
+
+class BatchedFailgenWrapper:
+    """Runs failure generation on `num_envs` sub-environments in parallel
+
+    Each sub-environment runs its own attempt (with its own failure type,
+    stage, seed and noise draw), and saves or discards its episode as soon as
+    it finishes, independently of the others
+
+    Args:
+        task_name: the id of the task to generate failures for
+        num_envs: the number of sub-environments to run in parallel
+        headless: whether or not to run without the GUI
+        save_video: whether or not to record the frames of the episodes
+        save_path: the folder where to save the data (defaults to the one in
+            the config of the task)
+        seed: the first seed to use for the attempts, which also seeds the
+            noise of each sub-environment
+        first_ep_idx: the index to give to the first saved episode
+    """
+
+    def __init__(
+        self,
+        task_name: str,
+        num_envs: int,
+        headless: bool = True,
+        save_video: bool = True,
+        save_path: Optional[str] = None,
+        seed: int = 0,
+        first_ep_idx: int = 0,
+    ) -> None:
+        self._task_name = task_name
+        self._num_envs = num_envs
+        self._seed = seed
+
+        ctx = mp.get_context("spawn")
+        self._episode_counter = ctx.Value("i", first_ep_idx)
+        self._conns: List[Connection] = []
+        self._procs: List = []
+        run_name = time.strftime("%Y%m%d_%H%M%S")
+        for env_idx in range(num_envs):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(
+                target=run_worker,
+                args=(
+                    env_idx,
+                    task_name,
+                    headless,
+                    save_video,
+                    save_path,
+                    f"{run_name}_env{env_idx}",
+                    seed,
+                    self._episode_counter,
+                    child_conn,
+                ),
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+
+        # Wait until every sub-environment is ready
+        for conn in self._conns:
+            self._recv(conn)
+
+    @property
+    def num_envs(self) -> int:
+        return self._num_envs
+
+    @property
+    def num_saved_episodes(self) -> int:
+        """The next index of the episodes saved by plans without one, which
+        `collect` always numbers"""
+        return self._episode_counter.value
+
+    def next_seed(self) -> int:
+        seed = self._seed
+        self._seed += 1
+        return seed
+
+    def _recv(self, conn: Connection):
+        try:
+            msg = conn.recv()
+        except EOFError:
+            raise WorkerError("A sub-environment exited unexpectedly")
+        if isinstance(msg, WorkerError):
+            raise msg
+        return msg
+
+    def run(self, plans: Iterable[FailurePlan]) -> Iterator[AttemptResult]:
+        """Runs the plans on the sub-environments, yielding each result as
+        soon as its attempt finishes
+
+        The plans are pulled lazily, only when a sub-environment is free, so
+        the iterable can depend on the results received so far. It can yield
+        None when it has nothing to run until an attempt running finishes
+        """
+        plans_iter = iter(plans)
+        idle = list(self._conns)
+        busy: Dict[Connection, FailurePlan] = {}
+        exhausted = False
+        while True:
+            while idle and not exhausted:
+                try:
+                    plan = next(plans_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if plan is None:
+                    break
+                conn = idle.pop()
+                conn.send(plan)
+                busy[conn] = plan
+            if not busy:
+                return
+            for conn in wait(list(busy.keys())):
+                busy.pop(conn)
+                idle.append(conn)
+                yield self._recv(conn)
+
+    def collect(
+        self,
+        fail_types: Sequence[str],
+        stages: Optional[Dict[str, Sequence[int]]],
+        num_episodes: int,
+        max_tries: int = 10,
+        verbose: bool = True,
+        scheduler: Optional[SeedScheduler] = None,
+    ) -> Dict[Tuple[str, int], int]:
+        """Collects failures for every (fail_type, stage) pair at once
+
+        Like the data collection example, a pair is done after collecting
+        `num_episodes` failures, or after `max_tries` consecutive attempts
+        that didn't fail. The pairs are spread over the sub-environments, so
+        each one may run a different failure type and stage
+
+        Args:
+            fail_types: the failure types to collect
+            stages: the stages to collect for each failure type, defaults to
+                the stages of each failure in the config of the task
+            num_episodes: the number of failures to collect per pair
+            max_tries: the consecutive attempts that didn't fail after which
+                a pair is given up
+            verbose: whether or not to print the result of each attempt
+            scheduler: if given, the seeds of each pair come from it and every
+                attempt is recorded in its ledger, so that a new call with the
+                same ledger continues where this one stopped. The failures are
+                then saved with their seed as episode index. Otherwise they
+                are numbered from 1 for each pair, like
+                `FailgenWrapper.collect` does
+
+        Returns:
+            The number of failures collected for each (fail_type, stage),
+            including the ones of previous runs in the ledger of the scheduler
+        """
+        if stages is None:
+            stages = load_fail_stages(self._task_name)
+        units = [
+            (fail_type, stage)
+            for fail_type in fail_types
+            for stage in stages.get(fail_type, [])
+        ]
+        collected = {unit: 0 for unit in units}
+        tries = {unit: max_tries for unit in units}
+        in_flight = {unit: 0 for unit in units}
+        # The episode indices of each pair held by an attempt or a failure.
+        # An attempt takes the smallest one free, and gives it back if it
+        # doesn't fail, so the failures are numbered 1, 2, ... as if they
+        # were collected one after the other
+        taken_indices = {unit: set() for unit in units}
+        finished = set()
+        if scheduler is not None:
+            for unit in units:
+                stats = scheduler.stats((self._task_name, *unit))
+                collected[unit] = stats.failures
+                tries[unit] = max_tries - stats.consecutive_successes
+                if collected[unit] >= num_episodes or tries[unit] <= 0:
+                    finished.add(unit)
+
+        def plans() -> Iterator[Optional[FailurePlan]]:
+            while True:
+                pending = [unit for unit in units if unit not in finished]
+                if not pending:
+                    return
+                # No more attempts than the failures a unit still needs, the
+                # others would be thrown away
+                wanted = [
+                    unit
+                    for unit in pending
+                    if collected[unit] + in_flight[unit] < num_episodes
+                ]
+                if not wanted:
+                    # Wait for the attempts running, which are all for
+                    # pending units
+                    yield None
+                    continue
+                # Balance the sub-environments over the pending units
+                unit = min(wanted, key=lambda u: in_flight[u])
+                in_flight[unit] += 1
+                if scheduler is None:
+                    taken = taken_indices[unit]
+                    ep_idx = min(set(range(1, len(taken) + 2)) - taken)
+                    taken.add(ep_idx)
+                    yield FailurePlan(
+                        unit[0], unit[1], self.next_seed(), ep_idx=ep_idx
+                    )
+                else:
+                    key = (self._task_name, *unit)
+                    seed = scheduler.next_seed(key)
+                    yield FailurePlan(
+                        unit[0],
+                        unit[1],
+                        seed,
+                        ep_idx=seed,
+                        noise_range=scheduler.noise_range(key),
+                    )
+
+        for result in self.run(plans()):
+            unit = (result.plan.fail_type, result.plan.fail_stage)
+            in_flight[unit] -= 1
+            if scheduler is not None:
+                scheduler.record(
+                    AttemptRecord(
+                        self._task_name,
+                        *unit,
+                        seed=result.plan.seed,
+                        outcome=(
+                            OUTCOME_SUCCESS if result.success else OUTCOME_FAIL
+                        ),
+                        noise_bucket=noise_bucket(result.noise_sample),
+                    )
+                )
+            if not result.success:
+                collected[unit] += 1
+                tries[unit] = max_tries
+            else:
+                tries[unit] -= 1
+                if scheduler is None:
+                    taken_indices[unit].discard(result.plan.ep_idx)
+            if collected[unit] >= num_episodes or tries[unit] <= 0:
+                finished.add(unit)
+            if verbose:
+                print(
+                    f"env: {result.env_idx}, stage: {unit[1]}, "
+                    + f"success: {result.success}, fail_type: {unit[0]}, "
+                    + f"num_ep: {collected[unit]}, curr_tries: {tries[unit]}, "
+                    + f"time: {result.duration:.2f}s"
+                )
+        return collected
+
+    def close(self) -> None:
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self._procs:
+            proc.join()
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+        self._procs = []
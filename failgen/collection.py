@@ -0,0 +1,680 @@
+import argparse
+import multiprocessing as mp
+import os
+import time
+import traceback
+from dataclasses import dataclass, field
+from queue import Empty
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from failgen.batched_env_wrapper import load_fail_stages
+from failgen.scheduler import (
+    LEDGER_FILENAME,
+    OUTCOME_ERROR,
+    OUTCOME_FAIL,
+    OUTCOME_SUCCESS,
+    AttemptRecord,
+    Ledger,
+    OutcomeCache,
+    SeedScheduler,
+    UnitKey,
+    noise_bucket,
+)
+from failgen.task_config import load_task_config
+from failgen.utils.frame_pool import FrameEncodingService, SharedFramePool
+
+# How often the runner checks that the workers are alive while it waits for
+# their events, in seconds
+WORKER_POLL_INTERVAL = 5.0
+
+
+@dataclass(frozen=True)
+class WorkUnit:
+    """A range of seeds to attempt for one failure type and stage of a task"""
+
+    task_name: str
+    fail_type: str
+    fail_stage: int
+    seed_start: int
+    seed_stop: int
+
+    @property
+    def key(self) -> str:
+        return (
+            f"{self.task_name}/{self.fail_type}/{self.fail_stage}/"
+            + f"{self.seed_start}-{self.seed_stop}"
+        )
+
+    @property
+    def unit_key(self) -> UnitKey:
+        return (self.task_name, self.fail_type, self.fail_stage)
+
+    @property
+    def seeds(self) -> range:
+        return range(self.seed_start, self.seed_stop)
+
+
+@dataclass
+class UnitResult:
+    unit: WorkUnit
+    attempts: int
+    failures: int
+    duration: float
+    worker: int
+
+
+@dataclass
+class Progress:
+    attempts: int = 0
+    failures: int = 0
+    units_done: int = 0
+    units_total: int = 0
+    sim_time: float = 0.0
+    wasted_time: float = 0.0
+    """time spent on attempts that didn't fail, and were discarded"""
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.attempts if self.attempts > 0 else 0.0
+
+
+@dataclass
+class CollectionSummary:
+    progress: Dict[Tuple[str, str, int], Progress] = field(
+        default_factory=dict
+    )
+    skipped_units: int = 0
+    failed_units: List[WorkUnit] = field(default_factory=list)
+    wall_time: float = 0.0
+
+    @property
+    def failures(self) -> int:
+        return sum(p.failures for p in self.progress.values())
+
+    @property
+    def attempts(self) -> int:
+        return sum(p.attempts for p in self.progress.values())
+
+    def format_report(self) -> str:
+        """The failure yield and the wasted time of each configuration"""
+        lines = []
+        for key in sorted(self.progress.keys()):
+            progress = self.progress[key]
+            lines.append(
+                f"{key[0]} {key[1]} stage {key[2]}: {progress.failures}"
+                + f"/{progress.attempts} failed "
+                + f"({progress.failure_rate:.0%}), wasted "
+                + f"{progress.wasted_time:.1f}/{progress.sim_time:.1f} s"
+            )
+        return "\n".join(lines)
+
+
+def make_work_units(
+    task_names: Sequence[str],
+    fail_types: Optional[Sequence[str]] = None,
+    num_seeds: int = 100,
+    seeds_per_unit: int = 10,
+    first_seed: int = 0,
+) -> List[WorkUnit]:
+    """Shards the seeds of every (task, fail_type, stage) into work units
+
+    Args:
+        task_names: the tasks to collect failures for
+        fail_types: the failure types to collect, defaults to all the ones in
+            the config of each task
+        num_seeds: the number of seeds to attempt per (task, fail_type, stage)
+        seeds_per_unit: the number of seeds in each work unit
+        first_seed: the first seed of every (task, fail_type, stage)
+    """
+    units = []
+    for task_name in task_names:
+        stages = load_fail_stages(task_name)
+        for fail_type, fail_stages in stages.items():
+            if fail_types is not None and fail_type not in fail_types:
+                continue
+            for fail_stage in fail_stages:
+                for seed_start in range(
+                    first_seed, first_seed + num_seeds, seeds_per_unit
+                ):
+                    units.append(
+                        WorkUnit(
+                            task_name=task_name,
+                            fail_type=fail_type,
+                            fail_stage=fail_stage,
+                            seed_start=seed_start,
+                            seed_stop=min(
+                                seed_start + seeds_per_unit,
+                                first_seed + num_seeds,
+                            ),
+                        )
+                    )
+    return units
+
+
+def episode_index(unit: WorkUnit, seed: int) -> int:
+    # The seeds of a (task, fail_type, stage) are never repeated, so using
+    # them as the index of the saved episodes (whose folders are named
+    # `<ep_idx>_<fail_type>_<stage>`) keeps the outputs of workers apart, and
+    # re-running a unit overwrites its own outputs only
+    return seed
+
+
+def run_collection_worker(
+    worker_idx: int,
+    headless: bool,
+    save_video: bool,
+    save_path: Optional[str],
+    run_name: str,
+    seed: int,
+    max_failures_per_unit: Optional[int],
+    unit_queue,
+    event_queue,
+    frame_pool=None,
+    frame_jobs=None,
+    save_dataset: bool = False,
+) -> None:
+    np.random.seed(
+        np.random.SeedSequence([seed, worker_idx]).generate_state(1)[0]
+    )
+
+    from failgen.env_wrapper import FailgenWrapper
+
+    # One long-lived environment per task, reused by all the units of a task
+    wrappers: Dict[str, FailgenWrapper] = {}
+    # The environments built for each task, the ones rebuilt after an error
+    # record into new files since the recorder truncates the files it opens
+    num_builds: Dict[str, int] = {}
+    try:
+        while True:
+            task = unit_queue.get()
+            if task is None:
+                break
+            # The seeds of the unit that are left (with the noise range of
+            # each one), and the failures that were already collected with the
+            # others
+            unit, seeds, failures = task
+            event_queue.put(("start", worker_idx, unit, None))
+            start = time.perf_counter()
+            attempts = 0
+            seed = None
+            try:
+                if unit.task_name not in wrappers:
+                    build = num_builds.get(unit.task_name, 0)
+                    num_builds[unit.task_name] = build + 1
+                    trajectory_name = f"{run_name}_worker{worker_idx}"
+                    if build > 0:
+                        trajectory_name += f"_{build}"
+                    wrappers[unit.task_name] = FailgenWrapper(
+                        task_name=unit.task_name,
+                        headless=headless,
+                        save_video=save_video,
+                        save_path=save_path,
+                        trajectory_name=trajectory_name,
+                        frame_pool=frame_pool,
+                        frame_jobs=frame_jobs,
+                        save_dataset=save_dataset,
+                    )
+                fail_wrapper = wrappers[unit.task_name]
+                for seed, noise_range in seeds:
+                    if (
+                        max_failures_per_unit is not None
+                        and failures >= max_failures_per_unit
+                    ):
+                        break
+                    attempt_start = time.perf_counter()
+                    success = fail_wrapper.attempt(
+                        unit.fail_type, unit.fail_stage, seed, noise_range
+                    )
+                    attempts += 1
+                    if not success:
+                        failures += 1
+                        fail_wrapper.save_video(
+                            save=True, ep_idx=episode_index(unit, seed)
+                        )
+                    else:
+                        fail_wrapper.save_video(save=False)
+                    event_queue.put(
+                        (
+                            "attempt",
+                            worker_idx,
+                            unit,
+                            (
+                                seed,
+                                success,
+                                fail_wrapper.noise_sample,
+                                time.perf_counter() - attempt_start,
+                            ),
+                        )
+                    )
+                seed = None
+            except Exception:
+                # The environment may be left in a bad state, so rebuild it
+                broken = wrappers.pop(unit.task_name, None)
+                if broken is not None:
+                    try:
+                        broken.close()
+                    except Exception:
+                        pass
+                event_queue.put(
+                    (
+                        "error",
+                        worker_idx,
+                        unit,
+                        (seed, traceback.format_exc()),
+                    )
+                )
+                continue
+            event_queue.put(
+                (
+                    "done",
+                    worker_idx,
+                    unit,
+                    UnitResult(
+                        unit=unit,
+                        attempts=attempts,
+                        failures=failures,
+                        duration=time.perf_counter() - start,
+                        worker=worker_idx,
+                    ),
+                )
+            )
+    finally:
+        for fail_wrapper in wrappers.values():
+            fail_wrapper.close()
+        event_queue.put(("exit", worker_idx, None, None))
+
+
+class CollectionRunner:
+    """Runs work units of failure collection on a pool of processes
+
+    Every worker keeps a long-lived environment per task, and takes the next
+    unit from a shared queue once it's done with the previous one. The seed
+    ranges of the units don't overlap, and each unit is handed to a single
+    worker, so no seed is attempted twice. Attempts are reported back to the
+    main process, which records each of them in the ledger of the run
+    (`<save_path>/ledger.tsv`), so that a new run with the same save path
+    skips the units that are done and resumes the others at the first seed
+    without an outcome
+
+    Args:
+        num_workers: the number of worker processes
+        save_path: the folder where to save the data (defaults to the one in
+            the config of each task)
+        headless: whether or not to run without the GUI
+        save_video: whether or not to record the frames of the episodes
+        seed: seeds the noise of each worker
+        max_failures_per_unit: stop a unit after collecting this many
+            failures, if given
+        verbose: whether or not to print the result of each attempt
+        outcome_cache: a file with the outcomes of previous runs, if given
+            the seeds and noise ranges that failed before are tried first
+            (see `SeedScheduler`), and the attempts are added to it
+        shared_frame_slots: if positive, the workers write the frames of their
+            episodes into a pool of this many slots of shared memory, and a
+            separate process writes their images and videos, so the workers
+            go on with the next attempt right away. A worker that finds no
+            free slot encodes the episode itself
+        max_episode_frames: the frames that fit in a slot of the pool, longer
+            episodes are encoded by their worker
+        save_dataset: whether to also save the frames of each view and the
+            trajectories of the failures, to convert the collection with
+            `failgen.dataset`
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        save_path: str,
+        headless: bool = True,
+        save_video: bool = True,
+        seed: int = 0,
+        max_failures_per_unit: Optional[int] = None,
+        verbose: bool = False,
+        outcome_cache: Optional[str] = None,
+        shared_frame_slots: int = 0,
+        max_episode_frames: int = 300,
+        save_dataset: bool = False,
+    ) -> None:
+        self._num_workers = num_workers
+        self._save_path = save_path
+        self._headless = headless
+        self._save_video = save_video
+        self._seed = seed
+        self._max_failures_per_unit = max_failures_per_unit
+        self._verbose = verbose
+        self._outcome_cache = outcome_cache
+        self._shared_frame_slots = shared_frame_slots
+        self._max_episode_frames = max_episode_frames
+        self._save_dataset = save_dataset
+        self._ledger_path = os.path.join(save_path, LEDGER_FILENAME)
+
+    @property
+    def ledger_path(self) -> str:
+        return self._ledger_path
+
+    def is_unit_done(self, failures: int, seeds_left: int) -> bool:
+        if seeds_left == 0:
+            return True
+        return (
+            self._max_failures_per_unit is not None
+            and failures >= self._max_failures_per_unit
+        )
+
+    def run(self, units: Sequence[WorkUnit]) -> CollectionSummary:
+        """Runs the units that aren't done yet
+
+        The progress in the summary includes the attempts of the previous
+        runs found in the ledger
+        """
+        start = time.perf_counter()
+        summary = CollectionSummary()
+        cache = None
+        if self._outcome_cache is not None:
+            cache = OutcomeCache(self._outcome_cache)
+        scheduler = SeedScheduler(
+            Ledger(self._ledger_path), cache=cache, seed=self._seed
+        )
+        pending = []
+        for unit in units:
+            progress = summary.progress.setdefault(unit.unit_key, Progress())
+            progress.units_total += 1
+            stats = scheduler.stats(unit.unit_key, unit.seeds)
+            progress.attempts += stats.attempts
+            progress.failures += stats.failures
+            seeds = scheduler.remaining_seeds(unit.unit_key, unit.seeds)
+            if self.is_unit_done(stats.failures, len(seeds)):
+                progress.units_done += 1
+            else:
+                seeds = [
+                    (seed, scheduler.noise_range(unit.unit_key))
+                    for seed in seeds
+                ]
+                pending.append((unit, seeds, stats.failures))
+        summary.skipped_units = len(units) - len(pending)
+        if not pending:
+            scheduler.close()
+            return summary
+
+        ctx = mp.get_context("spawn")
+        unit_queue = ctx.Queue()
+        event_queue = ctx.Queue()
+        for task in pending:
+            unit_queue.put(task)
+        num_workers = min(self._num_workers, len(pending))
+        for _ in range(num_workers):
+            unit_queue.put(None)
+
+        frame_pool, encoder = None, None
+        if self._save_video and self._shared_frame_slots > 0:
+            frame_pool = self.make_frame_pool(
+                {unit.task_name for unit, _, _ in pending}, ctx
+            )
+            encoder = FrameEncodingService(frame_pool, ctx=ctx)
+
+        run_name = time.strftime("%Y%m%d_%H%M%S")
+        procs = [
+            ctx.Process(
+                target=run_collection_worker,
+                args=(
+                    worker_idx,
+                    self._headless,
+                    self._save_video,
+                    self._save_path,
+                    run_name,
+                    self._seed,
+                    self._max_failures_per_unit,
+                    unit_queue,
+                    event_queue,
+                    frame_pool,
+                    encoder.jobs if encoder is not None else None,
+                    self._save_dataset,
+                ),
+                daemon=True,
+            )
+            for worker_idx in range(num_workers)
+        ]
+        for proc in procs:
+            proc.start()
+
+        exited = set()
+        # The unit each worker is running
+        running: Dict[int, WorkUnit] = {}
+        try:
+            while len(exited) < num_workers:
+                try:
+                    kind, worker_idx, unit, payload = event_queue.get(
+                        timeout=WORKER_POLL_INTERVAL
+                    )
+                except Empty:
+                    self.check_workers(procs, exited, running, summary)
+                    continue
+                if kind == "exit":
+                    exited.add(worker_idx)
+                    continue
+                if kind == "start":
+                    running[worker_idx] = unit
+                    continue
+                progress = summary.progress[unit.unit_key]
+                if kind == "attempt":
+                    seed, success, noise_sample, duration = payload
+                    scheduler.record(
+                        AttemptRecord(
+                            *unit.unit_key,
+                            seed=seed,
+                            outcome=(
+                                OUTCOME_SUCCESS if success else OUTCOME_FAIL
+                            ),
+                            noise_bucket=noise_bucket(noise_sample),
+                        )
+                    )
+                    progress.attempts += 1
+                    progress.failures += int(not success)
+                    progress.sim_time += duration
+                    if success:
+                        progress.wasted_time += duration
+                    if self._verbose:
+                        print(
+                            f"[worker {worker_idx}] {unit.key}: seed: {seed}, "
+                            + f"success: {success}, "
+                            + f"failures: {progress.failures}"
+                            + f"/{progress.attempts}"
+                        )
+                elif kind == "done":
+                    running.pop(worker_idx, None)
+                    progress.units_done += 1
+                    self.print_progress(summary)
+                elif kind == "error":
+                    running.pop(worker_idx, None)
+                    seed, error = payload
+                    if seed is not None:
+                        # Logged for the record, but attempted again on resume
+                        scheduler.record(
+                            AttemptRecord(
+                                *unit.unit_key, seed=seed, outcome=OUTCOME_ERROR
+                            )
+                        )
+                    summary.failed_units.append(unit)
+                    print(f"[worker {worker_idx}] {unit.key} failed:\n{error}")
+            if cache is not None and self._verbose:
+                print(cache.format_report())
+        finally:
+            scheduler.close()
+
+        for proc in procs:
+            proc.join()
+        if encoder is not None:
+            # The workers are done, write the episodes still in the pool
+            encoder.close()
+            frame_pool.close()
+        summary.wall_time = time.perf_counter() - start
+        return summary
+
+    def check_workers(
+        self,
+        procs: List[mp.Process],
+        exited: set,
+        running: Dict[int, WorkUnit],
+        summary: CollectionSummary,
+    ) -> None:
+        """Marks the workers that died without reporting it (e.g. killed or
+        crashed in the simulator) as exited, and their unit as failed
+
+        A worker that exits cleanly reports it before exiting, so only the
+        ones with a non-zero exit code are looked at. Their unit is resumed
+        at its first seed without an outcome by the next run
+        """
+        for worker_idx, proc in enumerate(procs):
+            if worker_idx in exited or proc.is_alive():
+                continue
+            if proc.exitcode == 0:
+                # Its exit event is still in the queue
+                continue
+            exited.add(worker_idx)
+            unit = running.pop(worker_idx, None)
+            if unit is not None:
+                summary.failed_units.append(unit)
+            print(
+                f"[worker {worker_idx}] died with exit code {proc.exitcode}"
+                + (f" while running {unit.key}" if unit is not None else "")
+            )
+
+    def make_frame_pool(self, task_names, ctx):
+        image_sizes = {
+            load_task_config(task_name).image_size for task_name in task_names
+        }
+        if len(image_sizes) != 1:
+            raise ValueError(
+                "The tasks of a run with shared frames must have the same "
+                + f"image size, got {sorted(image_sizes)}"
+            )
+        width, height = image_sizes.pop()
+        return SharedFramePool.create(
+            num_slots=self._shared_frame_slots,
+            max_frames=self._max_episode_frames,
+            height=height,
+            width=width,
+            ctx=ctx,
+        )
+
+    def print_progress(self, summary: CollectionSummary) -> None:
+        units_done = sum(p.units_done for p in summary.progress.values())
+        units_total = sum(p.units_total for p in summary.progress.values())
+        print(
+            f"units: {units_done}/{units_total}, "
+            + f"failures: {summary.failures}/{summary.attempts} attempts"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-t",
+        "--task-names",
+        type=str,
+        nargs="+",
+        default=["FailPickCube-v1"],
+        help="The ids of the tasks to collect failures for",
+    )
+    parser.add_argument(
+        "--fail-types",
+        type=str,
+        nargs="+",
+        default=None,
+        help="The fail types to collect, all the ones in the config if empty",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="The number of worker processes",
+    )
+    parser.add_argument(
+        "--num-seeds",
+        type=int,
+        default=100,
+        help="The number of seeds to attempt per task, fail type and stage",
+    )
+    parser.add_argument(
+        "--seeds-per-unit",
+        type=int,
+        default=10,
+        help="The number of seeds each worker attempts in one work unit",
+    )
+    parser.add_argument(
+        "--save-path",
+        type=str,
+        required=True,
+        help="The folder where to save the data and the ledger of the run",
+    )
+    parser.add_argument(
+        "--save-video",
+        action="store_true",
+        help="Whether or not to record the frames of the failures",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Whether or not to print the result of every attempt",
+    )
+    parser.add_argument(
+        "--outcome-cache",
+        type=str,
+        default=None,
+        help="A file with the outcomes of previous runs, to try first the "
+        + "seeds and noise ranges that failed before",
+    )
+    parser.add_argument(
+        "--shared-frame-slots",
+        type=int,
+        default=0,
+        help="Pass the frames to a separate encoding process through this "
+        + "many slots of shared memory (0 to encode them in the workers)",
+    )
+    parser.add_argument(
+        "--max-episode-frames",
+        type=int,
+        default=300,
+        help="The number of frames that fit in a slot of shared memory",
+    )
+    parser.add_argument(
+        "--save-dataset",
+        action="store_true",
+        help="Also save the frames of each view and the trajectories of the "
+        + "failures, to convert them with failgen.dataset",
+    )
+
+    args = parser.parse_args()
+
+    units = make_work_units(
+        args.task_names,
+        fail_types=args.fail_types,
+        num_seeds=args.num_seeds,
+        seeds_per_unit=args.seeds_per_unit,
+    )
+    runner = CollectionRunner(
+        num_workers=args.num_workers,
+        save_path=args.save_path,
+        save_video=args.save_video,
+        verbose=args.verbose,
+        outcome_cache=args.outcome_cache,
+        shared_frame_slots=args.shared_frame_slots,
+        max_episode_frames=args.max_episode_frames,
+        save_dataset=args.save_dataset,
+    )
+    summary = runner.run(units)
+    print(
+        f"Collected {summary.failures} failures in {summary.attempts} "
+        + f"attempts ({summary.wall_time:.1f} s), skipped "
+        + f"{summary.skipped_units} units already done"
+    )
+    print(summary.format_report())
+    print(f"Ledger of the attempts: {runner.ledger_path}")
+    for unit in summary.failed_units:
+        print(f"Failed unit: {unit.key}")
+    return 0 if not summary.failed_units else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,526 @@
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from failgen.scheduler import (
+    LEDGER_FILENAME,
+    OUTCOME_ERROR,
+    OUTCOME_SUCCESS,
+    Ledger,
+    UnitKey,
+)
+from failgen.utils.image_sink import DEFAULT_NUM_WORKERS, IMAGE_FORMATS
+
+# The views saved by `RecordEpisode.flush_multi_images`, each in a folder of
+# the episode
+VIEW_NAMES = ("front", "side", "wrist")
+# The folders of the saved episodes, `<ep_idx>_<fail_type>_<fail_stage>`
+EPISODE_FOLDER_PATTERN = re.compile(r"^(\d+)_(.+)_(\d+)$")
+META_FILENAME = "meta.json"
+
+# The actions and success of a trajectory
+TrajectoryActions = Tuple[np.ndarray, bool]
+# The (fail_type, fail_stage, ep_idx) in the name of the folder of an episode
+EpisodeKey = Tuple[str, int, int]
+
+# The arrays of a dataset, each in a `<name>.npy` file
+ARRAYS = (
+    "frames",
+    "frame_offsets",
+    "actions",
+    "action_offsets",
+    "task",
+    "fail_type",
+    "fail_stage",
+    "success",
+    "episode_index",
+)
+
+
+@dataclass
+class EpisodeSource:
+    """A saved episode of a collection, and where to read its data from"""
+
+    task_name: str
+    fail_type: str
+    fail_stage: int
+    episode_index: int
+    """the index in the name of its folder, the seed of the episode when the
+    collection used a ledger"""
+
+    frame_paths: List[List[str]] = field(default_factory=list)
+    """the paths of the frames of each view, in order"""
+
+    actions: Optional[np.ndarray] = None
+    success: bool = False
+
+    @property
+    def key(self) -> UnitKey:
+        return (self.task_name, self.fail_type, self.fail_stage)
+
+    @property
+    def num_frames(self) -> int:
+        return min((len(paths) for paths in self.frame_paths), default=0)
+
+
+def frame_paths(view_folder: str) -> List[str]:
+    """The frames saved in a folder as `<index>.<format>`, in order"""
+    paths = []
+    for name in os.listdir(view_folder):
+        stem, ext = os.path.splitext(name)
+        if stem.isdigit() and ext[1:] in IMAGE_FORMATS:
+            paths.append((int(stem), os.path.join(view_folder, name)))
+    return [path for _, path in sorted(paths)]
+
+
+def load_ledger_outcomes(collection_dir: str) -> Dict[Tuple, bool]:
+    """The last outcome of every (task_name, fail_type, fail_stage, seed) in
+    the ledger of a collection, True if it succeeded"""
+    outcomes = {}
+    for record in Ledger(os.path.join(collection_dir, LEDGER_FILENAME)).load():
+        if record.outcome != OUTCOME_ERROR:
+            outcomes[(*record.key, record.seed)] = (
+                record.outcome == OUTCOME_SUCCESS
+            )
+    return outcomes
+
+
+def load_trajectory_actions(
+    task_dir: str,
+) -> Tuple[Dict[EpisodeKey, TrajectoryActions], Dict[int, TrajectoryActions]]:
+    """The actions and success of the trajectories saved in a task folder
+    (with `FailgenWrapper(save_dataset=True)`)
+
+    Returns:
+        The trajectories by the (fail_type, fail_stage, ep_idx) of the folder
+        of their episode, which `FailgenWrapper` saves with them, and the
+        ones saved without those by the seed of their episode. The seeds of
+        more than one trajectory are left out of the latter, since they
+        can't be told apart
+    """
+    import h5py
+
+    from failgen.utils.h5_storage import (
+        ChunkedTrajectoryStore,
+        is_chunked_storage,
+    )
+
+    by_episode: Dict[EpisodeKey, TrajectoryActions] = {}
+    by_seed: Dict[int, List[TrajectoryActions]] = {}
+    for json_path in glob.glob(os.path.join(task_dir, "*.json")):
+        h5_path = json_path[: -len(".json")] + ".h5"
+        if not os.path.exists(h5_path):
+            continue
+        with open(json_path, "r") as f:
+            episodes = json.load(f).get("episodes", [])
+        with h5py.File(h5_path, "r") as h5_file:
+            store = None
+            if is_chunked_storage(h5_file):
+                store = ChunkedTrajectoryStore(h5_file)
+            for episode in episodes:
+                episode_id = episode["episode_id"]
+                if store is not None:
+                    actions = None
+                    if "actions" in store.paths:
+                        actions = store.read_episode(episode_id, ["actions"])
+                        actions = actions.get("actions")
+                else:
+                    actions = h5_file[f"traj_{episode_id}"].get("actions")
+                if not isinstance(actions, (np.ndarray, h5py.Dataset)):
+                    # Dictionaries of actions are not supported
+                    continue
+                found = (
+                    np.asarray(actions, dtype=np.float32),
+                    bool(episode.get("success", False)),
+                )
+                if "ep_idx" in episode:
+                    key = (
+                        episode["fail_type"],
+                        int(episode["fail_stage"]),
+                        int(episode["ep_idx"]),
+                    )
+                    by_episode[key] = found
+                    continue
+                seed = episode.get("episode_seed")
+                if isinstance(seed, list):
+                    seed = seed[0] if len(seed) == 1 else None
+                if seed is not None:
+                    by_seed.setdefault(int(seed), []).append(found)
+    return by_episode, {
+        seed: found[0] for seed, found in by_seed.items() if len(found) == 1
+    }
+
+
+def scan_collection(
+    collection_dir: str, views: Sequence[str] = VIEW_NAMES
+) -> List[EpisodeSource]:
+    """Finds the saved episodes of a collection, i.e. the episode folders of
+    each task folder in `collection_dir` (the save path of the collection)
+
+    The success of an episode comes from its trajectory if it was saved, or
+    from the ledger of the collection otherwise. Without either the episode
+    is a failure, the only episodes the collections keep. The trajectories
+    saved without the failure of their episode are matched by seed, only
+    when the collection used a ledger (the folders are then named with the
+    seed of their episode)
+
+    Raises:
+        ValueError: if a task folder has trajectories saved with the failure
+            of their episode, but none of its episode folders matches them,
+            i.e. the episodes weren't saved in `<collection_dir>/<task>/`
+    """
+    outcomes = load_ledger_outcomes(collection_dir)
+    has_ledger = os.path.exists(os.path.join(collection_dir, LEDGER_FILENAME))
+    episodes = []
+    for task_name in sorted(os.listdir(collection_dir)):
+        task_dir = os.path.join(collection_dir, task_name)
+        if not os.path.isdir(task_dir):
+            continue
+        trajectories, seed_trajectories = load_trajectory_actions(task_dir)
+        matched = False
+        for name in sorted(os.listdir(task_dir)):
+            match = EPISODE_FOLDER_PATTERN.match(name)
+            episode_dir = os.path.join(task_dir, name)
+            if match is None or not os.path.isdir(episode_dir):
+                continue
+            episode = EpisodeSource(
+                task_name=task_name,
+                fail_type=match.group(2),
+                fail_stage=int(match.group(3)),
+                episode_index=int(match.group(1)),
+            )
+            view_dirs = [os.path.join(episode_dir, view) for view in views]
+            if all(os.path.isdir(view_dir) for view_dir in view_dirs):
+                episode.frame_paths = [frame_paths(d) for d in view_dirs]
+            episode.success = outcomes.get(
+                (*episode.key, episode.episode_index), False
+            )
+            key = (*episode.key[1:], episode.episode_index)
+            found = trajectories.get(key)
+            if found is not None:
+                matched = True
+            elif has_ledger:
+                found = seed_trajectories.get(episode.episode_index)
+            if found is not None:
+                episode.actions, episode.success = found
+            episodes.append(episode)
+        if trajectories and not matched:
+            fail_type, fail_stage, ep_idx = next(iter(trajectories))
+            raise ValueError(
+                f"None of the trajectories in {task_dir} matches an episode "
+                + f"folder in it, e.g. {ep_idx}_{fail_type}_{fail_stage}"
+            )
+    episodes.sort(key=lambda e: (*e.key, e.episode_index))
+    return episodes
+
+
+def decode_frame(path: str) -> np.ndarray:
+    if path.endswith(".npy"):
+        return np.load(path)
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def codes(values: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    """The distinct values, and the index of each value among them"""
+    names = sorted(set(values))
+    index = {name: i for i, name in enumerate(names)}
+    return names, np.array([index[v] for v in values], dtype=np.int16)
+
+
+def offsets_of(lengths: Sequence[int]) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def build_dataset(
+    collection_dir: str,
+    output_dir: str,
+    views: Sequence[str] = VIEW_NAMES,
+    num_workers: int = DEFAULT_NUM_WORKERS,
+    verbose: bool = False,
+) -> "FailureDataset":
+    """Converts the output of a collection into flat arrays that are read
+    memory-mapped by `FailureDataset`
+
+    The frames of every episode are decoded once, and stored one after the
+    other in `frames.npy`, a (num_frames, num_views, H, W, 3) uint8 array.
+    The frames of the `i`th episode are `frame_offsets[i]:frame_offsets[i+1]`,
+    and likewise for the actions with the action offsets. The labels of the
+    episodes are arrays with one entry each, and the names of the tasks and
+    failure types they index are in `meta.json`
+
+    Args:
+        collection_dir: the save path of the collection, with a folder per
+            task (and the ledger of the collection, if it used one)
+        output_dir: where to write the arrays of the dataset
+        views: the views whose frames are stored, the episodes that didn't
+            save the frames of all of them have no frames
+        num_workers: the number of threads decoding the frames
+        verbose: whether or not to print the progress
+    """
+    episodes = scan_collection(collection_dir, views)
+    if not episodes:
+        raise ValueError(f"No saved episodes found in {collection_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    with_frames = [e for e in episodes if e.num_frames > 0]
+    frame_shape = (0, 0, 3)
+    if with_frames:
+        frame_shape = decode_frame(with_frames[0].frame_paths[0][0]).shape
+    frame_offsets = offsets_of([e.num_frames for e in episodes])
+    num_frames = int(frame_offsets[-1])
+    frames_path = os.path.join(output_dir, "frames.npy")
+    if num_frames == 0:
+        np.save(
+            frames_path, np.zeros((0, len(views), *frame_shape), np.uint8)
+        )
+    else:
+        frames = np.lib.format.open_memmap(
+            frames_path,
+            mode="w+",
+            dtype=np.uint8,
+            shape=(num_frames, len(views), *frame_shape),
+        )
+
+        def write(job) -> None:
+            row, view, path = job
+            frames[row, view] = decode_frame(path)
+
+        with ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="failgen-dataset"
+        ) as executor:
+            for i, episode in enumerate(episodes):
+                start = frame_offsets[i]
+                jobs = [
+                    (start + t, v, view_paths[t])
+                    for v, view_paths in enumerate(episode.frame_paths)
+                    for t in range(episode.num_frames)
+                ]
+                # Decoding runs in PIL with the GIL released
+                list(executor.map(write, jobs))
+                if verbose:
+                    print(
+                        f"[{i + 1}/{len(episodes)}] {episode.task_name} "
+                        + f"{episode.fail_type} {episode.fail_stage} "
+                        + f"{episode.episode_index}: "
+                        + f"{episode.num_frames} frames"
+                    )
+        frames.flush()
+        del frames
+
+    actions = [e.actions for e in episodes if e.actions is not None]
+    action_shapes = {a.shape[1:] for a in actions}
+    if len(action_shapes) > 1:
+        raise ValueError(f"The actions have different shapes {action_shapes}")
+    action_shape = action_shapes.pop() if action_shapes else (0,)
+    lengths = [0 if e.actions is None else len(e.actions) for e in episodes]
+    np.save(
+        os.path.join(output_dir, "actions.npy"),
+        (
+            np.concatenate(actions)
+            if actions
+            else np.zeros((0, *action_shape), np.float32)
+        ),
+    )
+
+    task_names, task = codes([e.task_name for e in episodes])
+    fail_types, fail_type = codes([e.fail_type for e in episodes])
+    labels = dict(
+        frame_offsets=frame_offsets,
+        action_offsets=offsets_of(lengths),
+        task=task,
+        fail_type=fail_type,
+        fail_stage=np.array([e.fail_stage for e in episodes], np.int16),
+        success=np.array([e.success for e in episodes], bool),
+        episode_index=np.array([e.episode_index for e in episodes], np.int64),
+    )
+    for name, array in labels.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), array)
+    with open(os.path.join(output_dir, META_FILENAME), "w") as f:
+        json.dump(
+            dict(
+                views=list(views),
+                task_names=task_names,
+                fail_types=fail_types,
+                collection_dir=os.path.abspath(collection_dir),
+            ),
+            f,
+            indent=2,
+        )
+    return FailureDataset(output_dir)
+
+
+class FailureDataset:
+    """The episodes of a collection converted by `build_dataset`, read
+    through memory maps
+
+    Reading an episode slices the arrays, which only reads the pages of its
+    rows from the disk (or the page cache), without decoding any image
+
+    Args:
+        root: the folder with the arrays of the dataset
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        with open(os.path.join(root, META_FILENAME), "r") as f:
+            meta = json.load(f)
+        self.views: List[str] = meta["views"]
+        self.task_names: List[str] = meta["task_names"]
+        self.fail_types: List[str] = meta["fail_types"]
+        for name in ARRAYS:
+            path = os.path.join(root, f"{name}.npy")
+            setattr(self, name, np.load(path, mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.fail_type)
+
+    def num_frames(self, index: int) -> int:
+        return int(self.frame_offsets[index + 1] - self.frame_offsets[index])
+
+    def __getitem__(self, index: int) -> Dict:
+        """The episode, with its (T, num_views, H, W, 3) frames and (T', A)
+        actions as views of the memory maps"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Episode {index} out of {len(self)}")
+        frame_start, frame_stop = self.frame_offsets[index : index + 2]
+        action_start, action_stop = self.action_offsets[index : index + 2]
+        return dict(
+            frames=self.frames[frame_start:frame_stop],
+            actions=self.actions[action_start:action_stop],
+            task_name=self.task_names[self.task[index]],
+            fail_type=self.fail_types[self.fail_type[index]],
+            fail_stage=int(self.fail_stage[index]),
+            success=bool(self.success[index]),
+            episode_index=int(self.episode_index[index]),
+        )
+
+
+class FrameBatchSampler:
+    """Samples batches of clips of consecutive frames from the episodes of a
+    `FailureDataset`
+
+    An epoch goes once through the episodes that have enough frames, in a
+    random order, with a random clip of each. The frames of a batch are
+    gathered from the memory map in the order they are stored, so the reads
+    are as sequential as the batch allows
+
+    Args:
+        dataset: the dataset to sample from
+        batch_size: the number of clips in a batch
+        clip_length: the number of consecutive frames of each clip
+        drop_last: whether or not to drop the last batch if it's smaller
+        seed: seeds the order of the episodes and the clips
+    """
+
+    def __init__(
+        self,
+        dataset: FailureDataset,
+        batch_size: int,
+        clip_length: int = 1,
+        drop_last: bool = False,
+        seed: int = 0,
+    ) -> None:
+        assert batch_size > 0 and clip_length > 0
+        self._dataset = dataset
+        self._batch_size = batch_size
+        self._clip_length = clip_length
+        self._drop_last = drop_last
+        self._rng = np.random.default_rng(seed)
+        lengths = np.diff(np.asarray(dataset.frame_offsets))
+        self._episodes = np.flatnonzero(lengths >= clip_length)
+        self._lengths = lengths
+
+    def __len__(self) -> int:
+        if self._drop_last:
+            return len(self._episodes) // self._batch_size
+        return -(-len(self._episodes) // self._batch_size)
+
+    def sample(self, episodes: np.ndarray) -> Dict[str, np.ndarray]:
+        """A batch with a random clip of each episode"""
+        dataset = self._dataset
+        offsets = np.asarray(dataset.frame_offsets)
+        max_starts = self._lengths[episodes] - self._clip_length + 1
+        starts = offsets[episodes] + self._rng.integers(0, max_starts)
+        rows = starts[:, None] + np.arange(self._clip_length)
+        flat = rows.ravel()
+        order = np.argsort(flat, kind="stable")
+        frames = np.empty(
+            (len(flat),) + dataset.frames.shape[1:], dtype=dataset.frames.dtype
+        )
+        frames[order] = dataset.frames[flat[order]]
+        return dict(
+            frames=frames.reshape(rows.shape + dataset.frames.shape[1:]),
+            frame_index=rows - offsets[episodes][:, None],
+            episode=episodes,
+            task=np.asarray(dataset.task[episodes]),
+            fail_type=np.asarray(dataset.fail_type[episodes]),
+            fail_stage=np.asarray(dataset.fail_stage[episodes]),
+            success=np.asarray(dataset.success[episodes]),
+        )
+
+    def __iter__(self) -> Iterator[Dict[str, np.ndarray]]:
+        episodes = self._rng.permutation(self._episodes)
+        for start in range(0, len(episodes), self._batch_size):
+            batch = episodes[start : start + self._batch_size]
+            if self._drop_last and len(batch) < self._batch_size:
+                return
+            yield self.sample(batch)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--collection-dir",
+        type=str,
+        required=True,
+        help="The save path of the collection to convert",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        required=True,
+        help="The folder where to write the arrays of the dataset",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=DEFAULT_NUM_WORKERS,
+        help="The number of threads decoding the frames",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Whether or not to print every episode converted",
+    )
+
+    args = parser.parse_args()
+
+    dataset = build_dataset(
+        args.collection_dir,
+        args.output_dir,
+        num_workers=args.num_workers,
+        verbose=args.verbose,
+    )
+    print(
+        f"Converted {len(dataset)} episodes with {len(dataset.frames)} frames "
+        + f"of {len(dataset.views)} views, and {len(dataset.actions)} actions "
+        + f"into {args.output_dir}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,25 +1,47 @@
 import os
-from typing import List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import gymnasium as gym
 import numpy as np
-from omegaconf import DictConfig, OmegaConf
 
-from failgen.fail_planner_wrapper import FailPlannerWrapper
+from failgen.fail_planner_wrapper import (
+    EarlyTermination,
+    FailPlannerWrapper,
+    OutcomePredicate,
+    PlanCache,
+)
+from failgen.task_solutions.soln_peg_insertion_side import (
+    predict_outcome as predictPegInsertionSide,
+)
 from failgen.task_solutions.soln_peg_insertion_side import (
     solve as solvePegInsertionSide,
 )
+from failgen.task_solutions.soln_pick_cube import (
+    predict_outcome as predictPickCube,
+)
 from failgen.task_solutions.soln_pick_cube import solve as solvePickCube
+from failgen.task_solutions.soln_plug_charger import (
+    predict_outcome as predictPlugCharger,
+)
 from failgen.task_solutions.soln_plug_charger import solve as solvePlugCharger
 from failgen.task_solutions.soln_push_cube import solve as solvePushCube
+from failgen.task_solutions.soln_stack_cube import (
+    predict_outcome as predictStackCube,
+)
 from failgen.task_solutions.soln_stack_cube import solve as solveStackCube
+from failgen.scheduler import (
+    OUTCOME_FAIL,
+    OUTCOME_SUCCESS,
+    AttemptRecord,
+    SeedScheduler,
+    noise_bucket,
+)
+from failgen.task_config import load_task_config
+from failgen.utils.frame_pool import SharedFramePool
 from failgen.wrappers.record import RecordEpisode
 
 # from failgen.wrappers.time_limit import TimeLimit
 
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIGS_DIR = os.path.join(CURRENT_DIR, "configs")
-
 DEFAULT_TASK = "FailPickCube-v1"
 MP_SOLUTIONS = {
     "FailPegInsertionSide-v1": solvePegInsertionSide,
@@ -28,23 +50,63 @@ MP_SOLUTIONS = {
     "FailPushCube-v1": solvePushCube,
     "FailStackCube-v1": solveStackCube,
 }
+# Tell the attempts that can't succeed anymore after each stage, to stop them
+# early. The outcome of a push is only known once the cube has been pushed
+OUTCOME_PREDICATES: Dict[str, OutcomePredicate] = {
+    "FailPegInsertionSide-v1": predictPegInsertionSide,
+    "FailPickCube-v1": predictPickCube,
+    "FailPlugCharger-v1": predictPlugCharger,
+    "FailStackCube-v1": predictStackCube,
+}
 
 
 class FailgenWrapper:
+    """Collects the failures of a task in one environment
+
+    Args:
+        frame_pool: if given with `frame_jobs`, the frames of the episodes are
+            written into this shared pool, and their images and videos are
+            written by the `FrameEncodingService` that reads the jobs
+        save_dataset: whether to also save the frames of each view (with
+            `save_video`) and the trajectory of the failures, which
+            `failgen.dataset` converts. Only the image packs are saved
+            otherwise
+    """
+
     def __init__(
-        self, task_name: str, headless: bool, save_video: bool
+        self,
+        task_name: str,
+        headless: bool,
+        save_video: bool,
+        save_path: Optional[str] = None,
+        trajectory_name: Optional[str] = None,
+        frame_pool: Optional[SharedFramePool] = None,
+        frame_jobs=None,
+        save_dataset: bool = False,
     ) -> None:
         self._task_name = task_name
         self._headless = headless
         self._save_video = save_video
+        self._save_dataset = save_dataset
         self._solve_fn = MP_SOLUTIONS[task_name]
         self._seed = 0
 
-        self._config = OmegaConf.load(
-            os.path.join(CONFIGS_DIR, f"{task_name}.yaml")
+        self._config = load_task_config(task_name)
+        self._save_path = (
+            save_path if save_path is not None else self._config.save_path
         )
 
-        self._fail_plan_wrapper = FailPlannerWrapper(self._config)  # type: ignore
+        self._fail_plan_wrapper = FailPlannerWrapper(
+            self._config, task_name=task_name
+        )
+        if self._config.early_termination:
+            self._fail_plan_wrapper.set_outcome_predicate(
+                OUTCOME_PREDICATES.get(task_name)
+            )
+        if self._config.plan_cache_size > 0:
+            self._fail_plan_wrapper.set_plan_cache(
+                PlanCache(capacity=self._config.plan_cache_size)
+            )
 
         self._env = gym.make(
             task_name,
@@ -66,7 +128,8 @@ class FailgenWrapper:
 
         self._env = RecordEpisode(
             self._env,
-            output_dir=os.path.join(self._config.save_path, self._task_name),
+            output_dir=os.path.join(self._save_path, self._task_name),
+            trajectory_name=trajectory_name,
             save_video=self._save_video,
             video_fps=30,
             save_on_reset=False,
@@ -74,6 +137,10 @@ class FailgenWrapper:
                 width=self._config.image_size[0],
                 height=self._config.image_size[1],
             ),
+            # Only the frames of the episodes that are kept get rendered
+            defer_rendering=self._config.defer_rendering,
+            frame_pool=frame_pool,
+            frame_jobs=frame_jobs,
         )
 
     #    def on_timelimit_done(self):
@@ -82,13 +149,21 @@ class FailgenWrapper:
     #        self._seed += 1
 
     def get_failure(self) -> bool:
-        result = self._solve_fn(
-            self._env,
-            self._fail_plan_wrapper,
-            seed=self._seed,
-            debug=False,
-            vis=not self._headless,
-        )
+        self._fail_plan_wrapper.reset_noise_sample()
+        self._fail_plan_wrapper.seed_episode(self._seed)
+        try:
+            result = self._solve_fn(
+                self._env,
+                self._fail_plan_wrapper,
+                seed=self._seed,
+                debug=False,
+                vis=not self._headless,
+            )
+        except EarlyTermination as termination:
+            # The solution was cut short before closing its planner
+            self._fail_plan_wrapper.close()
+            self._seed += 1
+            return termination.success
         self._seed += 1
         if result is None:
             return True
@@ -98,20 +173,166 @@ class FailgenWrapper:
             return True
         return result[4]["success"]
 
+    def attempt(
+        self,
+        fail_type: str,
+        fail_stage: int,
+        seed: int,
+        noise_range: Optional[Tuple[float, float]] = None,
+    ) -> bool:
+        """Runs one episode with the given failure, returning its success
+
+        Args:
+            noise_range: the sub-range of [0, 1) to draw the random fraction
+                of the noise from, the whole range if None
+        """
+        self._fail_plan_wrapper.set_active_type(fail_type)
+        self._fail_plan_wrapper.set_active_stage(fail_stage)
+        self._fail_plan_wrapper.set_noise_range(*(noise_range or (0.0, 1.0)))
+        self._seed = seed
+        return self.get_failure()
+
+    def fail_stages(self) -> Dict[str, List[int]]:
+        """The stages of each failure type in the config of the task"""
+        return self._config.fail_stages()
+
+    def collect(
+        self,
+        fail_types: Sequence[str],
+        stages: Optional[Dict[str, Sequence[int]]] = None,
+        num_episodes: int = 10,
+        max_tries: int = 10,
+        verbose: bool = True,
+        scheduler: Optional[SeedScheduler] = None,
+    ) -> Dict[Tuple[str, int], int]:
+        """Collects failures for every (fail_type, stage) pair, one pair
+        after the other, all in this environment
+
+        Switching the failure type and stage of the planner wrapper is free,
+        so the environment is only created once for the whole plan. A pair is
+        done after collecting `num_episodes` failures, or after `max_tries`
+        consecutive attempts that didn't fail
+
+        Args:
+            fail_types: the failure types to collect
+            stages: the stages to collect for each failure type, defaults to
+                the stages of each failure in the config of the task
+            num_episodes: the number of failures to collect per pair
+            max_tries: the consecutive attempts that didn't fail after which
+                a pair is given up
+            verbose: whether or not to print the result of each attempt
+            scheduler: if given, the seeds of each pair come from it and every
+                attempt is recorded in its ledger, so that a new call with the
+                same ledger continues where this one stopped. The failures are
+                then saved with their seed as episode index. Without one, the
+                seeds of each failure type start at 0, and the failures of
+                each pair are numbered from 1
+
+        Returns:
+            The number of failures collected for each (fail_type, stage),
+            including the ones of previous runs in the ledger of the scheduler
+        """
+        if stages is None:
+            stages = self.fail_stages()
+        collected: Dict[Tuple[str, int], int] = {}
+        for fail_type in fail_types:
+            # Without a scheduler, the seeds of every failure type start at 0
+            # and go on across its stages, like with a wrapper per failure
+            # type
+            self._seed = 0
+            # Not every task has every failure type
+            for stage in stages.get(fail_type, []):
+                key = (self._task_name, fail_type, stage)
+                num_collected, tries = 0, max_tries
+                if scheduler is not None:
+                    stats = scheduler.stats(key)
+                    num_collected = stats.failures
+                    tries -= stats.consecutive_successes
+                while num_collected < num_episodes and tries > 0:
+                    if scheduler is not None:
+                        seed = scheduler.next_seed(key)
+                        success = self.attempt(
+                            fail_type, stage, seed, scheduler.noise_range(key)
+                        )
+                        scheduler.record(
+                            AttemptRecord(
+                                *key,
+                                seed=seed,
+                                outcome=(
+                                    OUTCOME_SUCCESS if success else OUTCOME_FAIL
+                                ),
+                                noise_bucket=noise_bucket(self.noise_sample),
+                            )
+                        )
+                        ep_idx = seed
+                    else:
+                        success = self.attempt(fail_type, stage, self._seed)
+                        # The failures of a pair are numbered from 1
+                        ep_idx = num_collected + 1
+                    if not success:
+                        num_collected += 1
+                        tries = max_tries
+                        self.save_video(save=True, ep_idx=ep_idx)
+                    else:
+                        tries -= 1
+                        self.save_video(save=False)
+                    if verbose:
+                        print(
+                            f"stage: {stage}, success: {success}, "
+                            + f"fail_type: {fail_type}, "
+                            + f"num_ep: {num_collected}, curr_tries: {tries}"
+                        )
+                collected[(fail_type, stage)] = num_collected
+        return collected
+
+    def render_episode(
+        self,
+        fail_type: str,
+        fail_stage: int,
+        seed: int,
+        noise_range: Optional[Tuple[float, float]] = None,
+        ep_idx: int = 0,
+    ) -> bool:
+        """Runs an episode of a collection again alone, and saves it whatever
+        its outcome. The episode is the same as long as the noise range is
+        the one it was run with (the whole range, or the range of the noise
+        bucket of its attempt when an outcome cache picked the ranges)"""
+        success = self.attempt(fail_type, fail_stage, seed, noise_range)
+        self.save_video(save=True, ep_idx=ep_idx)
+        return success
+
+    @property
+    def noise_sample(self) -> Optional[float]:
+        """The random fraction of the noise drawn in the last episode"""
+        return self._fail_plan_wrapper.noise_sample
+
+    @property
+    def plan_cache(self) -> Optional[PlanCache]:
+        """The cache of the screw motion plans, None if it's disabled"""
+        return self._fail_plan_wrapper.plan_cache
+
     def save_video(self, save: bool = True, ep_idx: int = 0) -> None:
-        self._env.flush_trajectory(save=False)
-        self._env.flush_video(
-            save=False, suffix=self._fail_plan_wrapper._active_fail.type
-        )
         fail_type = self._fail_plan_wrapper._active_fail.type
         fail_stage = self._fail_plan_wrapper._fail_stage
-        images_save_path = os.path.join(
-            self._config.save_path,
-            self._task_name,
-            f"{ep_idx}_{fail_type}_{fail_stage}",
+        # The trajectories are matched to the folders of their episodes with
+        # these
+        self._env.flush_trajectory(
+            save=save and self._save_dataset,
+            extra_info=dict(
+                fail_type=fail_type, fail_stage=fail_stage, ep_idx=ep_idx
+            ),
+        )
+        self._env.flush_video(save=False, suffix=fail_type)
+        # Relative to the output folder of the recorder, which is already
+        # `<save_path>/<task_name>`
+        images_save_path = f"{ep_idx}_{fail_type}_{fail_stage}"
+        self._env.flush_multi_images(
+            save=save and self._save_dataset, save_path=images_save_path
         )
-        self._env.flush_multi_images(save=False, save_path=images_save_path)
-        self._env.flush_multi_images_pack(save=True, save_path=images_save_path)
+        self._env.flush_multi_images_pack(save=save, save_path=images_save_path)
         self._env.flush_video_multi(
             save=False, suffix=f"{fail_type}_{fail_stage}"
         )
+
+    def close(self) -> None:
+        self._env.close()
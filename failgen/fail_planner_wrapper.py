@@ -1,14 +1,20 @@
+import time
+import zlib
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple, Union
 
 import numpy as np
 import sapien
-from omegaconf import DictConfig
 from transforms3d.euler import euler2quat, quat2euler
 
+from mani_skill.envs.sapien_env import BaseEnv
 from mani_skill.examples.motionplanning.panda.motionplanner import (
     PandaArmMotionPlanningSolver,
 )
+from mani_skill.utils.structs.pose import to_sapien_pose
+
+from failgen.task_config import TaskConfig
 
 DELTA_TRANS = {
     "trans_x": np.array([1.0, 0.0, 0.0]),
@@ -22,17 +28,343 @@ DELTA_ROT = {
     "rot_z": np.array([0.0, 0.0, 1.0]),
 }
 
+# The direction of the perturbation of each kind, in (x, y, z, roll, pitch,
+# yaw) of the target pose, and the offset of its random fraction of the noise
+# (the rotations are centered on zero)
+PERTURBATION_AXES: Dict[str, Tuple[np.ndarray, float]] = {
+    **{
+        name: (np.concatenate([delta, np.zeros(3)]), 0.0)
+        for name, delta in DELTA_TRANS.items()
+    },
+    **{
+        name: (np.concatenate([np.zeros(3), delta]), -0.5)
+        for name, delta in DELTA_ROT.items()
+    },
+}
+
+# Joins the kinds of a composite perturbation, e.g. "trans_x+rot_z"
+COMPOSITE_SEPARATOR = "+"
+
+
+def episode_rng(
+    task_name: str, fail_type: str, stage: int, seed: int
+) -> np.random.Generator:
+    """The generator of the random choices of an episode, which only depends
+    on the episode (the names are hashed with crc32, as the hash of strings
+    changes between processes)"""
+    return np.random.default_rng(
+        np.random.SeedSequence(
+            [
+                zlib.crc32(task_name.encode()),
+                zlib.crc32(fail_type.encode()),
+                int(stage),
+                int(seed),
+            ]
+        )
+    )
+
+
+# Decides the outcome of an attempt from the state of the env after a stage,
+# given (env, stage, fail_stage): False if it can't succeed anymore, True only
+# if nothing left in the attempt can change its success, and None otherwise
+OutcomePredicate = Callable[[BaseEnv, int, int], Optional[bool]]
+
+
+class EarlyTermination(Exception):
+    """Raised after a stage once the outcome of the attempt is decided"""
+
+    def __init__(self, success: bool, stage: int) -> None:
+        super().__init__(f"outcome decided after stage {stage}: {success}")
+        self.success = success
+        self.stage = stage
+
+
+# A plan of mplib (a dict with the joint trajectory), or -1 if planning failed
+Plan = Union[dict, int]
+# The exact start joint positions and target pose of a cached plan, and the
+# plan
+PlanEntry = Tuple[np.ndarray, np.ndarray, Plan]
+
+
+@dataclass
+class PlanCacheStats:
+    hits: int = 0
+    misses: int = 0
+    rejected: int = 0
+    """lookups that found a plan that failed validation"""
+
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+
+class PlanCache:
+    """LRU cache of the screw motion plans, keyed by task, stage, and the
+    quantized start joint positions and target pose
+
+    Screw plans only depend on the start joint positions and the target pose
+    (the solutions don't plan around obstacles), so the plans of the stages
+    that aren't perturbed are the same for every failure type and stage tried
+    with a seed. Before a cached plan is reused, its exact start and target
+    are checked to be within `tolerance` of the requested ones, which rejects
+    the plans of values that merely fall in the same quantization cell
+
+    Args:
+        capacity: the maximum number of plans to keep
+        qpos_resolution: the quantization step of the joint positions
+        pose_resolution: the quantization step of the target position and
+            quaternion
+        tolerance: the fraction of the resolutions within which a cached
+            plan is valid
+    """
+
+    def __init__(
+        self,
+        capacity: int = 256,
+        qpos_resolution: float = 1e-3,
+        pose_resolution: float = 1e-4,
+        tolerance: float = 0.5,
+    ) -> None:
+        self._capacity = capacity
+        self._qpos_resolution = qpos_resolution
+        self._pose_resolution = pose_resolution
+        self._tolerance = tolerance
+        self._plans: "OrderedDict[tuple, PlanEntry]" = OrderedDict()
+        self.stats = PlanCacheStats()
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def key(
+        self, task_name: str, stage: int, qpos: np.ndarray, target: np.ndarray
+    ) -> tuple:
+        return (
+            task_name,
+            stage,
+            tuple(np.round(qpos / self._qpos_resolution).astype(np.int64)),
+            tuple(np.round(target / self._pose_resolution).astype(np.int64)),
+        )
+
+    def get(
+        self, key: tuple, qpos: np.ndarray, target: np.ndarray
+    ) -> Optional[Plan]:
+        entry = self._plans.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        cached_qpos, cached_target, plan = entry
+        if (
+            np.abs(cached_qpos - qpos).max()
+            > self._tolerance * self._qpos_resolution
+            or np.abs(cached_target - target).max()
+            > self._tolerance * self._pose_resolution
+        ):
+            self.stats.rejected += 1
+            self.stats.misses += 1
+            return None
+        self._plans.move_to_end(key)
+        self.stats.hits += 1
+        return plan
+
+    def put(
+        self, key: tuple, qpos: np.ndarray, target: np.ndarray, plan: Plan
+    ) -> None:
+        self._plans[key] = (qpos.copy(), target.copy(), plan)
+        self._plans.move_to_end(key)
+        while len(self._plans) > self._capacity:
+            self._plans.popitem(last=False)
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        self._plans.clear()
+
+
+def _quat_conjugate(quat: np.ndarray) -> np.ndarray:
+    return quat * np.array([1.0, -1.0, -1.0, -1.0])
+
+
+def _quat_multiply(q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
+    """Hamilton product of (wxyz) quaternions, broadcast over the leading
+    dimensions"""
+    q1, q2 = np.broadcast_arrays(q1, q2)
+    w1, x1, y1, z1 = np.moveaxis(q1, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(q2, -1, 0)
+    return np.stack(
+        [
+            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+            w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+        ],
+        axis=-1,
+    )
+
+
+def _wrap_angle(angle: np.ndarray) -> np.ndarray:
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+@dataclass
+class PlannerSetupStats:
+    builds: int = 0
+    build_time: float = 0.0
+    resyncs: int = 0
+    resync_time: float = 0.0
+
+    @property
+    def mean_build_time(self) -> float:
+        return self.build_time / self.builds if self.builds > 0 else 0.0
+
+    @property
+    def mean_resync_time(self) -> float:
+        return self.resync_time / self.resyncs if self.resyncs > 0 else 0.0
+
+
+@dataclass
+class Perturbation:
+    """The perturbation of the target poses by a failure type, compiled from
+    its config into a matrix with a row per kind of perturbation, each with
+    its own random fraction of the noise"""
+
+    directions: np.ndarray
+    """(K, 6) directions of the kinds, scaled by the noise"""
+
+    offsets: np.ndarray
+    """(K,) offsets of the random fractions"""
+
+    @classmethod
+    def compile(cls, fail_type: str, noise: float) -> "Perturbation":
+        kinds = [
+            kind
+            for kind in fail_type.split(COMPOSITE_SEPARATOR)
+            if kind in PERTURBATION_AXES
+        ]
+        directions = np.zeros((len(kinds), 6))
+        offsets = np.zeros(len(kinds))
+        for i, kind in enumerate(kinds):
+            directions[i], offsets[i] = PERTURBATION_AXES[kind]
+        return cls(directions=noise * directions, offsets=offsets)
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.directions) == 0
+
+    @property
+    def rotates(self) -> bool:
+        return bool(np.any(self.directions[:, 3:]))
+
+    def sample(
+        self,
+        rng: np.random.Generator,
+        num_poses: int,
+        noise_range: Tuple[float, float] = (0.0, 1.0),
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Draws the deltas of a batch of poses
+
+        Returns:
+            The (num_poses, 6) deltas of the poses, and the (num_poses, K)
+            random fractions of the noise they were drawn with
+        """
+        fractions = rng.uniform(
+            *noise_range, size=(num_poses, len(self.offsets))
+        )
+        return (fractions + self.offsets) @ self.directions, fractions
+
+
+# The actions of the planner that a failure can act on
+ACTION_MOVE = "move"
+ACTION_GRIPPER = "gripper"
+
+
+class FailureEffect:
+    """What a failure does to the action of the planner at its stage"""
+
+
+class MoveEffect(FailureEffect):
+    def apply(
+        self, planner_wrapper: "FailPlannerWrapper", poses: List[sapien.Pose]
+    ) -> None:
+        """Changes the target poses of a move in place"""
+        raise NotImplementedError
+
+
+class GripperEffect(FailureEffect):
+    def apply(self, planner_wrapper: "FailPlannerWrapper") -> bool:
+        """Returns whether the gripper should still open or close"""
+        raise NotImplementedError
+
+
+@dataclass
+class PosePerturbation(MoveEffect):
+    perturbation: Perturbation
+
+    def apply(
+        self, planner_wrapper: "FailPlannerWrapper", poses: List[sapien.Pose]
+    ) -> None:
+        deltas = planner_wrapper.sample_deltas(self.perturbation, len(poses))
+        positions = np.stack([pose.p for pose in poses]) + deltas[:, :3]
+        for pose, position, delta in zip(poses, positions, deltas):
+            pose.p = position
+            if self.perturbation.rotates:
+                pose.rpy = pose.rpy + delta[3:]
+
+
+class SkipGripper(GripperEffect):
+    def apply(self, planner_wrapper: "FailPlannerWrapper") -> bool:
+        return False
+
+
+# Builds the effects of a kind of failure, by the action they act on, from
+# the kind and the noise of the failure
+FailureKindFactory = Callable[[str, float], Dict[str, FailureEffect]]
+
+FAILURE_KINDS: Dict[str, FailureKindFactory] = {}
+
+
+def register_failure_kind(name: str, factory: FailureKindFactory) -> None:
+    """Registers a new kind of failure, usable as a failure type in the
+    configs (alone, or as a part of a composite failure type)"""
+    FAILURE_KINDS[name] = factory
+
+
+def _skip_gripper(kind: str, noise: float) -> Dict[str, FailureEffect]:
+    return {ACTION_GRIPPER: SkipGripper()}
+
+
+register_failure_kind("grasp", _skip_gripper)
+
+
+def compile_failure_effects(
+    fail_type: str, noise: float
+) -> Dict[str, FailureEffect]:
+    """The effects of a failure type by action. The pose perturbations of a
+    composite type are merged into a single one, with a random fraction of
+    the noise per kind"""
+    kinds = fail_type.split(COMPOSITE_SEPARATOR)
+    effects: Dict[str, FailureEffect] = {}
+    for kind in kinds:
+        if kind in FAILURE_KINDS:
+            effects.update(FAILURE_KINDS[kind](kind, noise))
+    perturbation = Perturbation.compile(fail_type, noise)
+    if not perturbation.is_empty:
+        effects[ACTION_MOVE] = PosePerturbation(perturbation)
+    return effects
+
 
 @dataclass
 class Failure:
     type: str
     enabled: bool
-    stages: List[int]
+    stages: Tuple[int, ...]
+    stage_set: FrozenSet[int]
     rnd_stage: int
     noise: float
 
     def check_active(self, stage: int, stage_fail: str) -> bool:
-        if self.enabled and stage in self.stages and stage_fail == self.type:
+        if self.enabled and stage in self.stage_set and stage_fail == self.type:
             return True
         return False
 
@@ -42,67 +374,325 @@ class FailPlannerWrapper:
 
     _failures: Dict[str, Failure] = {}
 
-    _cfg: DictConfig
+    _cfg: TaskConfig
 
     _active_fail: Optional[Failure] = None
 
-    _stages: List[int] = []
+    _stages: np.ndarray = np.zeros(0, dtype=np.int64)
+
+    _noise_range: Tuple[float, float] = (0.0, 1.0)
+
+    _noise_sample: Optional[float] = None
+
+    _outcome_predicate: Optional[OutcomePredicate] = None
 
-    def __init__(self, cfg: DictConfig):
+    _plan_cache: Optional[PlanCache] = None
+
+    # The arguments the planner was built with, that can't be changed after
+    _planner_settings: Optional[tuple] = None
+
+    def __init__(self, cfg: TaskConfig, task_name: str = "", seed: int = 0):
         self._planner = None
-        self._cfg = cfg.copy()
+        self._planner_settings = None
+        self.setup_stats = PlannerSetupStats()
+        self._noise_range = (0.0, 1.0)
+        self._noise_sample = None
+        self._outcome_predicate = None
+        self._plan_cache = None
+        self._task_name = task_name
+        self._cfg = cfg
         self._failures = {}
-        self._stages = self._cfg.stages.copy()
-        self._fail_stage = np.random.choice(self._stages)
+        self._effects: Dict[str, Dict[str, FailureEffect]] = {}
+        # The effect of the active failure on each (stage, action)
+        self._dispatch: Dict[Tuple[int, str], FailureEffect] = {}
+        self._stages = self._cfg.stages
+        # The initial choices of failure stages, until an episode is seeded
+        self._rng = np.random.default_rng(
+            np.random.SeedSequence([zlib.crc32(task_name.encode()), seed])
+        )
+        self._fail_stage = int(self._rng.choice(self._stages))
 
-        for fail_cfg in self._cfg.failures:
+        for fail_cfg in self._cfg.failures.values():
             self._failures[fail_cfg.type] = Failure(
                 type=fail_cfg.type,
                 enabled=fail_cfg.enabled,
-                stages=fail_cfg.stages.copy(),
-                rnd_stage=np.random.choice(fail_cfg.stages),
-                noise=fail_cfg.noise if "noise" in fail_cfg else 0,
+                stages=tuple(fail_cfg.stages.tolist()),
+                stage_set=fail_cfg.stage_set,
+                rnd_stage=int(self._rng.choice(fail_cfg.stages)),
+                noise=fail_cfg.noise,
+            )
+            self._effects[fail_cfg.type] = compile_failure_effects(
+                fail_cfg.type, fail_cfg.noise
             )
             if fail_cfg.enabled:
                 self._active_fail = self._failures[fail_cfg.type]
+        self._rebuild_dispatch()
 
     @property
-    def stages(self) -> List[int]:
+    def stages(self) -> np.ndarray:
         return self._stages
 
     def wrap_planner(self, planner: PandaArmMotionPlanningSolver) -> None:
         self._planner = planner
 
+    def get_planner(
+        self,
+        env: BaseEnv,
+        debug: bool = False,
+        vis: bool = False,
+        visualize_target_grasp_pose: bool = False,
+        joint_vel_limits: float = 0.9,
+        joint_acc_limits: float = 0.9,
+    ) -> PandaArmMotionPlanningSolver:
+        """Wraps a planner for the episode the env was just reset to
+
+        The planner (which loads the robot model and sets up mplib) is only
+        built for the first episode, or when the robot or the arguments it's
+        built with change, and is re-synchronized to the new episode after
+        """
+        start = time.perf_counter()
+        base_env = env.unwrapped
+        settings = (
+            vis and visualize_target_grasp_pose,
+            joint_vel_limits,
+            joint_acc_limits,
+        )
+        planner = self._planner
+        if (
+            planner is None
+            or planner.robot is not base_env.agent.robot
+            or settings != self._planner_settings
+        ):
+            planner = PandaArmMotionPlanningSolver(
+                env,
+                debug=debug,
+                vis=vis,
+                base_pose=base_env.agent.robot.pose,
+                visualize_target_grasp_pose=visualize_target_grasp_pose,
+                print_env_info=False,
+                joint_vel_limits=joint_vel_limits,
+                joint_acc_limits=joint_acc_limits,
+            )
+            self._planner_settings = settings
+            self.setup_stats.builds += 1
+            self.setup_stats.build_time += time.perf_counter() - start
+        else:
+            self._resync_planner(planner, env, debug, vis)
+            self.setup_stats.resyncs += 1
+            self.setup_stats.resync_time += time.perf_counter() - start
+        self.wrap_planner(planner)
+        return planner
+
+    def _resync_planner(
+        self,
+        planner: PandaArmMotionPlanningSolver,
+        env: BaseEnv,
+        debug: bool,
+        vis: bool,
+    ) -> None:
+        base_env = env.unwrapped
+        planner.env = env
+        planner.debug = debug
+        planner.vis = vis
+        planner.control_mode = base_env.control_mode
+        planner.base_pose = to_sapien_pose(base_env.agent.robot.pose)
+        planner.planner.set_base_pose(
+            np.hstack([planner.base_pose.p, planner.base_pose.q])
+        )
+        # The joint positions are read from the robot when planning, the rest
+        # of the state of the planner is the one of a new planner
+        planner.gripper_state = planner.OPEN
+        planner.elapsed_steps = 0
+        planner.clear_collisions()
+        if planner.grasp_pose_visual is not None:
+            planner.grasp_pose_visual.set_pose(base_env.agent.tcp.pose)
+
     def set_active_type(self, fail_type: str) -> None:
         for f_type, f_obj in self._failures.items():
             f_obj.enabled = f_type == fail_type
             if f_type == fail_type:
                 self._active_fail = f_obj
+        self._rebuild_dispatch()
 
     def set_active_stage(self, fail_stage: int) -> None:
         self._fail_stage = fail_stage
+        self._rebuild_dispatch()
 
-    def open_gripper(self, stage: int):
+    def _rebuild_dispatch(self) -> None:
+        self._dispatch = {}
+        fail = self._active_fail
+        if fail is None or not fail.check_active(self._fail_stage, fail.type):
+            return
+        for action, effect in self._effects[fail.type].items():
+            self._dispatch[(self._fail_stage, action)] = effect
+
+    def set_noise_range(self, low: float = 0.0, high: float = 1.0) -> None:
+        """Restricts the random fraction of the noise that perturbs the poses
+        to [low, high), a sub-range of the default [0, 1)"""
+        self._noise_range = (low, high)
+
+    @property
+    def noise_sample(self) -> Optional[float]:
+        """The last random fraction of the noise, None if none was drawn
+        since the last call to `reset_noise_sample`"""
+        return self._noise_sample
+
+    def reset_noise_sample(self) -> None:
+        self._noise_sample = None
+
+    def seed_episode(self, seed: int) -> None:
+        """Seeds the random choices of the episode that's about to run from
+        the task, the active failure type and stage, and the seed, so that
+        it can be run again alone"""
+        fail_type = self._active_fail.type if self._active_fail else ""
+        self._rng = episode_rng(
+            self._task_name, fail_type, self._fail_stage, seed
+        )
+
+    def set_outcome_predicate(
+        self, predicate: Optional[OutcomePredicate]
+    ) -> None:
+        """Evaluates the predicate after each stage, raising EarlyTermination
+        to cut the attempt short once it decides the outcome"""
+        self._outcome_predicate = predicate
+
+    def set_plan_cache(self, plan_cache: Optional[PlanCache]) -> None:
+        """Reuses the plans of the screw motions kept in the cache"""
+        self._plan_cache = plan_cache
+
+    @property
+    def plan_cache(self) -> Optional[PlanCache]:
+        return self._plan_cache
+
+    def plan_screw(self, target_pose: sapien.Pose, stage: int) -> Plan:
+        """Plans a screw motion to the pose, or takes the plan from the cache"""
+        assert self._planner is not None
+        if self._plan_cache is None:
+            return self._planner.move_to_pose_with_screw(
+                target_pose, dry_run=True
+            )
+        target = np.concatenate([target_pose.p, target_pose.q])
+        qpos = self._planner.robot.get_qpos().cpu().numpy()[0]
+        key = self._plan_cache.key(self._task_name, stage, qpos, target)
+        plan = self._plan_cache.get(key, qpos, target)
+        if plan is None:
+            plan = self._planner.move_to_pose_with_screw(
+                target_pose, dry_run=True
+            )
+            self._plan_cache.put(key, qpos, target, plan)
+        return plan
+
+    def wrist_limit_mask(self, poses: List[sapien.Pose]) -> np.ndarray:
+        """Predicts which of the candidate poses of the TCP the wrist can turn
+        to, for all of them at once
+
+        The last joint of the arm turns the TCP about its z axis, so turning
+        the TCP to a candidate changes that joint by about the twist about z
+        of the rotation from the current orientation. This is a cheap guess,
+        not a feasibility check: the other joints also take part in a motion,
+        and the candidates it keeps may still fail to be planned
+
+        Returns:
+            A mask with the candidates that keep the wrist within its limits
+        """
+        assert self._planner is not None
+        rel = self._rotations_from_tcp(poses)
+        twist = _wrap_angle(2.0 * np.arctan2(rel[:, 3], rel[:, 0]))
+        wrist = self._planner.planner.move_group_joint_indices[-1]
+        low, high = self._planner.planner.joint_limits[wrist]
+        qpos = self._planner.robot.get_qpos().cpu().numpy()[0][wrist] + twist
+        return (qpos >= low) & (qpos <= high)
+
+    def find_feasible_pose(
+        self, poses: List[sapien.Pose], stage: int = 0
+    ) -> Tuple[np.ndarray, Optional[int]]:
+        """Finds the best candidate pose that the TCP can move to
+
+        The candidates are planned (a dry run, perturbed if `stage` is the
+        failing stage) one at a time until one succeeds, the ones that
+        `wrist_limit_mask` keeps first, each group from the smallest rotation
+        from the current orientation. The prediction only orders the
+        candidates, so the one returned is always planned, and a candidate
+        that the prediction rejects is still found if all the others fail
+
+        Returns:
+            The mask of the candidates that are planned or predicted to be
+            feasible (those that are not planned are predicted by
+            `wrist_limit_mask`), and the index of the best one, or None if
+            none is feasible
+        """
+        mask = self.wrist_limit_mask(poses)
+        rel = self._rotations_from_tcp(poses)
+        angles = 2.0 * np.arccos(np.clip(np.abs(rel[:, 0]), 0.0, 1.0))
+        order = np.lexsort((angles, ~mask))
+        for idx in order:
+            res = self.move_to_pose_with_screw(
+                poses[idx], dry_run=True, stage=stage
+            )
+            mask[idx] = not isinstance(res, int)
+            if mask[idx]:
+                return mask, int(idx)
+        return mask, None
+
+    def _rotations_from_tcp(self, poses: List[sapien.Pose]) -> np.ndarray:
+        """The rotations (in the frame of the TCP) from the current
+        orientation of the TCP to the ones of the poses, as quaternions"""
         assert self._planner is not None
-        should_fail = (
-            stage == self._fail_stage
-            and self._active_fail
-            and self._active_fail.check_active(stage, "grasp")
+        tcp_quat = np.asarray(
+            self._planner.base_env.agent.tcp.pose.sp.q, dtype=np.float64
         )
-        if not should_fail:
-            return self._planner.open_gripper()
-        return False
+        quats = np.stack(
+            [np.asarray(pose.q, dtype=np.float64) for pose in poses]
+        )
+        return _quat_multiply(_quat_conjugate(tcp_quat), quats)
 
-    def close_gripper(self, stage: int):
+    def check_outcome(self, stage: int) -> None:
+        if self._outcome_predicate is None:
+            return
         assert self._planner is not None
-        should_fail = (
-            stage == self._fail_stage
-            and self._active_fail
-            and self._active_fail.check_active(stage, "grasp")
+        outcome = self._outcome_predicate(
+            self._planner.env.unwrapped, stage, self._fail_stage
         )
-        if not should_fail:
-            return self._planner.close_gripper()
-        return False
+        if outcome is not None:
+            raise EarlyTermination(success=outcome, stage=stage)
+
+    def sample_deltas(
+        self, perturbation: Perturbation, num_poses: int
+    ) -> np.ndarray:
+        """Draws the deltas of a batch of poses from the generator of the
+        episode, within the noise range"""
+        deltas, fractions = perturbation.sample(
+            self._rng, num_poses, self._noise_range
+        )
+        self._noise_sample = float(fractions.mean())
+        return deltas
+
+    def perturb(self, poses: List[sapien.Pose], stage: int) -> None:
+        """Perturbs the poses in place if the active failure perturbs this
+        stage, drawing the deltas of the whole batch at once"""
+        effect = self._dispatch.get((stage, ACTION_MOVE))
+        if effect is not None:
+            effect.apply(self, poses)
+
+    def _should_actuate_gripper(self, stage: int) -> bool:
+        effect = self._dispatch.get((stage, ACTION_GRIPPER))
+        return effect is None or effect.apply(self)
+
+    def open_gripper(self, stage: int):
+        assert self._planner is not None
+        result = False
+        if self._should_actuate_gripper(stage):
+            result = self._planner.open_gripper()
+        self.check_outcome(stage)
+        return result
+
+    def close_gripper(self, stage: int):
+        assert self._planner is not None
+        result = False
+        if self._should_actuate_gripper(stage):
+            result = self._planner.close_gripper()
+        self.check_outcome(stage)
+        return result
 
     def move_to_pose_with_screw(
         self,
@@ -112,56 +702,21 @@ class FailPlannerWrapper:
         stage: int = 0,
     ):
         assert self._planner is not None
-        position_delta = np.zeros(target_pose.p.shape)
-        rotation_delta = np.zeros(target_pose.rpy.shape)
-        if self._active_fail is not None:
-            if stage == self._fail_stage and self._active_fail.check_active(
-                stage, "trans_x"
-            ):
-                position_delta = (
-                    self._active_fail.noise
-                    * np.random.rand()
-                    * DELTA_TRANS["trans_x"].reshape(target_pose.p.shape)
-                )
-            if stage == self._fail_stage and self._active_fail.check_active(
-                stage, "trans_y"
-            ):
-                position_delta = (
-                    self._active_fail.noise
-                    * np.random.rand()
-                    * DELTA_TRANS["trans_y"].reshape(target_pose.p.shape)
-                )
-            if stage == self._fail_stage and self._active_fail.check_active(stage, "trans_z"):
-                position_delta = (
-                    self._active_fail.noise
-                    * np.random.rand()
-                    * DELTA_TRANS["trans_z"].reshape(target_pose.p.shape)
-                )
-            target_pose.p = target_pose.p + position_delta
+        self.perturb([target_pose], stage)
 
-            if stage == self._fail_stage and self._active_fail.check_active(stage, "rot_x"):
-                rotation_delta = (
-                    self._active_fail.noise
-                    * (np.random.rand() - 0.5)
-                    * DELTA_ROT["rot_x"].reshape(target_pose.rpy.shape)
-                )
-            if stage == self._fail_stage and self._active_fail.check_active(stage, "rot_y"):
-                rotation_delta = (
-                    self._active_fail.noise
-                    * (np.random.rand() - 0.5)
-                    * DELTA_ROT["rot_y"].reshape(target_pose.rpy.shape)
-                )
-            if stage == self._fail_stage and self._active_fail.check_active(stage, "rot_z"):
-                rotation_delta = (
-                    self._active_fail.noise
-                    * (np.random.rand() - 0.5)
-                    * DELTA_ROT["rot_z"].reshape(target_pose.rpy.shape)
+        if self._plan_cache is None:
+            result = self._planner.move_to_pose_with_screw(
+                target_pose, dry_run=dry_run, refine_steps=refine_steps
+            )
+        else:
+            result = self.plan_screw(target_pose, stage)
+            if not dry_run and not isinstance(result, int):
+                result = self._planner.follow_path(
+                    result, refine_steps=refine_steps
                 )
-            target_pose.rpy = target_pose.rpy + rotation_delta
-
-        return self._planner.move_to_pose_with_screw(
-            target_pose, dry_run=dry_run, refine_steps=refine_steps
-        )
+        if not dry_run:
+            self.check_outcome(stage)
+        return result
 
     def close(self) -> None:
         assert self._planner is not None
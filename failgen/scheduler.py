@@ -0,0 +1,401 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_FAIL = "fail"
+OUTCOME_ERROR = "error"
+OUTCOMES = (OUTCOME_SUCCESS, OUTCOME_FAIL, OUTCOME_ERROR)
+
+LEDGER_FILENAME = "ledger.tsv"
+
+# The random fraction of the noise (in [0, 1)) is binned in this many buckets
+NUM_NOISE_BUCKETS = 10
+NO_NOISE_BUCKET = -1
+
+# (task_name, fail_type, fail_stage)
+UnitKey = Tuple[str, str, int]
+
+
+def noise_bucket(
+    sample: Optional[float], num_buckets: int = NUM_NOISE_BUCKETS
+) -> int:
+    if sample is None:
+        return NO_NOISE_BUCKET
+    return min(max(int(sample * num_buckets), 0), num_buckets - 1)
+
+
+def bucket_range(
+    bucket: int, num_buckets: int = NUM_NOISE_BUCKETS
+) -> Tuple[float, float]:
+    return (bucket / num_buckets, (bucket + 1) / num_buckets)
+
+
+@dataclass(frozen=True)
+class AttemptRecord:
+    task_name: str
+    fail_type: str
+    fail_stage: int
+    seed: int
+    outcome: str
+    noise_bucket: int = NO_NOISE_BUCKET
+
+    @property
+    def key(self) -> UnitKey:
+        return (self.task_name, self.fail_type, self.fail_stage)
+
+    def to_line(self) -> str:
+        return (
+            f"{self.task_name}\t{self.fail_type}\t{self.fail_stage}\t"
+            + f"{self.seed}\t{self.outcome}\t{self.noise_bucket}\n"
+        )
+
+    @staticmethod
+    def from_line(line: str) -> Optional["AttemptRecord"]:
+        fields = line.rstrip("\n").split("\t")
+        if not line.endswith("\n") or len(fields) not in (5, 6):
+            # the last line may have been cut short by a crash
+            return None
+        task_name, fail_type, fail_stage, seed, outcome = fields[:5]
+        if outcome not in OUTCOMES:
+            return None
+        bucket = int(fields[5]) if len(fields) == 6 else NO_NOISE_BUCKET
+        return AttemptRecord(
+            task_name, fail_type, int(fail_stage), int(seed), outcome, bucket
+        )
+
+
+class Ledger:
+    """Append-only log of every attempt, one tab-separated line each:
+    `<task_name> <fail_type> <fail_stage> <seed> <outcome> <noise_bucket>`
+
+    Args:
+        path: the path of the ledger file, created if it doesn't exist
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._file = None
+
+    def load(self) -> List[AttemptRecord]:
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r") as f:
+            for line in f:
+                record = AttemptRecord.from_line(line)
+                if record is not None:
+                    records.append(record)
+        return records
+
+    def append(self, record: AttemptRecord) -> None:
+        if self._file is None:
+            self._truncate_partial_line()
+            self._file = open(self.path, "a")
+        self._file.write(record.to_line())
+        self._file.flush()
+
+    def _truncate_partial_line(self) -> None:
+        # Drop a line left incomplete by a crash, so new records start on a
+        # line of their own
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+@dataclass
+class YieldStats:
+    attempts: int = 0
+    failures: int = 0
+
+    @property
+    def failure_yield(self) -> float:
+        return self.failures / self.attempts if self.attempts > 0 else 0.0
+
+    def add(self, failed: bool) -> None:
+        self.attempts += 1
+        self.failures += int(failed)
+
+
+class OutcomeCache:
+    """Outcomes of past attempts per (task, fail_type, stage), by seed and by
+    noise bucket, used to tell which seeds and noise ranges yield failures
+
+    Unlike the ledger of a run, the cache is meant to be shared by runs (e.g.
+    with different save paths or numbers of episodes), and is kept in a file
+    with the same format as the ledger
+
+    Args:
+        path: the file to load and persist the outcomes in. If None, the
+            cache only lives in memory
+        num_buckets: the number of noise buckets
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, num_buckets: int = NUM_NOISE_BUCKETS
+    ) -> None:
+        self._ledger = Ledger(path) if path is not None else None
+        self._num_buckets = num_buckets
+        self._seeds: Dict[UnitKey, Dict[int, YieldStats]] = {}
+        self._buckets: Dict[UnitKey, Dict[int, YieldStats]] = {}
+        if self._ledger is not None:
+            for record in self._ledger.load():
+                self.add(record, persist=False)
+
+    @property
+    def num_buckets(self) -> int:
+        return self._num_buckets
+
+    def add(self, record: AttemptRecord, persist: bool = True) -> None:
+        if record.outcome == OUTCOME_ERROR:
+            return
+        failed = record.outcome == OUTCOME_FAIL
+        seeds = self._seeds.setdefault(record.key, {})
+        seeds.setdefault(record.seed, YieldStats()).add(failed)
+        buckets = self._buckets.setdefault(record.key, {})
+        buckets.setdefault(record.noise_bucket, YieldStats()).add(failed)
+        if persist and self._ledger is not None:
+            self._ledger.append(record)
+
+    def seed_stats(self, key: UnitKey, seed: int) -> YieldStats:
+        return self._seeds.get(key, {}).get(seed, YieldStats())
+
+    def bucket_stats(self, key: UnitKey) -> Dict[int, YieldStats]:
+        return dict(self._buckets.get(key, {}))
+
+    def failed_seeds(self, key: UnitKey) -> List[int]:
+        """The seeds that failed at least once, the most failing ones first"""
+        seeds = self._seeds.get(key, {})
+        failed = [seed for seed, stats in seeds.items() if stats.failures > 0]
+        return sorted(
+            failed,
+            key=lambda seed: (-seeds[seed].failure_yield, seed),
+        )
+
+    def never_fails(self, key: UnitKey, seed: int, min_attempts: int) -> bool:
+        stats = self.seed_stats(key, seed)
+        return stats.attempts >= min_attempts and stats.failures == 0
+
+    def yield_report(self) -> List[Tuple[UnitKey, int, YieldStats]]:
+        """The failure yield of every (task, fail_type, stage) and bucket"""
+        return [
+            (key, bucket, self._buckets[key][bucket])
+            for key in sorted(self._buckets.keys())
+            for bucket in sorted(self._buckets[key].keys())
+        ]
+
+    def format_report(self) -> str:
+        lines = []
+        for key in sorted(self._buckets.keys()):
+            buckets = self._buckets[key]
+            total = YieldStats(
+                attempts=sum(b.attempts for b in buckets.values()),
+                failures=sum(b.failures for b in buckets.values()),
+            )
+            lines.append(
+                f"{key[0]} {key[1]} stage {key[2]}: {total.failures}"
+                + f"/{total.attempts} failed ({total.failure_yield:.0%})"
+            )
+            for bucket in sorted(buckets.keys()):
+                if bucket == NO_NOISE_BUCKET:
+                    continue
+                low, high = bucket_range(bucket, self._num_buckets)
+                stats = buckets[bucket]
+                lines.append(
+                    f"    noise [{low:.2f}, {high:.2f}): {stats.failures}"
+                    + f"/{stats.attempts} failed ({stats.failure_yield:.0%})"
+                )
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        if self._ledger is not None:
+            self._ledger.close()
+
+
+@dataclass
+class UnitStats:
+    attempts: int = 0
+    failures: int = 0
+    consecutive_successes: int = 0
+    """successful attempts since the last failure, in seed order"""
+
+
+class SeedScheduler:
+    """Hands out the seeds to attempt for each (task, fail_type, stage), and
+    records the outcome of every attempt in a ledger
+
+    Seeds are given out in increasing order starting at `first_seed`, skipping
+    the ones that already have an outcome in the ledger, so a restarted run
+    continues exactly where the previous one stopped (attempts that were in
+    flight, or that raised an error, are attempted again). The scheduler is
+    the single owner of the seeds, so as long as all workers get their seeds
+    from it, no seed is ever attempted twice
+
+    Given an outcome cache, the seeds that failed before are handed out
+    first, the ones that didn't fail in `skip_after` attempts are skipped, and
+    the noise ranges are picked by Thompson sampling over the failure yield of
+    each noise bucket, so the simulation time goes to the attempts that are
+    the most likely to fail
+
+    Args:
+        ledger: the ledger to resume from and to record the attempts in
+        first_seed: the first seed of every (task, fail_type, stage)
+        cache: the outcomes of past runs to prioritize the seeds and noise
+            ranges with, if given. The attempts are also recorded in it
+        skip_after: the attempts without a failure after which a seed of the
+            cache is skipped
+        seed: seeds the choice of the noise ranges
+    """
+
+    def __init__(
+        self,
+        ledger: Ledger,
+        first_seed: int = 0,
+        cache: Optional[OutcomeCache] = None,
+        skip_after: int = 2,
+        seed: int = 0,
+    ) -> None:
+        self._ledger = ledger
+        self._first_seed = first_seed
+        self._cache = cache
+        self._skip_after = skip_after
+        self._rng = np.random.default_rng(seed)
+        self._outcomes: Dict[UnitKey, Dict[int, str]] = {}
+        self._reserved: Dict[UnitKey, Set[int]] = {}
+        self._cursors: Dict[UnitKey, int] = {}
+        for record in ledger.load():
+            self._outcomes.setdefault(record.key, {})[record.seed] = (
+                record.outcome
+            )
+
+    @property
+    def ledger(self) -> Ledger:
+        return self._ledger
+
+    @property
+    def cache(self) -> Optional[OutcomeCache]:
+        return self._cache
+
+    def is_done(self, key: UnitKey, seed: int) -> bool:
+        outcome = self._outcomes.get(key, {}).get(seed)
+        return outcome is not None and outcome != OUTCOME_ERROR
+
+    def is_skipped(self, key: UnitKey, seed: int) -> bool:
+        return self._cache is not None and self._cache.never_fails(
+            key, seed, self._skip_after
+        )
+
+    def next_seed(self, key: UnitKey) -> int:
+        """Returns the next seed of the unit that is neither done nor handed
+        out already, and reserves it
+
+        That's the smallest one, unless the cache has seeds that failed before
+        """
+        reserved = self._reserved.setdefault(key, set())
+        if self._cache is not None:
+            for seed in self._cache.failed_seeds(key):
+                if seed < self._first_seed:
+                    continue
+                if not self.is_done(key, seed) and seed not in reserved:
+                    reserved.add(seed)
+                    return seed
+        seed = self._cursors.get(key, self._first_seed)
+        while (
+            self.is_done(key, seed)
+            or seed in reserved
+            or self.is_skipped(key, seed)
+        ):
+            seed += 1
+        reserved.add(seed)
+        self._cursors[key] = seed + 1
+        return seed
+
+    def remaining_seeds(self, key: UnitKey, seeds: Iterable[int]) -> List[int]:
+        """Reserves and returns the given seeds that are not done yet, in the
+        order to attempt them"""
+        reserved = self._reserved.setdefault(key, set())
+        remaining = [
+            seed
+            for seed in seeds
+            if not self.is_done(key, seed)
+            and seed not in reserved
+            and not self.is_skipped(key, seed)
+        ]
+        reserved.update(remaining)
+        if self._cache is not None:
+            cache = self._cache
+            remaining.sort(
+                key=lambda seed: -cache.seed_stats(key, seed).failure_yield
+            )
+        return remaining
+
+    def noise_range(self, key: UnitKey) -> Optional[Tuple[float, float]]:
+        """Picks the noise range of the next attempt of the unit, None (the
+        whole range) without a cache"""
+        if self._cache is None:
+            return None
+        buckets = self._cache.bucket_stats(key)
+        num_buckets = self._cache.num_buckets
+        scores = []
+        for bucket in range(num_buckets):
+            stats = buckets.get(bucket, YieldStats())
+            scores.append(
+                self._rng.beta(
+                    stats.failures + 1, stats.attempts - stats.failures + 1
+                )
+            )
+        return bucket_range(int(np.argmax(scores)), num_buckets)
+
+    def record(self, record: AttemptRecord) -> None:
+        self._ledger.append(record)
+        self._outcomes.setdefault(record.key, {})[record.seed] = record.outcome
+        self.release(record.key, record.seed)
+        if self._cache is not None:
+            self._cache.add(record)
+
+    def release(self, key: UnitKey, seed: int) -> None:
+        """Gives a reserved seed back, e.g. when its attempt couldn't run"""
+        self._reserved.get(key, set()).discard(seed)
+        if seed < self._cursors.get(key, self._first_seed):
+            if not self.is_done(key, seed):
+                self._cursors[key] = seed
+
+    def stats(
+        self, key: UnitKey, seeds: Optional[Iterable[int]] = None
+    ) -> UnitStats:
+        """Summarizes the attempts of a unit, optionally only of some seeds"""
+        outcomes = self._outcomes.get(key, {})
+        if seeds is not None:
+            seeds = set(seeds)
+        stats = UnitStats()
+        for seed in sorted(outcomes.keys()):
+            if seeds is not None and seed not in seeds:
+                continue
+            outcome = outcomes[seed]
+            if outcome == OUTCOME_ERROR:
+                continue
+            stats.attempts += 1
+            if outcome == OUTCOME_FAIL:
+                stats.failures += 1
+                stats.consecutive_successes = 0
+            else:
+                stats.consecutive_successes += 1
+        return stats
+
+    def close(self) -> None:
+        self._ledger.close()
+        if self._cache is not None:
+            self._cache.close()
@@ -0,0 +1,115 @@
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Mapping, Tuple
+
+import numpy as np
+from omegaconf import OmegaConf
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIGS_DIR = os.path.join(CURRENT_DIR, "configs")
+
+
+@dataclass(frozen=True)
+class FailureConfig:
+    __slots__ = ("type", "enabled", "stages", "stage_set", "noise")
+
+    type: str
+    enabled: bool
+    stages: np.ndarray
+    stage_set: FrozenSet[int]
+    """the stages again, for the membership checks of `Failure.check_active`"""
+
+    noise: float
+
+
+@dataclass(frozen=True)
+class TaskConfig:
+    """The config of a task, compiled from its yaml file into plain values,
+    so that reading it doesn't go through OmegaConf"""
+
+    __slots__ = (
+        "save_path",
+        "obs_mode",
+        "render_mode",
+        "defer_rendering",
+        "early_termination",
+        "plan_cache_size",
+        "shader",
+        "sim_backend",
+        "image_size",
+        "stages",
+        "failures",
+    )
+
+    save_path: str
+    obs_mode: str
+    render_mode: str
+    defer_rendering: bool
+    early_termination: bool
+    plan_cache_size: int
+    shader: str
+    sim_backend: str
+    image_size: Tuple[int, int]
+    stages: np.ndarray
+    failures: Mapping[str, FailureConfig]
+    """the failures by type, in the order of the yaml file"""
+
+    def fail_stages(self) -> Dict[str, List[int]]:
+        """The stages of each failure type"""
+        return {
+            fail_type: failure.stages.tolist()
+            for fail_type, failure in self.failures.items()
+        }
+
+
+def _readonly_array(values) -> np.ndarray:
+    array = np.array(values, dtype=np.int64)
+    array.setflags(write=False)
+    return array
+
+
+def compile_task_config(path: str) -> TaskConfig:
+    """Loads and compiles a config file, resolving its interpolations"""
+    raw = OmegaConf.to_container(OmegaConf.load(path), resolve=True)
+    assert isinstance(raw, dict)
+    failures = {}
+    for fail_raw in raw["failures"]:
+        failures[fail_raw["type"]] = FailureConfig(
+            type=fail_raw["type"],
+            enabled=bool(fail_raw["enabled"]),
+            stages=_readonly_array(fail_raw["stages"]),
+            stage_set=frozenset(int(stage) for stage in fail_raw["stages"]),
+            noise=float(fail_raw.get("noise", 0.0)),
+        )
+    return TaskConfig(
+        save_path=raw["save_path"],
+        obs_mode=raw["obs_mode"],
+        render_mode=raw["render_mode"],
+        defer_rendering=bool(raw.get("defer_rendering", False)),
+        early_termination=bool(raw.get("early_termination", False)),
+        plan_cache_size=int(raw.get("plan_cache_size", 0)),
+        shader=raw["shader"],
+        sim_backend=raw["sim_backend"],
+        image_size=(int(raw["image_size"][0]), int(raw["image_size"][1])),
+        stages=_readonly_array(raw["stages"]),
+        failures=MappingProxyType(failures),
+    )
+
+
+# The compiled configs of this process, by path, with the modification time
+# of the file they were compiled from
+_COMPILED_CONFIGS: Dict[str, Tuple[int, TaskConfig]] = {}
+
+
+def load_task_config(task_name: str) -> TaskConfig:
+    """The compiled config of a task, only compiled again if its file has
+    changed since the last call"""
+    path = os.path.join(CONFIGS_DIR, f"{task_name}.yaml")
+    mtime = os.stat(path).st_mtime_ns
+    cached = _COMPILED_CONFIGS.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    config = compile_task_config(path)
+    _COMPILED_CONFIGS[path] = (mtime, config)
+    return config
@@ -1,9 +1,8 @@
+from typing import Optional
+
 import numpy as np
 import sapien
 
-from mani_skill.examples.motionplanning.panda.motionplanner import (
-    PandaArmMotionPlanningSolver,
-)
 from mani_skill.examples.motionplanning.panda.utils import (
     compute_grasp_info_by_obb,
     get_actor_obb,
@@ -27,19 +26,15 @@ def solve(
         "pd_joint_pos",
         "pd_joint_pos_vel",
     ], env.unwrapped.control_mode
-    planner = PandaArmMotionPlanningSolver(
+    planner_wrapper.get_planner(
         env,
         debug=debug,
         vis=vis,
-        base_pose=env.unwrapped.agent.robot.pose,
         visualize_target_grasp_pose=vis,
-        print_env_info=False,
         joint_vel_limits=0.5,
         joint_acc_limits=0.5,
     )
 
-    planner_wrapper.wrap_planner(planner)
-
     env = env.unwrapped
     FINGER_LENGTH = 0.025
 
@@ -105,5 +100,14 @@ def solve(
     return res
 
 
+def predict_outcome(
+    env: FailPegInsertionSideEnv, stage: int, fail_stage: int
+) -> Optional[bool]:
+    # Without the peg in the gripper it can't be inserted
+    if stage == 2 and not bool(env.agent.is_grasping(env.peg)[0]):
+        return False
+    return None
+
+
 if __name__ == "__main__":
     main()
@@ -1,9 +1,8 @@
+from typing import Optional
+
 import numpy as np
 import sapien
 
-from mani_skill.examples.motionplanning.panda.motionplanner import (
-    PandaArmMotionPlanningSolver,
-)
 from mani_skill.examples.motionplanning.panda.utils import (
     compute_grasp_info_by_obb,
     get_actor_obb,
@@ -22,17 +21,13 @@ def solve(
     vis=False,
 ):
     env.reset(seed=seed)
-    planner = PandaArmMotionPlanningSolver(
+    planner_wrapper.get_planner(
         env,
         debug=debug,
         vis=vis,
-        base_pose=env.unwrapped.agent.robot.pose,
         visualize_target_grasp_pose=vis,
-        print_env_info=False,
     )
 
-    planner_wrapper.wrap_planner(planner)
-
     FINGER_LENGTH = 0.025
     env = env.unwrapped
 
@@ -76,3 +71,14 @@ def solve(
 
     planner_wrapper.close()
     return res
+
+
+def predict_outcome(
+    env: FailPickCubeEnv, stage: int, fail_stage: int
+) -> Optional[bool]:
+    if stage != 2:
+        return None
+    # Without the cube in the gripper it can't be carried to the goal
+    if not bool(env.agent.is_grasping(env.cube)[0]):
+        return False
+    return None
@@ -1,11 +1,10 @@
+from typing import Optional
+
 import numpy as np
 import sapien.core as sapien
 import trimesh
 from transforms3d.euler import euler2quat
 
-from mani_skill.examples.motionplanning.panda.motionplanner import (
-    PandaArmMotionPlanningSolver,
-)
 from mani_skill.examples.motionplanning.panda.utils import (
     compute_grasp_info_by_obb,
 )
@@ -27,19 +26,15 @@ def solve(
         "pd_joint_pos",
         "pd_joint_pos_vel",
     ], env.unwrapped.control_mode
-    planner = PandaArmMotionPlanningSolver(
+    planner_wrapper.get_planner(
         env,
         debug=debug,
         vis=vis,
-        base_pose=env.unwrapped.agent.robot.pose,
         visualize_target_grasp_pose=False,
-        print_env_info=False,
         joint_vel_limits=0.5,
         joint_acc_limits=0.5,
     )
 
-    planner_wrapper.wrap_planner(planner)
-
     FINGER_LENGTH = 0.025
     env = env.unwrapped
     charger_base_pose = env.charger_base_pose
@@ -104,5 +99,14 @@ def solve(
     return res
 
 
+def predict_outcome(
+    env: FailPlugChargerEnv, stage: int, fail_stage: int
+) -> Optional[bool]:
+    # Without the charger in the gripper it can't be plugged
+    if stage == 2 and not bool(env.agent.is_grasping(env.charger)[0]):
+        return False
+    return None
+
+
 if __name__ == "__main__":
     main()
@@ -1,9 +1,6 @@
 import numpy as np
 import sapien
 
-from mani_skill.examples.motionplanning.panda.motionplanner import (
-    PandaArmMotionPlanningSolver,
-)
 
 from failgen.fail_planner_wrapper import FailPlannerWrapper
 from failgen.tasks.fail_push_cube import FailPushCubeEnv
@@ -18,17 +15,13 @@ def solve(
     vis=False,
 ):
     env.reset(seed=seed)
-    planner = PandaArmMotionPlanningSolver(
+    planner_wrapper.get_planner(
         env,
         debug=debug,
         vis=vis,
-        base_pose=env.unwrapped.agent.robot.pose,
         visualize_target_grasp_pose=vis,
-        print_env_info=False,
     )
 
-    planner_wrapper.wrap_planner(planner)
-
     FINGER_LENGTH = 0.025
     env = env.unwrapped
     planner_wrapper.close_gripper(stage=0)
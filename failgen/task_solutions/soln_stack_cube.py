@@ -1,10 +1,9 @@
+from typing import Optional
+
 import numpy as np
 import sapien
 from transforms3d.euler import euler2quat
 
-from mani_skill.examples.motionplanning.panda.motionplanner import (
-    PandaArmMotionPlanningSolver,
-)
 from mani_skill.examples.motionplanning.panda.utils import (
     compute_grasp_info_by_obb,
     get_actor_obb,
@@ -27,17 +26,13 @@ def solve(
         "pd_joint_pos",
         "pd_joint_pos_vel",
     ], env.unwrapped.control_mode
-    planner = PandaArmMotionPlanningSolver(
+    planner_wrapper.get_planner(
         env,
         debug=debug,
         vis=vis,
-        base_pose=env.unwrapped.agent.robot.pose,
         visualize_target_grasp_pose=vis,
-        print_env_info=False,
     )
 
-    planner_wrapper.wrap_planner(planner)
-
     FINGER_LENGTH = 0.025
     env = env.unwrapped
     obb = get_actor_obb(env.cubeA)
@@ -59,16 +54,12 @@ def solve(
     angles = np.arange(0, np.pi * 2 / 3, np.pi / 2)
     angles = np.repeat(angles, 2)
     angles[1::2] *= -1
-    for angle in angles:
-        delta_pose = sapien.Pose(q=euler2quat(0, 0, angle))
-        grasp_pose2 = grasp_pose * delta_pose
-        res = planner_wrapper.move_to_pose_with_screw(
-            grasp_pose2, dry_run=True, stage=0
-        )
-        if res == -1:
-            continue
-        grasp_pose = grasp_pose2
-        break
+    grasp_poses = [
+        grasp_pose * sapien.Pose(q=euler2quat(0, 0, angle)) for angle in angles
+    ]
+    _, best_idx = planner_wrapper.find_feasible_pose(grasp_poses, stage=0)
+    if best_idx is not None:
+        grasp_pose = grasp_poses[best_idx]
     else:
         print("Fail to find a valid grasp pose")
 
@@ -103,3 +94,14 @@ def solve(
     res = planner_wrapper.open_gripper(stage=6)
     planner_wrapper.close()
     return res
+
+
+def predict_outcome(
+    env: FailStackCubeEnv, stage: int, fail_stage: int
+) -> Optional[bool]:
+    if stage not in (3, 4):
+        return None
+    # Without cube A in the gripper it can't be lifted onto cube B
+    if not bool(env.agent.is_grasping(env.cubeA)[0]):
+        return False
+    return None
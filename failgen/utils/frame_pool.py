@@ -0,0 +1,282 @@
+import multiprocessing as mp
+import os
+import queue
+import traceback
+from dataclasses import dataclass, replace
+from math import floor
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+from failgen.utils.image_manipulation import create_image_packs
+from failgen.utils.image_sink import DEFAULT_NUM_WORKERS, ImageSink
+from failgen.utils.video_sink import (
+    DEFAULT_VIDEO_QUALITY,
+    write_multi_view_videos,
+)
+
+MULTI_VIEW_NAMES = ("front", "side", "wrist")
+
+
+@dataclass(frozen=True)
+class FramePoolSpec:
+    """The layout of a `SharedFramePool`, enough to attach to it from another
+    process"""
+
+    name: str
+    num_slots: int
+    max_frames: int
+    height: int
+    width: int
+    num_views: int = len(MULTI_VIEW_NAMES)
+    channels: int = 3
+
+    @property
+    def shape(self):
+        return (
+            self.num_slots,
+            self.max_frames,
+            self.num_views,
+            self.height,
+            self.width,
+            self.channels,
+        )
+
+
+class SharedFramePool:
+    """Slots of shared memory, each one holding the
+    (max_frames, num_views, H, W, 3) frames of an episode
+
+    The recorders of the collection workers write the frames of an episode
+    straight into a slot, and hand the slot over to a `FrameEncodingService`
+    with a `FrameJob`, so the frames go from the worker to the encoder
+    without being pickled or copied. The free slots are kept in a queue
+    shared by all the processes: a recorder takes one without waiting, and
+    the encoder gives it back once the outputs of its episode are written.
+    The pool is created in the main process (`create`) and passed to the
+    processes it starts, which attach to the same memory
+
+    Args:
+        spec: the layout of the pool
+        free_slots: the queue of the slots that are free
+        create: whether to allocate the shared memory, or to attach to the
+            one of the spec
+    """
+
+    def __init__(
+        self, spec: FramePoolSpec, free_slots, create: bool = False
+    ) -> None:
+        self._spec = spec
+        self._free_slots = free_slots
+        self._owner = create
+        size = int(np.prod(spec.shape))
+        if create:
+            self._shm = shared_memory.SharedMemory(
+                name=spec.name or None, create=True, size=size
+            )
+            self._spec = spec = replace(spec, name=self._shm.name)
+        else:
+            # The processes started by the owner share its resource tracker,
+            # so attaching doesn't make the memory be unlinked when they
+            # exit, only the owner unlinks it
+            self._shm = shared_memory.SharedMemory(name=spec.name)
+        self.frames = np.ndarray(
+            spec.shape, dtype=np.uint8, buffer=self._shm.buf
+        )
+
+    @classmethod
+    def create(
+        cls, num_slots: int, max_frames: int, height: int, width: int, ctx=None
+    ) -> "SharedFramePool":
+        ctx = ctx if ctx is not None else mp.get_context("spawn")
+        spec = FramePoolSpec(
+            name="",
+            num_slots=num_slots,
+            max_frames=max_frames,
+            height=height,
+            width=width,
+        )
+        free_slots = ctx.Queue()
+        for slot in range(num_slots):
+            free_slots.put(slot)
+        return cls(spec, free_slots, create=True)
+
+    def __getstate__(self):
+        return dict(spec=self._spec, free_slots=self._free_slots)
+
+    def __setstate__(self, state) -> None:
+        self.__init__(state["spec"], state["free_slots"], create=False)
+
+    @property
+    def spec(self) -> FramePoolSpec:
+        return self._spec
+
+    def acquire(self) -> Optional[int]:
+        """Takes a free slot, or returns None right away if there is none"""
+        try:
+            return self._free_slots.get_nowait()
+        except queue.Empty:
+            return None
+
+    def release(self, slot: int) -> None:
+        self._free_slots.put(slot)
+
+    def fits(self, tiled_image: np.ndarray, width: int) -> bool:
+        return (
+            tiled_image.shape[0] == self._spec.height
+            and width == self._spec.width
+        )
+
+    def write(
+        self, slot: int, frame_idx: int, tiled_image: np.ndarray, width: int
+    ) -> None:
+        """Splits a (H, >= num_views * width, 3) image into its views and
+        stores them as a frame of the slot"""
+        height, num_views = tiled_image.shape[0], self._spec.num_views
+        tiled_views = tiled_image[:, : num_views * width].reshape(
+            height, num_views, width, -1
+        )
+        self.frames[slot, frame_idx] = tiled_views.transpose(1, 0, 2, 3)
+
+    def close(self) -> None:
+        del self.frames
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+@dataclass(frozen=True)
+class FrameJob:
+    """The outputs to write from the frames of an episode held in a slot of
+    a `SharedFramePool`"""
+
+    slot: int
+    num_frames: int
+    output_dir: str
+    images_folder: Optional[str] = None
+    """where to save the frames of each view (see
+    `RecordEpisode.flush_multi_images`)"""
+
+    packs_folder: Optional[str] = None
+    """where to save the image packs (see
+    `RecordEpisode.flush_multi_images_pack`)"""
+
+    video_name: Optional[str] = None
+    """the name of the videos of each view (see
+    `RecordEpisode.flush_video_multi`)"""
+
+    video_fps: int = 30
+    video_quality: float = DEFAULT_VIDEO_QUALITY
+    video_layout: str = "separate"
+
+
+def write_frame_job(
+    job: FrameJob, frames: np.ndarray, image_sink: ImageSink
+) -> None:
+    views = [frames[:, i] for i in range(frames.shape[1])]
+    if job.images_folder is not None:
+        image_sink.save(
+            {
+                os.path.join(job.images_folder, view_name): view_images
+                for view_name, view_images in zip(MULTI_VIEW_NAMES, views)
+            }
+        )
+    if job.packs_folder is not None:
+        img_packs = create_image_packs(
+            *views,
+            start_indices=list(range(floor(len(frames) / 5))),
+            end_idx=len(frames),
+        )
+        image_sink.save({job.packs_folder: img_packs}, image_format="png")
+    if job.video_name is not None:
+        write_multi_view_videos(
+            views,
+            job.output_dir,
+            job.video_name,
+            MULTI_VIEW_NAMES,
+            fps=job.video_fps,
+            quality=job.video_quality,
+            layout=job.video_layout,
+        )
+
+
+def run_frame_encoder(
+    pool: SharedFramePool,
+    jobs,
+    image_workers: int,
+    image_format: str,
+    image_compress_level: Optional[int],
+) -> None:
+    image_sink = ImageSink(
+        num_workers=image_workers,
+        image_format=image_format,
+        compress_level=image_compress_level,
+    )
+    try:
+        while True:
+            job: Optional[FrameJob] = jobs.get()
+            if job is None:
+                break
+            try:
+                # A view into the shared memory, not a copy
+                frames = pool.frames[job.slot, : job.num_frames]
+                write_frame_job(job, frames, image_sink)
+            except Exception:
+                print(
+                    f"Failed to write the frames of {job}:\n"
+                    + traceback.format_exc()
+                )
+            finally:
+                pool.release(job.slot)
+    finally:
+        image_sink.close()
+        pool.close()
+
+
+class FrameEncodingService:
+    """A process that writes the images, image packs and videos of the
+    episodes recorded into a `SharedFramePool`, so that the processes that
+    run the simulations don't spend time encoding
+
+    The recorders get the pool and the `jobs` queue (see the `frame_pool` and
+    `frame_jobs` arguments of `RecordEpisode`), and only put small
+    `FrameJob`s in the queue
+
+    Args:
+        pool: the pool the recorders write the frames into
+        image_workers: the number of threads encoding the images
+        image_format: the format of the images of each view
+        image_compress_level: the compression level of the images (see
+            `ImageSink`)
+    """
+
+    def __init__(
+        self,
+        pool: SharedFramePool,
+        image_workers: int = DEFAULT_NUM_WORKERS,
+        image_format: str = "png",
+        image_compress_level: Optional[int] = None,
+        ctx=None,
+    ) -> None:
+        ctx = ctx if ctx is not None else mp.get_context("spawn")
+        self.jobs = ctx.Queue()
+        self._proc = ctx.Process(
+            target=run_frame_encoder,
+            args=(
+                pool,
+                self.jobs,
+                image_workers,
+                image_format,
+                image_compress_level,
+            ),
+            daemon=True,
+        )
+        self._proc.start()
+
+    def close(self) -> None:
+        """Waits until the jobs in the queue are written, then stops the
+        process"""
+        if self._proc.is_alive():
+            self.jobs.put(None)
+        self._proc.join()
@@ -0,0 +1,343 @@
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple, Union
+
+import h5py
+import numpy as np
+
+try:
+    import hdf5plugin
+except ImportError:
+    # Only needed for the blosc compressors
+    hdf5plugin = None
+
+H5_COMPRESSORS = ("none", "lzf", "gzip", "blosc-lz4")
+TRAJECTORY_STORAGES = ("groups", "chunked")
+
+# NOTE(jigu): It is more efficient to use gzip than png for a sequence of
+# images. The depth images of ManiSkill cameras are uint16
+DEFAULT_COMPRESSORS = {"rgb": "gzip", "depth": "gzip", "seg": "gzip"}
+
+GZIP_LEVEL = 5
+BLOSC_LEVEL = 5
+# The chunks of the shared datasets hold about this many bytes
+CHUNK_BYTES = 1 << 20
+IMAGE_CHUNK_FRAMES = 32
+
+EpisodeData = Dict[str, Union[dict, np.ndarray]]
+
+
+def available_compressors() -> Tuple[str, ...]:
+    if hdf5plugin is None:
+        return tuple(c for c in H5_COMPRESSORS if not c.startswith("blosc"))
+    return H5_COMPRESSORS
+
+
+def compression_options(compressor: str) -> dict:
+    """The keyword arguments of `create_dataset` that use a compressor"""
+    assert compressor in H5_COMPRESSORS, f"Unknown compressor {compressor}"
+    if compressor == "lzf":
+        return dict(compression="lzf")
+    if compressor == "gzip":
+        return dict(compression="gzip", compression_opts=GZIP_LEVEL)
+    if compressor == "blosc-lz4":
+        if hdf5plugin is None:
+            raise ImportError(
+                "The blosc-lz4 compressor needs the hdf5plugin package"
+            )
+        return dict(
+            hdf5plugin.Blosc(
+                cname="lz4",
+                clevel=BLOSC_LEVEL,
+                shuffle=hdf5plugin.Blosc.SHUFFLE,
+            )
+        )
+    return dict()
+
+
+class CompressionPolicy:
+    """The compressor of each dataset of a trajectory
+
+    Args:
+        compressors: the compressor of the datasets, by path in the episode
+            (e.g. "obs/sensor_data/base_camera/rgb") or by name (e.g. "rgb"),
+            the path taking precedence. They are added to the defaults, which
+            compress the rgb, depth and seg images with gzip
+        default: the compressor of the datasets not in `compressors`
+    """
+
+    def __init__(
+        self,
+        compressors: Optional[Mapping[str, str]] = None,
+        default: str = "none",
+    ) -> None:
+        merged = dict(DEFAULT_COMPRESSORS)
+        merged.update(compressors or {})
+        self._options = {
+            key: compression_options(compressor)
+            for key, compressor in merged.items()
+        }
+        self._default_options = compression_options(default)
+
+    def options(self, path: str) -> dict:
+        if path in self._options:
+            return self._options[path]
+        name = path.rsplit("/", 1)[-1]
+        return self._options.get(name, self._default_options)
+
+
+def recursive_add_to_h5py(
+    group: h5py.Group,
+    data: Union[dict, np.ndarray],
+    key: str,
+    compression: Optional[CompressionPolicy] = None,
+    path: Optional[str] = None,
+) -> None:
+    """simple recursive data insertion for nested data structures into h5py,
+    optimizing for visual data as well
+
+    Args:
+        compression: the compressor of each dataset, by default the rgb, depth
+            and seg images are compressed with gzip
+        path: the path of the data in the episode, to pick its compressor.
+            Defaults to `key`
+    """
+    if compression is None:
+        compression = CompressionPolicy()
+    path = path if path is not None else key
+    if isinstance(data, dict):
+        subgrp = group.create_group(key, track_order=True)
+        for k in data.keys():
+            recursive_add_to_h5py(
+                subgrp, data[k], k, compression, f"{path}/{k}"
+            )
+    else:
+        group.create_dataset(
+            key, data=data, dtype=data.dtype, **compression.options(path)
+        )
+
+
+def iter_leaves(
+    data: Union[dict, np.ndarray], path: str = ""
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """The (path, array) of every array of a nested dictionary, in order"""
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from iter_leaves(value, f"{path}/{key}" if path else key)
+    else:
+        yield path, np.asarray(data)
+
+
+def set_leaf(data: dict, path: str, value: np.ndarray) -> None:
+    *parents, name = path.split("/")
+    for key in parents:
+        data = data.setdefault(key, {})
+    data[name] = value
+
+
+def chunk_shape(
+    row_shape: Tuple[int, ...], dtype, chunk_bytes: int
+) -> Tuple[int, ...]:
+    """The shape of the chunks of a dataset with rows of `row_shape`, about
+    `chunk_bytes` large
+
+    The chunks of images (H, W, C) hold a strip of `IMAGE_CHUNK_FRAMES`
+    consecutive frames instead of whole frames, so that the compressors see
+    the same pixels of the previous frames, which are alike
+    """
+    itemsize = np.dtype(dtype).itemsize
+    if len(row_shape) == 3 and row_shape[-1] <= 4:
+        height, width, channels = row_shape
+        line_bytes = IMAGE_CHUNK_FRAMES * width * channels * itemsize
+        lines = min(height, max(1, chunk_bytes // line_bytes))
+        # Strips of about the same height, the last one isn't mostly padding
+        num_strips = -(-height // lines)
+        lines = -(-height // num_strips)
+        return (IMAGE_CHUNK_FRAMES, lines, width, channels)
+    row_bytes = int(np.prod(row_shape, dtype=np.int64)) * itemsize
+    return (max(1, chunk_bytes // max(1, row_bytes)),) + row_shape
+
+
+class ChunkedTrajectoryStore:
+    """Appends the episodes of a recording to shared datasets, one per key
+
+    Writing every episode into its own group makes a dataset per key per
+    episode, which makes files with many episodes slow to open and to
+    iterate. Instead, the arrays of every key are appended to a single
+    chunked dataset that grows along its first axis, under the "episodes"
+    group, e.g. "episodes/obs/sensor_data/base_camera/rgb". The rows of the
+    `i`th episode in the dataset at `path` are `offsets[i]:offsets[i + 1]`,
+    with the offsets in the dataset at the same path under the
+    "episode_offsets" group. "episode_ids" holds the id of each episode (the
+    N of the "traj_N" groups of the other storage)
+
+    The offsets are kept in memory too, so reading an episode only touches
+    the chunks that hold its rows. A store opened on a file that was
+    already written continues it, or only reads it if the file is read-only
+
+    Args:
+        h5_file: the file of the recording
+        compression: the compressor of each dataset, only used when creating
+            the datasets
+        chunk_bytes: the approximate size of the chunks of the datasets
+    """
+
+    DATA_GROUP = "episodes"
+    OFFSETS_GROUP = "episode_offsets"
+    IDS_DATASET = "episode_ids"
+    STORAGE_ATTR = "trajectory_storage"
+
+    def __init__(
+        self,
+        h5_file: h5py.File,
+        compression: Optional[CompressionPolicy] = None,
+        chunk_bytes: int = CHUNK_BYTES,
+    ) -> None:
+        self._file = h5_file
+        self._compression = (
+            compression if compression is not None else CompressionPolicy()
+        )
+        self._chunk_bytes = chunk_bytes
+        self._datasets: Dict[str, h5py.Dataset] = {}
+        self._offsets: Dict[str, List[int]] = {}
+        if self.IDS_DATASET in h5_file:
+            self._ids = h5_file[self.IDS_DATASET]
+            h5_file[self.DATA_GROUP].visititems(self._load_dataset)
+        else:
+            h5_file.attrs[self.STORAGE_ATTR] = "chunked"
+            h5_file.create_group(self.DATA_GROUP, track_order=True)
+            h5_file.create_group(self.OFFSETS_GROUP, track_order=True)
+            self._ids = h5_file.create_dataset(
+                self.IDS_DATASET,
+                shape=(0,),
+                maxshape=(None,),
+                chunks=(1024,),
+                dtype=np.int64,
+            )
+        self._episode_ids = self._ids[:].tolist()
+        self._rows = {eid: i for i, eid in enumerate(self._episode_ids)}
+
+    def _load_dataset(self, name: str, node) -> None:
+        if isinstance(node, h5py.Dataset):
+            self._datasets[name] = node
+            offsets = self._file[self.OFFSETS_GROUP][name]
+            self._offsets[name] = offsets[:].tolist()
+
+    def __len__(self) -> int:
+        return len(self._episode_ids)
+
+    @property
+    def episode_ids(self) -> List[int]:
+        return list(self._episode_ids)
+
+    @property
+    def paths(self) -> List[str]:
+        """The paths of the datasets, e.g. "obs/agent/qpos" """
+        return list(self._datasets.keys())
+
+    def _create(self, path: str, array: np.ndarray) -> h5py.Dataset:
+        data_group = self._file[self.DATA_GROUP]
+        offsets_group = self._file[self.OFFSETS_GROUP]
+        *parents, _ = path.split("/")
+        for i in range(len(parents)):
+            # Nested groups keep the order of the keys, like the episodes
+            # saved one group each
+            parent = "/".join(parents[: i + 1])
+            if parent not in data_group:
+                data_group.create_group(parent, track_order=True)
+                offsets_group.create_group(parent, track_order=True)
+        row_shape = array.shape[1:]
+        dataset = data_group.create_dataset(
+            path,
+            shape=(0,) + row_shape,
+            maxshape=(None,) + row_shape,
+            chunks=chunk_shape(row_shape, array.dtype, self._chunk_bytes),
+            dtype=array.dtype,
+            **self._compression.options(path),
+        )
+        # The datasets that appear after the first episodes are empty in them
+        offsets_group.create_dataset(
+            path,
+            data=np.zeros(len(self) + 1, dtype=np.int64),
+            maxshape=(None,),
+            chunks=(1024,),
+        )
+        self._datasets[path] = dataset
+        self._offsets[path] = [0] * (len(self) + 1)
+        return dataset
+
+    def append(self, episode_id: int, episode_data: EpisodeData) -> None:
+        """Appends the (possibly nested) arrays of an episode, each with the
+        time along its first axis"""
+        leaves = list(iter_leaves(episode_data))
+        for path, array in leaves:
+            dataset = self._datasets.get(path)
+            if dataset is not None and dataset.shape[1:] != array.shape[1:]:
+                raise ValueError(
+                    f"The rows of {path} have shape {array.shape[1:]}, "
+                    + f"but the ones stored have shape {dataset.shape[1:]}"
+                )
+        for path, array in leaves:
+            dataset = self._datasets.get(path)
+            if dataset is None:
+                dataset = self._create(path, array)
+            start = dataset.shape[0]
+            dataset.resize(start + len(array), axis=0)
+            dataset[start:] = array
+        # Every dataset gets an offset, the ones the episode doesn't have
+        # hold no rows of it
+        num_episodes = len(self)
+        for path, dataset in self._datasets.items():
+            offsets = self._file[self.OFFSETS_GROUP][path]
+            offsets.resize(num_episodes + 2, axis=0)
+            offsets[num_episodes + 1] = dataset.shape[0]
+            self._offsets[path].append(dataset.shape[0])
+        self._ids.resize(num_episodes + 1, axis=0)
+        self._ids[num_episodes] = episode_id
+        self._episode_ids.append(episode_id)
+        self._rows[episode_id] = num_episodes
+
+    def rows(self, path: str, index: int) -> slice:
+        """The rows of the `index`th episode in the dataset at `path`"""
+        offsets = self._offsets[path]
+        return slice(offsets[index], offsets[index + 1])
+
+    def read(
+        self, index: int, paths: Optional[List[str]] = None
+    ) -> EpisodeData:
+        """The arrays of the `index`th episode stored, nested like they were
+        appended
+
+        Args:
+            paths: the datasets to read, all of them if None
+        """
+        episode: EpisodeData = {}
+        for path in paths if paths is not None else self._datasets:
+            rows = self.rows(path, index)
+            if rows.stop > rows.start:
+                set_leaf(episode, path, self._datasets[path][rows])
+        return episode
+
+    def read_episode(
+        self, episode_id: int, paths: Optional[List[str]] = None
+    ) -> EpisodeData:
+        return self.read(self._rows[episode_id], paths)
+
+
+def is_chunked_storage(h5_file: h5py.File) -> bool:
+    return (
+        h5_file.attrs.get(ChunkedTrajectoryStore.STORAGE_ATTR, "groups")
+        == "chunked"
+    )
+
+
+def read_group(group: h5py.Group) -> EpisodeData:
+    return {
+        key: read_group(node) if isinstance(node, h5py.Group) else node[()]
+        for key, node in group.items()
+    }
+
+
+def load_trajectory(h5_file: h5py.File, episode_id: int) -> EpisodeData:
+    """The arrays of an episode of a recording, whatever its storage"""
+    if is_chunked_storage(h5_file):
+        return ChunkedTrajectoryStore(h5_file).read_episode(episode_id)
+    return read_group(h5_file[f"traj_{episode_id}"])
@@ -1,11 +1,65 @@
+from dataclasses import dataclass
 from math import ceil
-from typing import List
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
-from PIL import Image, ImageDraw, ImageFont
 import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
 
 NUM_TIMESTEPS = 5
 
+NUM_VIEWS = 3
+
+# Offset in pixels of the timestep labels from the top-left of each frame
+LABEL_OFFSET = 10
+
+Color = Union[str, Tuple[int, int, int]]
+
+
+@dataclass(frozen=True)
+class Glyph:
+    mask: np.ndarray
+    """(h, w) uint8 coverage of the rasterized text"""
+
+    offset: Tuple[int, int]
+    """(x, y) offset of the mask from the position the text is drawn at"""
+
+    color: Tuple[int, int, int]
+
+
+_GLYPH_CACHE: Dict[Tuple[int, Tuple[int, int, int], str], Glyph] = {}
+
+
+def load_font(font_size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=font_size)
+    except IOError:
+        return ImageFont.truetype("arial", font_size)
+
+
+def get_glyph(text: str, font_size: int = 40, color: Color = "white") -> Glyph:
+    """Returns the pre-rasterized alpha mask of a label, rendering it once
+
+    The text is drawn in full intensity over a black canvas, so the values of
+    the mask are exactly the coverage PIL uses when drawing the text straight
+    into an image
+    """
+    rgb = ImageColor.getrgb(color) if isinstance(color, str) else color
+    key = (font_size, tuple(rgb[:3]), text)
+    if key not in _GLYPH_CACHE:
+        font = load_font(font_size)
+        left, top, right, bottom = font.getbbox(text)
+        mask_pil = Image.new("L", (max(right - left, 1), max(bottom - top, 1)))
+        draw = ImageDraw.Draw(mask_pil)
+        draw.text((-left, -top), text, fill=255, font=font)
+        mask = np.asarray(mask_pil)
+        mask.flags.writeable = False
+        _GLYPH_CACHE[key] = Glyph(mask=mask, offset=(left, top), color=key[1])
+    return _GLYPH_CACHE[key]
+
+
+def clear_glyph_cache() -> None:
+    _GLYPH_CACHE.clear()
+
 
 def create_image_pack(
     front_view_images: List[np.ndarray],
@@ -30,7 +84,7 @@ def create_image_pack(
     # fmt: on
     total_height = 3 * img_height
 
-    image_pack = np.zeros((total_height, total_width, 3))
+    image_pack = np.zeros((total_height, total_width, 3), dtype=np.uint8)
 
     j = 0
     for j_idx in range(start_idx, end_idx, step_idx):
@@ -70,20 +124,143 @@ def create_image_pack(
 
         j += 1
 
-    image_pack_pil = Image.fromarray(image_pack.astype(np.uint8))
-
     if use_annotations:
         # here come the number annotations
-        draw = ImageDraw.Draw(image_pack_pil)
-        try:
-            font = ImageFont.load_default(size=font_size)
-        except IOError:
-            font = ImageFont.truetype("arial", font_size)
-
-        for j in range(5):
-            for i in range(3):
-                start_px = (i * img_height, j * img_width + j * separator_width)
-                text_px = (start_px[1] + 10, start_px[0] + 10)
-                draw.text(text_px, str(j + 1), fill="white", font=font)
-
-    return image_pack_pil
+        annotate_image_packs(
+            image_pack, img_height, img_width, separator_width, font_size
+        )
+
+    return Image.fromarray(image_pack)
+
+
+def get_window_indices(start_idx: int, end_idx: int) -> List[int]:
+    """Returns the frame indices that `create_image_pack` places in a pack"""
+    step_idx = ceil((end_idx - start_idx) / NUM_TIMESTEPS)
+    return list(range(start_idx, end_idx, step_idx))[:NUM_TIMESTEPS]
+
+
+def blend_mask(
+    image_packs: np.ndarray,
+    mask: np.ndarray,
+    color: Sequence[int] = (255, 255, 255),
+) -> None:
+    """Alpha-blends `color` into the (..., H, W, 3) uint8 array in place
+
+    Uses the same integer rounding as PIL's bitmap fill, i.e. the result is
+    round((background * (255 - alpha) + color * alpha) / 255)
+    """
+    selection = mask > 0
+    if not selection.any():
+        return
+    alpha = mask[selection].astype(np.uint32)[:, None]
+    ink = np.asarray(color, dtype=np.uint32)
+    background = image_packs[..., selection, :].astype(np.uint32)
+    blended = background * (255 - alpha) + ink * alpha + 128
+    blended = ((blended >> 8) + blended) >> 8
+    image_packs[..., selection, :] = blended.astype(np.uint8)
+
+
+def draw_glyph(image_packs: np.ndarray, glyph: Glyph, xy: Tuple[int, int]):
+    """Blends the glyph into the (..., H, W, 3) uint8 array at the (x, y) text
+    position, clipping it to the borders of the images"""
+    height, width = image_packs.shape[-3:-1]
+    x0, y0 = xy[0] + glyph.offset[0], xy[1] + glyph.offset[1]
+    x1, y1 = x0 + glyph.mask.shape[1], y0 + glyph.mask.shape[0]
+    cx0, cy0 = max(x0, 0), max(y0, 0)
+    cx1, cy1 = min(x1, width), min(y1, height)
+    if cx0 >= cx1 or cy0 >= cy1:
+        return
+    blend_mask(
+        image_packs[..., cy0:cy1, cx0:cx1, :],
+        glyph.mask[cy0 - y0 : cy1 - y0, cx0 - x0 : cx1 - x0],
+        glyph.color,
+    )
+
+
+def annotate_image_packs(
+    image_packs: np.ndarray,
+    img_height: int,
+    img_width: int,
+    separator_width: int = 10,
+    font_size: int = 40,
+    color: Color = "white",
+) -> None:
+    """Draws the timestep labels into one (3H, W_total, 3) or several
+    (N, 3H, W_total, 3) uint8 image packs in place"""
+    for j in range(NUM_TIMESTEPS):
+        glyph = get_glyph(str(j + 1), font_size, color)
+        for i in range(NUM_VIEWS):
+            start_px = (i * img_height, j * img_width + j * separator_width)
+            text_px = (start_px[1] + LABEL_OFFSET, start_px[0] + LABEL_OFFSET)
+            draw_glyph(image_packs, glyph, text_px)
+
+
+def create_image_packs(
+    front_view_images: np.ndarray,
+    side_view_images: np.ndarray,
+    wrist_view_images: np.ndarray,
+    start_indices: Sequence[int],
+    end_idx: Optional[int] = None,
+    separator_width: int = 10,
+    font_size: int = 40,
+    use_annotations: bool = True,
+) -> np.ndarray:
+    """Builds the image packs for several windows at once
+
+    Args:
+        front_view_images: (T, H, W, 3) uint8 frames from the front camera
+        side_view_images: (T, H, W, 3) uint8 frames from the side camera
+        wrist_view_images: (T, H, W, 3) uint8 frames from the wrist camera
+        start_indices: the `start_idx` of each of the N windows
+        end_idx: the shared `end_idx` of all windows (defaults to T)
+        separator_width: width in pixels of the gap between timesteps
+        font_size: the size of the font used for the timestep labels
+        use_annotations: whether or not to draw the timestep labels
+
+    Returns:
+        A (N, 3H, W_total, 3) uint8 array, where the n-th pack is equal to
+        `create_image_pack(..., start_idx=start_indices[n], end_idx=end_idx)`
+    """
+    front_view_images = np.asarray(front_view_images)
+    side_view_images = np.asarray(side_view_images)
+    wrist_view_images = np.asarray(wrist_view_images)
+    assert front_view_images.shape == side_view_images.shape
+    assert side_view_images.shape == wrist_view_images.shape
+
+    num_frames, img_height, img_width = front_view_images.shape[:3]
+    if end_idx is None:
+        end_idx = num_frames
+    # fmt: off
+    total_width = NUM_TIMESTEPS * img_width + \
+                  (NUM_TIMESTEPS - 1) * separator_width
+    # fmt: on
+    total_height = NUM_VIEWS * img_height
+
+    # Frame index for each (window, timestep) slot, -1 for empty slots
+    frame_indices = np.full((len(start_indices), NUM_TIMESTEPS), -1, dtype=int)
+    for n, start_idx in enumerate(start_indices):
+        window = get_window_indices(start_idx, end_idx)
+        frame_indices[n, : len(window)] = window
+
+    image_packs = np.zeros(
+        (len(start_indices), total_height, total_width, 3), dtype=np.uint8
+    )
+    views = (front_view_images, side_view_images, wrist_view_images)
+    for j in range(NUM_TIMESTEPS):
+        valid = frame_indices[:, j] >= 0
+        if not valid.any():
+            continue
+        col = j * img_width + j * separator_width
+        for i, view_images in enumerate(views):
+            image_packs[
+                valid,
+                i * img_height : (i + 1) * img_height,
+                col : col + img_width,
+            ] = view_images[frame_indices[valid, j]]
+
+    if use_annotations and len(start_indices) > 0:
+        annotate_image_packs(
+            image_packs, img_height, img_width, separator_width, font_size
+        )
+
+    return image_packs
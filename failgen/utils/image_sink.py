@@ -0,0 +1,120 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+IMAGE_FORMATS = ("png", "webp", "npy")
+
+DEFAULT_NUM_WORKERS = min(8, os.cpu_count() or 1)
+
+
+@dataclass
+class SaveStats:
+    num_images: int = 0
+    num_bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def images_per_second(self) -> float:
+        return self.num_images / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.num_bytes / 1e6 / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"saved {self.num_images} images ({self.num_bytes / 1e6:.2f} MB) "
+            + f"in {self.seconds:.3f} s: {self.images_per_second:.1f} img/s, "
+            + f"{self.megabytes_per_second:.2f} MB/s"
+        )
+
+
+class ImageSink:
+    """Encodes and saves images concurrently on a pool of threads
+
+    Encoding (zlib for PNG, libwebp for WebP) runs inside PIL with the GIL
+    released, so threads scale with the number of cores and can read the
+    frames straight from the recorder's buffers without pickling them
+
+    Args:
+        num_workers: the number of threads used to encode the images
+        image_format: one of "png", "webp" (lossless) or "npy" (raw arrays)
+        compress_level: the zlib level (0-9) for PNG, or the encoding method
+            (0-6) for WebP. If None, the defaults of PIL are used
+    """
+
+    def __init__(
+        self,
+        num_workers: int = DEFAULT_NUM_WORKERS,
+        image_format: str = "png",
+        compress_level: Optional[int] = None,
+    ) -> None:
+        assert image_format in IMAGE_FORMATS, f"Unknown format {image_format}"
+        self._image_format = image_format
+        self._compress_level = compress_level
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="failgen-image-sink"
+        )
+
+    @property
+    def image_format(self) -> str:
+        return self._image_format
+
+    def save_image(
+        self, np_image: np.ndarray, path: str, image_format: str
+    ) -> int:
+        if image_format == "npy":
+            np.save(path, np_image)
+        elif image_format == "webp":
+            params = dict(lossless=True)
+            if self._compress_level is not None:
+                params["method"] = min(self._compress_level, 6)
+            Image.fromarray(np_image).save(path, format="WEBP", **params)
+        else:
+            params = dict()
+            if self._compress_level is not None:
+                params["compress_level"] = self._compress_level
+            Image.fromarray(np_image).save(path, format="PNG", **params)
+        return os.path.getsize(path)
+
+    def save(
+        self,
+        images_per_folder: Dict[str, Sequence[np.ndarray]],
+        image_format: Optional[str] = None,
+    ) -> SaveStats:
+        """Saves the images of every folder as `<folder>/<index>.<format>`
+
+        Args:
+            images_per_folder: maps each output folder to its images, e.g. a
+                (T, H, W, 3) array with the frames of a camera view
+            image_format: overrides the format given to the sink
+
+        Returns:
+            The number of images and bytes written, and the time it took
+        """
+        image_format = image_format or self._image_format
+        start = time.perf_counter()
+        futures = []
+        for folder, images in images_per_folder.items():
+            os.makedirs(folder, exist_ok=True)
+            for i, np_image in enumerate(images):
+                path = os.path.join(folder, f"{i}.{image_format}")
+                futures.append(
+                    self._executor.submit(
+                        self.save_image, np_image, path, image_format
+                    )
+                )
+        num_bytes = sum(future.result() for future in futures)
+        return SaveStats(
+            num_images=len(futures),
+            num_bytes=num_bytes,
+            seconds=time.perf_counter() - start,
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
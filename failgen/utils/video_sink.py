@@ -0,0 +1,184 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import imageio
+import numpy as np
+
+VIDEO_LAYOUTS = ("separate", "stacked")
+# The quality of ManiSkill's `images_to_video`, which encoded the videos
+# before, from 0 (lowest) to 10 (highest)
+DEFAULT_VIDEO_QUALITY = 5
+
+
+def stack_views(views: Sequence[np.ndarray]) -> np.ndarray:
+    """Places the (..., H, W, 3) frames of each view side by side"""
+    return np.concatenate(views, axis=-2)
+
+
+def video_paths(
+    output_dir: str,
+    video_name: str,
+    view_names: Sequence[str],
+    layout: str = "separate",
+) -> List[str]:
+    video_name = video_name.replace(" ", "_").replace("\n", "_")
+    if layout == "stacked":
+        return [os.path.join(output_dir, f"{video_name}.mp4")]
+    return [
+        os.path.join(output_dir, f"{video_name}_{view_name}.mp4")
+        for view_name in view_names
+    ]
+
+
+def write_video(
+    frames, path: str, fps: int = 30, quality: float = DEFAULT_VIDEO_QUALITY
+) -> None:
+    writer = imageio.get_writer(path, fps=fps, quality=quality)
+    for frame in frames:
+        writer.append_data(frame)
+    writer.close()
+
+
+def write_multi_view_videos(
+    views: Sequence[np.ndarray],
+    output_dir: str,
+    video_name: str,
+    view_names: Sequence[str],
+    fps: int = 30,
+    quality: float = DEFAULT_VIDEO_QUALITY,
+    layout: str = "separate",
+    verbose: bool = False,
+) -> List[str]:
+    """Encodes the (T, H, W, 3) frames of every view into videos in one pass
+
+    With the "separate" layout every view gets its own video, and the views
+    are encoded concurrently (each writer feeds its own ffmpeg process). With
+    the "stacked" layout the views are placed side by side in a single video
+
+    Args:
+        quality: the quality of the videos, from 0 (lowest) to 10 (highest).
+            Defaults to `DEFAULT_VIDEO_QUALITY`, the one of `images_to_video`
+    """
+    assert layout in VIDEO_LAYOUTS, f"Unknown layout {layout}"
+    os.makedirs(output_dir, exist_ok=True)
+    paths = video_paths(output_dir, video_name, view_names, layout)
+    if layout == "stacked":
+        write_video(
+            (stack_views(frames) for frames in zip(*views)),
+            paths[0],
+            fps=fps,
+            quality=quality,
+        )
+    else:
+        with ThreadPoolExecutor(max_workers=len(views)) as executor:
+            futures = [
+                executor.submit(write_video, frames, path, fps, quality)
+                for frames, path in zip(views, paths)
+            ]
+            for future in futures:
+                future.result()
+    if verbose:
+        for path in paths:
+            print(f"Video created: {path}")
+    return paths
+
+
+class MultiViewVideoSink:
+    """Streams the frames of several camera views to video encoders as soon
+    as they are captured, so no frames have to be buffered for the videos
+
+    The videos are written to temporary files, as the final name of a video
+    is usually only known once the episode is over, and are renamed (or
+    removed) by `close`
+
+    Args:
+        output_dir: the folder where to place the videos
+        view_names: the names of the views, used as suffixes of the videos
+        fps: the frames per second of the videos
+        quality: the quality of the videos, from 0 (lowest) to 10 (highest).
+            Defaults to `DEFAULT_VIDEO_QUALITY`, the one of `images_to_video`
+        layout: "separate" for one video per view, "stacked" for a single
+            video with the views side by side
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        view_names: Sequence[str],
+        fps: int = 30,
+        quality: float = DEFAULT_VIDEO_QUALITY,
+        layout: str = "separate",
+    ) -> None:
+        assert layout in VIDEO_LAYOUTS, f"Unknown layout {layout}"
+        self._output_dir = output_dir
+        self._view_names = list(view_names)
+        self._fps = fps
+        self._quality = quality
+        self._layout = layout
+        self._writers: List = []
+        self._tmp_paths: List[str] = []
+        self._num_frames = 0
+
+    @property
+    def is_open(self) -> bool:
+        return len(self._writers) > 0
+
+    @property
+    def num_frames(self) -> int:
+        return self._num_frames
+
+    def open(self) -> None:
+        assert not self.is_open, "The previous videos haven't been closed"
+        os.makedirs(self._output_dir, exist_ok=True)
+        self._tmp_paths = video_paths(
+            self._output_dir,
+            f".streaming_{os.getpid()}_{id(self)}",
+            self._view_names,
+            self._layout,
+        )
+        self._writers = [
+            imageio.get_writer(path, fps=self._fps, quality=self._quality)
+            for path in self._tmp_paths
+        ]
+        self._num_frames = 0
+
+    def append(self, views: Sequence[np.ndarray]) -> None:
+        """Sends one (H, W, 3) frame per view to the encoders"""
+        if not self.is_open:
+            self.open()
+        if self._layout == "stacked":
+            self._writers[0].append_data(stack_views(views))
+        else:
+            for writer, frame in zip(self._writers, views):
+                writer.append_data(frame)
+        self._num_frames += 1
+
+    def close(
+        self, video_name: Optional[str] = None, verbose: bool = False
+    ) -> List[str]:
+        """Finishes the videos, saving them under `video_name`, or removing
+        them if no name is given
+
+        Returns:
+            The paths of the saved videos
+        """
+        for writer in self._writers:
+            writer.close()
+        paths = []
+        if video_name is not None:
+            paths = video_paths(
+                self._output_dir, video_name, self._view_names, self._layout
+            )
+            for tmp_path, path in zip(self._tmp_paths, paths):
+                os.replace(tmp_path, path)
+                if verbose:
+                    print(f"Video created: {path}")
+        else:
+            for tmp_path in self._tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        self._writers = []
+        self._tmp_paths = []
+        self._num_frames = 0
+        return paths
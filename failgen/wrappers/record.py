@@ -1,4 +1,7 @@
 import copy
+import json
+import queue
+import threading
 import time
 import os
 from dataclasses import dataclass
@@ -11,13 +14,11 @@ import h5py
 import numpy as np
 import sapien.physx as physx
 import torch
-from PIL import Image
 
 from mani_skill import get_commit_info
 from mani_skill.envs.sapien_env import BaseEnv
 from mani_skill.utils import common, gym_utils
-from mani_skill.utils.io_utils import dump_json
-from mani_skill.utils.structs.types import Array
+from mani_skill.utils.io_utils import CustomJsonEncoder, dump_json
 from mani_skill.utils.visualization.misc import (
     images_to_video,
     put_info_on_image,
@@ -25,10 +26,28 @@ from mani_skill.utils.visualization.misc import (
 )
 from mani_skill.utils.wrappers import CPUGymWrapper
 
-from failgen.utils.image_manipulation import create_image_pack
+from failgen.utils.image_manipulation import create_image_packs
+from failgen.utils.h5_storage import (
+    TRAJECTORY_STORAGES,
+    ChunkedTrajectoryStore,
+    CompressionPolicy,
+    recursive_add_to_h5py,
+)
+from failgen.utils.frame_pool import (
+    MULTI_VIEW_NAMES,
+    FrameJob,
+    SharedFramePool,
+)
+from failgen.utils.image_sink import DEFAULT_NUM_WORKERS, ImageSink, SaveStats
+from failgen.utils.video_sink import (
+    DEFAULT_VIDEO_QUALITY,
+    MultiViewVideoSink,
+    write_multi_view_videos,
+)
 
-# NOTE (stao): The code for record.py is quite messy and perhaps confusing as it is trying to support both recording on CPU and GPU seamlessly
-# and handle partial resets. It works but can be claned up a lot.
+# NOTE (stao): The code for record.py is quite messy and perhaps confusing as it
+# is trying to support both recording on CPU and GPU seamlessly and handle
+# partial resets. It works but can be claned up a lot.
 
 
 def parse_env_info(env: gym.Env):
@@ -56,11 +75,13 @@ def temp_deep_print_shapes(x, prefix=""):
         print(prefix, x.shape)
 
 
-def clean_trajectories(h5_file: h5py.File, json_dict: dict, prune_empty_action=True):
+def clean_trajectories(
+    h5_file: h5py.File, json_dict: dict, prune_empty_action=True
+):
     """Clean trajectories by renaming and pruning trajectories in place.
 
-    After cleanup, trajectory names are consecutive integers (traj_0, traj_1, ...),
-    and trajectories with empty action are pruned.
+    After cleanup, trajectory names are consecutive integers (traj_0, traj_1,
+    ...), and trajectories with empty action are pruned.
 
     Args:
         h5_file: raw h5 file
@@ -98,6 +119,156 @@ def clean_trajectories(h5_file: h5py.File, json_dict: dict, prune_empty_action=T
     json_dict["episodes"] = new_json_episodes
 
 
+def copy_dict_array(x: Union[dict, np.ndarray]) -> Union[dict, np.ndarray]:
+    if isinstance(x, dict):
+        return {k: copy_dict_array(v) for k, v in x.items()}
+    return np.array(x, copy=True)
+
+
+class BackgroundWriter:
+    """Runs write jobs on a background thread, in the order they were submitted
+
+    Submitting blocks while `max_pending` jobs are already waiting, which
+    applies backpressure to the caller instead of letting finished episodes pile
+    up in memory. If a job raises, the jobs after it are skipped and the error
+    is re-raised to the caller on the next `submit`, `drain` or `close`.
+
+    Args:
+        max_pending: maximum number of jobs waiting to be written
+    """
+
+    def __init__(self, max_pending: int = 4) -> None:
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._run, name="failgen-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._error is None:
+                    fn, args = job
+                    fn(*args)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(
+                "Background write of recorded data failed"
+            ) from error
+
+    def submit(self, fn: Callable, *args) -> None:
+        self.raise_error()
+        if not self._thread.is_alive():
+            raise RuntimeError("Cannot submit jobs to a closed writer")
+        self._queue.put((fn, args))
+
+    def drain(self) -> None:
+        """Blocks until every submitted job has been processed"""
+        self._queue.join()
+        self.raise_error()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.raise_error()
+
+
+class EpisodeIndex:
+    """Append-only log of the episode metadata that goes into the JSON file of a
+    recording
+
+    Rewriting the whole JSON file after every flushed episode makes long
+    collection runs do quadratic work, so instead every episode is appended as
+    one line to a JSON Lines log next to the JSON file (`<name>.episodes.jsonl`,
+    whose first line holds the header, i.e. everything except the episodes). The
+    regular ManiSkill JSON file is only written by `compact`. If the process
+    dies before compacting, `load_episode_index` rebuilds the metadata from the
+    log.
+
+    Args:
+        json_path: path of the ManiSkill JSON file of the recording
+        data: the JSON data, whose "episodes" list is appended to by this index
+    """
+
+    def __init__(self, json_path: str, data: dict) -> None:
+        self.json_path = json_path
+        self.log_path = episode_log_path(json_path)
+        self.data = data
+        self._log = open(self.log_path, "w")
+        header = {k: v for k, v in self.data.items() if k != "episodes"}
+        self._write_line(dict(header=header))
+
+    def _write_line(self, record: dict) -> None:
+        self._log.write(json.dumps(record, cls=CustomJsonEncoder) + "\n")
+        self._log.flush()
+
+    def append(self, episode_info: dict) -> None:
+        self.data["episodes"].append(episode_info)
+        self._write_line(dict(episode=episode_info))
+
+    def compact(self) -> None:
+        """Writes the ManiSkill-compatible JSON file with all the episodes
+        recorded so far"""
+        dump_json(self.json_path, self.data, indent=2)
+
+    def close(self, remove_log: bool = True) -> None:
+        """Compacts the index and closes the log, removing it as the JSON file
+        now holds all of its data"""
+        if self._log.closed:
+            return
+        self.compact()
+        self._log.close()
+        if remove_log:
+            os.remove(self.log_path)
+
+
+def episode_log_path(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + ".episodes.jsonl"
+
+
+def load_episode_index(json_path: str, compact: bool = False) -> dict:
+    """Rebuilds the JSON data of a recording, e.g. after a crash left only the
+    episode log behind
+
+    Args:
+        json_path: path of the ManiSkill JSON file of the recording
+        compact: whether to also write the rebuilt data to `json_path`
+    """
+    log_path = episode_log_path(json_path)
+    if not os.path.exists(log_path):
+        # the recording was closed properly, so the JSON file is complete
+        with open(json_path, "r") as f:
+            return json.load(f)
+    data = None
+    with open(log_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may have been cut short by the crash
+                break
+            if "header" in record:
+                data = dict(**record["header"], episodes=[])
+            else:
+                data["episodes"].append(record["episode"])
+    if data is None:
+        raise ValueError(f"The episode log {log_path} has no header")
+    if compact:
+        dump_json(json_path, data, indent=2)
+    return data
+
+
 @dataclass
 class Step:
     state: np.ndarray
@@ -108,38 +279,324 @@ class Step:
     truncated: np.ndarray
     done: np.ndarray
     env_episode_ptr: np.ndarray
-    """points to index in above data arrays where current episode started (any data before should already be flushed)"""
+    """points to index in above data arrays where current episode started (any
+    data before should already be flushed)"""
 
     success: np.ndarray = None
     fail: np.ndarray = None
 
 
-class RecordEpisode(gym.Wrapper):
-    """Record trajectories or videos for episodes. You generally should always apply this wrapper last, particularly if you include
-    observation wrappers which modify the returned observations. The only wrappers that may go after this one is any of the vector env
-    interface wrappers that map the maniskill env to a e.g. gym vector env interface.
+class TrajectoryBuffer:
+    """Columnar trajectory storage with amortized O(1) appends, replacing the
+    `Step` of concatenated arrays
+
+    Every field of a `Step` (except env_episode_ptr) is kept as a possibly
+    nested dictionary of preallocated numpy arrays whose leading dimension is
+    doubled whenever it runs out of space. The field attributes (state,
+    observation, action, ...) return views over the rows recorded so far, so
+    slicing them for flushing or writing into them for partial resets never
+    copies the data. Fields that are None in the given `Step` (e.g. state when
+    env states are not recorded) are not stored and read as None.
+
+    Args:
+        first_step: the data of the first step, each field with a leading time
+            dimension
+        capacity: number of rows to preallocate
+    """
+
+    FIELDS = (
+        "state",
+        "observation",
+        "action",
+        "reward",
+        "terminated",
+        "truncated",
+        "done",
+        "success",
+        "fail",
+    )
 
-    Trajectory data is saved with two files, the actual data in a .h5 file via H5py and metadata in a JSON file of the same basename.
+    def __init__(self, first_step: Step, capacity: int = 64) -> None:
+        self.env_episode_ptr = first_step.env_episode_ptr
+        self._size = len(first_step.done)
+        self._capacity = max(capacity, self._size)
+        self._columns: Dict[str, Union[dict, np.ndarray]] = dict()
+        for field in self.FIELDS:
+            data = getattr(first_step, field)
+            if data is not None:
+                self._columns[field] = self._allocate(data, self._capacity)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @staticmethod
+    def _allocate(data: Union[dict, np.ndarray], capacity: int):
+        if isinstance(data, dict):
+            return {
+                k: TrajectoryBuffer._allocate(v, capacity)
+                for k, v in data.items()
+            }
+        buffer = np.empty((capacity, *data.shape[1:]), dtype=data.dtype)
+        buffer[: len(data)] = data
+        return buffer
+
+    @staticmethod
+    def _resize(buffer: Union[dict, np.ndarray], capacity: int, size: int):
+        if isinstance(buffer, dict):
+            return {
+                k: TrajectoryBuffer._resize(v, capacity, size)
+                for k, v in buffer.items()
+            }
+        new_buffer = np.empty((capacity, *buffer.shape[1:]), dtype=buffer.dtype)
+        new_buffer[:size] = buffer[:size]
+        return new_buffer
+
+    @staticmethod
+    def _write(
+        buffer: Union[dict, np.ndarray],
+        data: Union[dict, np.ndarray],
+        start: int,
+        size: int,
+    ):
+        """Writes data into the rows [start, start + len(data)) and returns the
+        (possibly promoted) buffer"""
+        if isinstance(buffer, dict):
+            for k in buffer.keys():
+                buffer[k] = TrajectoryBuffer._write(
+                    buffer[k], data[k], start, size
+                )
+            return buffer
+        if not np.can_cast(data.dtype, buffer.dtype):
+            # keep the same type promotion rules as concatenating the arrays
+            # would
+            buffer = buffer.astype(np.result_type(buffer.dtype, data.dtype))
+        buffer[start : start + len(data)] = data
+        return buffer
+
+    @staticmethod
+    def _slice(buffer: Union[dict, np.ndarray], index: slice):
+        if isinstance(buffer, dict):
+            return {
+                k: TrajectoryBuffer._slice(v, index) for k, v in buffer.items()
+            }
+        return buffer[index]
+
+    def column(self, field: str) -> Optional[Union[dict, np.ndarray]]:
+        """Returns a view over the recorded rows of the given field, or None if
+        it is not stored"""
+        if field not in self._columns:
+            return None
+        return self._slice(self._columns[field], slice(0, self._size))
+
+    def drop(self, field: str) -> None:
+        self._columns.pop(field, None)
+
+    def append(self, **rows: Union[dict, np.ndarray]) -> None:
+        """Appends rows (batched along a leading time dimension) to each of the
+        given fields
+
+        All stored fields must be given, and fields given as None are dropped
+        from the buffer
+        """
+        num_rows = len(rows["done"])
+        for field in list(self._columns.keys()):
+            if rows.get(field) is None:
+                self.drop(field)
+        if self._size + num_rows > self._capacity:
+            while self._size + num_rows > self._capacity:
+                self._capacity *= 2
+            for field, buffer in self._columns.items():
+                self._columns[field] = self._resize(
+                    buffer, self._capacity, self._size
+                )
+        for field, buffer in self._columns.items():
+            self._columns[field] = self._write(
+                buffer, rows[field], self._size, self._size
+            )
+        self._size += num_rows
+
+    def truncate(self, start: int) -> None:
+        """Drops the rows before `start`, moving the remaining ones to the front
+        of the buffer"""
+        if start <= 0:
+            return
+        remaining = self._size - start
+        for field, buffer in self._columns.items():
+            self._columns[field] = self._write(
+                buffer,
+                self._slice(buffer, slice(start, self._size)),
+                0,
+                remaining,
+            )
+        self._size = remaining
+        self.env_episode_ptr -= start
+
+    @property
+    def state(self):
+        return self.column("state")
+
+    @property
+    def observation(self):
+        return self.column("observation")
+
+    @property
+    def action(self):
+        return self.column("action")
+
+    @property
+    def reward(self):
+        return self.column("reward")
+
+    @property
+    def terminated(self):
+        return self.column("terminated")
+
+    @property
+    def truncated(self):
+        return self.column("truncated")
+
+    @property
+    def done(self):
+        return self.column("done")
+
+    @property
+    def success(self):
+        return self.column("success")
+
+    @property
+    def fail(self):
+        return self.column("fail")
+
+
+class FrameStore:
+    """Growable (capacity, num_views, H, W, 3) uint8 buffer for the frames of
+    each camera view
+
+    Frames are written in place into preallocated memory, and the per-view
+    stacks are exposed as views (not copies) into that memory. Resetting only
+    moves the cursor back to the start, so the buffer is reused across episodes.
+    Views returned by `view`/`views` are only valid until the next `reset` or
+    until the buffer grows.
+
+    Args:
+        num_views: number of camera views tiled side by side in each rendered
+            image
+        capacity: number of frames to preallocate, doubled whenever the buffer
+            is full
+    """
+
+    def __init__(
+        self, num_views: int = len(MULTI_VIEW_NAMES), capacity: int = 128
+    ) -> None:
+        self.num_views = num_views
+        self._capacity = capacity
+        self._frames: Optional[np.ndarray] = None
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return self._cursor
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def _allocate(self, frame_shape) -> None:
+        self._frames = np.empty(
+            (self._capacity, self.num_views, *frame_shape), dtype=np.uint8
+        )
+
+    def _grow(self) -> None:
+        old_frames = self._frames
+        self._capacity *= 2
+        self._allocate(old_frames.shape[2:])
+        self._frames[: self._cursor] = old_frames[: self._cursor]
+
+    def append(self, tiled_image: np.ndarray, width: int) -> None:
+        """Splits a (H, >= num_views * width, 3) image into its views and stores
+        them in the next slot"""
+        height = tiled_image.shape[0]
+        if self._frames is None or self._frames.shape[2:4] != (height, width):
+            self._cursor = 0
+            self._allocate((height, width, tiled_image.shape[-1]))
+        elif self._cursor == self._capacity:
+            self._grow()
+        tiled_views = tiled_image[:, : self.num_views * width].reshape(
+            height, self.num_views, width, -1
+        )
+        self._frames[self._cursor] = tiled_views.transpose(1, 0, 2, 3)
+        self._cursor += 1
+
+    def view(self, view_idx: int) -> np.ndarray:
+        """Returns a (T, H, W, 3) view over the stored frames of the given
+        camera view"""
+        if self._frames is None:
+            return np.empty((0, 0, 0, 3), dtype=np.uint8)
+        return self._frames[: self._cursor, view_idx]
+
+    @property
+    def views(self) -> List[np.ndarray]:
+        return [self.view(i) for i in range(self.num_views)]
+
+    def reset(self) -> None:
+        self._cursor = 0
+
+    def extend(self, frames: np.ndarray) -> None:
+        """Stores (T, num_views, H, W, 3) frames that are already split into
+        their views"""
+        if self._frames is None or self._frames.shape[2:] != frames.shape[2:]:
+            self._cursor = 0
+            self._capacity = max(self._capacity, len(frames))
+            self._allocate(frames.shape[2:])
+        while self._cursor + len(frames) > self._capacity:
+            self._grow()
+        self._frames[self._cursor : self._cursor + len(frames)] = frames
+        self._cursor += len(frames)
+
+
+class RecordEpisode(gym.Wrapper):
+    """Record trajectories or videos for episodes. You generally should always
+    apply this wrapper last, particularly if you include observation wrappers
+    which modify the returned observations. The only wrappers that may go after
+    this one is any of the vector env interface wrappers that map the maniskill
+    env to a e.g. gym vector env interface.
+
+    Trajectory data is saved with two files, the actual data in a .h5 file via
+    H5py and metadata in a JSON file of the same basename. While recording, the
+    metadata of each episode is appended to a `.episodes.jsonl` log instead,
+    which is compacted into the JSON file (and removed) when the wrapper is
+    closed. See `EpisodeIndex` and `load_episode_index` to recover it after a
+    crash.
 
     Each JSON file contains:
 
-    - `env_info` (Dict): task (also known as environment) information, which can be used to initialize the task
+    - `env_info` (Dict): task (also known as environment) information, which can
+      be used to initialize the task
     - `env_id` (str): task id
     - `max_episode_steps` (int)
-    - `env_kwargs` (Dict): keyword arguments to initialize the task. **Essential to recreate the environment.**
+    - `env_kwargs` (Dict): keyword arguments to initialize the task. **Essential
+      to recreate the environment.**
     - `episodes` (List[Dict]): episode information
-    - `source_type` (Optional[str]): a simple category string describing what process generated the trajectory data. ManiSkill official datasets will usually write one of "human", "motionplanning", or "rl" at the moment.
-    - `source_desc` (Optional[str]): a longer explanation of how the data was generated.
+    - `source_type` (Optional[str]): a simple category string describing what
+      process generated the trajectory data. ManiSkill official datasets will
+      usually write one of "human", "motionplanning", or "rl" at the moment.
+    - `source_desc` (Optional[str]): a longer explanation of how the data was
+      generated.
 
     The episode information (the element of `episodes`) includes:
 
     - `episode_id` (int): a unique id to index the episode
-    - `reset_kwargs` (Dict): keyword arguments to reset the task. **Essential to reproduce the trajectory.**
+    - `reset_kwargs` (Dict): keyword arguments to reset the task. **Essential to
+      reproduce the trajectory.**
     - `control_mode` (str): control mode used for the episode.
     - `elapsed_steps` (int): trajectory length
     - `info` (Dict): information at the end of the episode.
 
-    With just the meta data, you can reproduce the task the same way it was created when the trajectories were collected as so:
+    With just the meta data, you can reproduce the task the same way it was
+    created when the trajectories were collected as so:
 
     ```python
     env = gym.make(env_info["env_id"], **env_info["env_kwargs"])
@@ -147,19 +604,30 @@ class RecordEpisode(gym.Wrapper):
     env.reset(**episode["reset_kwargs"])
     ```
 
-    Each HDF5 demonstration dataset consists of multiple trajectories. The key of each trajectory is `traj_{episode_id}`, e.g., `traj_0`.
+    Each HDF5 demonstration dataset consists of multiple trajectories. The key
+    of each trajectory is `traj_{episode_id}`, e.g., `traj_0`. With
+    `trajectory_storage="chunked"` the trajectories are instead appended to
+    shared datasets with the same keys (see `ChunkedTrajectoryStore`).
 
     Each trajectory is an `h5py.Group`, which contains:
 
     - actions: [T, A], `np.float32`. `T` is the number of transitions.
-    - terminated: [T], `np.bool_`. It indicates whether the task is terminated or not at each time step.
-    - truncated: [T], `np.bool_`. It indicates whether the task is truncated or not at each time step.
-    - env_states: [T+1, D], `np.float32`. Environment states. It can be used to set the environment to a certain state via `env.set_state_dict`. However, it may not be enough to reproduce the trajectory.
-    - success (optional): [T], `np.bool_`. It indicates whether the task is successful at each time step. Included if task defines success.
-    - fail (optional): [T], `np.bool_`. It indicates whether the task is in a failure state at each time step. Included if task defines failure.
+    - terminated: [T], `np.bool_`. It indicates whether the task is terminated
+      or not at each time step.
+    - truncated: [T], `np.bool_`. It indicates whether the task is truncated or
+      not at each time step.
+    - env_states: [T+1, D], `np.float32`. Environment states. It can be used to
+      set the environment to a certain state via `env.set_state_dict`. However,
+      it may not be enough to reproduce the trajectory.
+    - success (optional): [T], `np.bool_`. It indicates whether the task is
+      successful at each time step. Included if task defines success.
+    - fail (optional): [T], `np.bool_`. It indicates whether the task is in a
+      failure state at each time step. Included if task defines failure.
     - obs (optional): [T+1, D] observations.
 
-    Note that env_states is in a dictionary form (and observations may be as well depending on obs_mode), where it is formatted as a dictionary of lists. For example, a typical environment state looks like this:
+    Note that env_states is in a dictionary form (and observations may be as
+    well depending on obs_mode), where it is formatted as a dictionary of lists.
+    For example, a typical environment state looks like this:
 
     ```python
     env_state = env.get_state_dict()
@@ -176,42 +644,111 @@ class RecordEpisode(gym.Wrapper):
     }
     \"\"\"
     ```
-    In the trajectory file env_states will be the same structure but each value/leaf in the dictionary will be a sequence of states representing the state of that particular entity in the simulation over time.
+    In the trajectory file env_states will be the same structure but each
+    value/leaf in the dictionary will be a sequence of states representing the
+    state of that particular entity in the simulation over time.
 
-    In practice it is may be more useful to use slices of the env_states data (or the observations data), which can be done with
+    In practice it is may be more useful to use slices of the env_states data
+    (or the observations data), which can be done with
 
     ```python
     import mani_skill.trajectory.utils as trajectory_utils
     env_states = trajectory_utils.dict_to_list_of_dicts(env_states)
-    # now env_states[i] is the same as the data env.get_state_dict() returned at timestep i
+    # now env_states[i] is the same as the data env.get_state_dict()
+    # returned at timestep i
     i = 10
     env_state_i = trajectory_utils.index_dict(env_states, i)
-    # now env_state_i is the same as the data env.get_state_dict() returned at timestep i
+    # now env_state_i is the same as the data env.get_state_dict()
+    # returned at timestep i
     ```
 
     Args:
         env: the environment to record
         output_dir: output directory
         save_trajectory: whether to save trajectory
-        trajectory_name: name of trajectory file (.h5). Use timestamp if not provided.
+        trajectory_name: name of trajectory file (.h5). Use timestamp if not
+            provided.
         save_video: whether to save video
-        info_on_video: whether to write data about reward, action, and data in the info object to the video. The first video frame is generally the result
-            of the first env.reset() (visualizing the first observation). Text is written on frames after that, showing the action taken to get to that
-            environment state and reward.
-        save_on_reset: whether to save the previous trajectory (and video of it if `save_video` is True) automatically when resetting.
-            Not that for environments simulated on the GPU (to leverage fast parallel rendering) you must
-            set `max_steps_per_video` to a fixed number so that every `max_steps_per_video` steps a video is saved. This is
-            required as there may be partial environment resets which makes it ambiguous about how to save/cut videos.
-        save_video_trigger: a function that takes the current number of elapsed environment steps and outputs a bool. If output is True, will start saving that timestep to the video.
-        max_steps_per_video: how many steps can be recorded into a single video before flushing the video. If None this is not used. A internal step counter is maintained to do this.
-            If the video is flushed at any point, the step counter is reset to 0.
+        info_on_video: whether to write data about reward, action, and data in
+            the info object to the video. The first video frame is generally the
+            result of the first env.reset() (visualizing the first observation).
+            Text is written on frames after that, showing the action taken to
+            get to that environment state and reward.
+        save_on_reset: whether to save the previous trajectory (and video of it
+            if `save_video` is True) automatically when resetting. Not that for
+            environments simulated on the GPU (to leverage fast parallel
+            rendering) you must set `max_steps_per_video` to a fixed number so
+            that every `max_steps_per_video` steps a video is saved. This is
+            required as there may be partial environment resets which makes it
+            ambiguous about how to save/cut videos.
+        save_video_trigger: a function that takes the current number of elapsed
+            environment steps and outputs a bool. If output is True, will start
+            saving that timestep to the video.
+        max_steps_per_video: how many steps can be recorded into a single video
+            before flushing the video. If None this is not used. A internal step
+            counter is maintained to do this. If the video is flushed at any
+            point, the step counter is reset to 0.
         clean_on_close: whether to rename and prune trajectories when closed.
             See `clean_trajectories` for details.
         record_reward: whether to record the reward in the trajectory data
-        record_env_state: whether to record the environment state in the trajectory data
+        record_env_state: whether to record the environment state in the
+            trajectory data
         video_fps (int): The FPS of the video to generate if save_video is True
-        source_type (Optional[str]): a word to describe the source of the actions used to record episodes (e.g. RL, motionplanning, teleoperation)
-        source_desc (Optional[str]): A longer description describing how the demonstrations are collected
+        video_quality (float): the quality of the multi-view videos, from 0
+            (lowest) to 10 (highest). Defaults to the quality of
+            `images_to_video`, which encodes the other videos
+        async_write (bool): whether to write trajectories to disk (h5 datasets,
+            compression and the JSON metadata) on a background thread, so
+            stepping can continue while a flushed episode is being saved. Call
+            `drain` to wait for pending writes; `close` does so automatically.
+            The writes only overlap with the stepping while one of them releases
+            the GIL (the compression of h5py, the simulation and the rendering
+            do), so this pays off with compressed camera observations but not
+            with small state-only episodes, see `ex_bench_background_writer.py`
+        max_pending_writes (int): how many flushed episodes can wait for the
+            background writer before `flush_trajectory` blocks
+        image_format (str): format of the per-view frames saved by
+            `flush_multi_images`, one of "png", "webp" (lossless) or "npy".
+            Image packs are always saved as png
+        image_compress_level (Optional[int]): zlib level (0-9) for png or
+            encoding method (0-6) for webp frames and packs. Uses PIL's defaults
+            if None
+        image_workers (int): number of threads used to encode the frames and
+            image packs
+        multi_video_layout (str): "separate" to save one video per camera view
+            with `flush_video_multi` (encoded concurrently), or "stacked" to
+            save a single video with the views side by side
+        stream_multi_video (bool): whether to send every captured frame straight
+            to the encoders of the multi-view videos, instead of encoding them
+            from the stored frames when flushing
+        store_frames (bool): whether to keep the frames of each view in memory,
+            which `flush_multi_images` and `flush_multi_images_pack` need.
+            Together with `stream_multi_video=True`, setting it to False keeps
+            memory flat no matter how long the episodes are
+        defer_rendering (bool): whether to only record the env state
+            (`get_state_dict()`) where a frame would be captured, and render the
+            frames by replaying the states with `set_state_dict` once a flush
+            saves them (see `render_deferred`). Rendering then only costs time
+            for the videos and images that are kept. The states of a video that
+            were not rendered are dropped when the next video starts. Cannot be
+            used with `info_on_video=True`
+        trajectory_storage (str): "groups" to save every trajectory into its own
+            group (`traj_{episode_id}`), or "chunked" to append them to shared
+            chunked datasets, one per key, with an index of the rows of each
+            episode. Files with many episodes open and read faster with the
+            latter, see `ChunkedTrajectoryStore` and `load_trajectory`. Chunked
+            recordings are not cleaned on close, the ids of the episodes saved
+            are already consecutive
+        h5_compression (Optional[Dict[str, str]]): the compressor ("none",
+            "lzf", "gzip" or "blosc-lz4", which needs the hdf5plugin package) of
+            the datasets, by name (e.g. "rgb") or by path (e.g.
+            "obs/sensor_data/base_camera/rgb"). The rgb, depth and seg images
+            are compressed with gzip unless given
+        source_type (Optional[str]): a word to describe the source of the
+            actions used to record episodes (e.g. RL, motionplanning,
+            teleoperation)
+        source_desc (Optional[str]): A longer description describing how the
+            demonstrations are collected
     """
 
     def __init__(
@@ -229,16 +766,34 @@ class RecordEpisode(gym.Wrapper):
         record_reward: bool = True,
         record_env_state: bool = True,
         video_fps: int = 30,
+        video_quality: float = DEFAULT_VIDEO_QUALITY,
         source_type: Optional[str] = None,
         source_desc: Optional[str] = None,
-        image_size: Optional[Dict[str, int]] = None
+        image_size: Optional[Dict[str, int]] = None,
+        async_write: bool = False,
+        max_pending_writes: int = 4,
+        image_format: str = "png",
+        image_compress_level: Optional[int] = None,
+        image_workers: int = DEFAULT_NUM_WORKERS,
+        multi_video_layout: str = "separate",
+        stream_multi_video: bool = False,
+        store_frames: bool = True,
+        defer_rendering: bool = False,
+        frame_pool: Optional[SharedFramePool] = None,
+        frame_jobs=None,
+        trajectory_storage: str = "groups",
+        h5_compression: Optional[Dict[str, str]] = None,
     ) -> None:
         super().__init__(env)
+        assert (
+            trajectory_storage in TRAJECTORY_STORAGES
+        ), f"Unknown trajectory storage {trajectory_storage}"
 
         self.output_dir = Path(output_dir)
         if save_trajectory or save_video:
             self.output_dir.mkdir(parents=True, exist_ok=True)
         self.video_fps = video_fps
+        self._video_quality = video_quality
         self._elapsed_record_steps = 0
         self._episode_id = -1
         self._video_id = -1
@@ -246,12 +801,48 @@ class RecordEpisode(gym.Wrapper):
         self._closed = False
 
         self._multi_video_id = -1
-        self._image_size = image_size if image_size else dict(width=128, height=128)
-        self._images_storage = [[], [], []]
+        self._image_size = (
+            image_size if image_size else dict(width=128, height=128)
+        )
+        self._frame_store = FrameStore()
+        self._store_frames = store_frames
+        self._multi_video_layout = multi_video_layout
+        self._video_sink: Optional[MultiViewVideoSink] = None
+        if stream_multi_video and save_video:
+            self._video_sink = MultiViewVideoSink(
+                str(self.output_dir),
+                MULTI_VIEW_NAMES,
+                fps=video_fps,
+                quality=video_quality,
+                layout=multi_video_layout,
+            )
+        self._image_sink = ImageSink(
+            num_workers=image_workers,
+            image_format=image_format,
+            compress_level=image_compress_level,
+        )
+        self._defer_rendering = defer_rendering
+        self._deferred_states: List[dict] = []
+        self._num_deferred_rendered = 0
+        if (frame_pool is None) != (frame_jobs is None):
+            raise ValueError(
+                "The frame pool and the queue of frame jobs must be given "
+                + "together"
+            )
+        if frame_pool is not None and stream_multi_video:
+            raise ValueError(
+                "Cannot stream the videos while their frames are encoded by "
+                + "another process"
+            )
+        self._frame_pool = frame_pool
+        self._frame_jobs = frame_jobs
+        self._pool_slot: Optional[int] = None
+        self._pool_frames = 0
+        self._pending_job: Dict[str, str] = {}
 
         self.save_video_trigger = save_video_trigger
 
-        self._trajectory_buffer: Step = None
+        self._trajectory_buffer: TrajectoryBuffer = None
 
         self.max_steps_per_video = max_steps_per_video
         self.max_episode_steps = gym_utils.find_max_episode_steps_value(env)
@@ -259,12 +850,13 @@ class RecordEpisode(gym.Wrapper):
         self.save_on_reset = save_on_reset
         self.save_trajectory = save_trajectory
         if self.base_env.num_envs > 1 and save_video:
-            assert (
-                max_steps_per_video is not None
-            ), "On GPU parallelized environments, \
-                there must be a given max steps per video value in order to flush videos in order \
-                to avoid issues caused by partial resets. If your environment does not do partial \
-                resets you may set max_steps_per_video equal to the max_episode_steps"
+            assert max_steps_per_video is not None, (
+                "On GPU parallelized environments, there must be a given max "
+                + "steps per video value in order to flush videos in order to "
+                + "avoid issues caused by partial resets. If your environment "
+                + "does not do partial resets you may set max_steps_per_video "
+                + "equal to the max_episode_steps"
+            )
         self.clean_on_close = clean_on_close
         self.record_reward = record_reward
         self.record_env_state = record_env_state
@@ -272,7 +864,15 @@ class RecordEpisode(gym.Wrapper):
             if not trajectory_name:
                 trajectory_name = time.strftime("%Y%m%d_%H%M%S")
 
-            self._h5_file = h5py.File(self.output_dir / f"{trajectory_name}.h5", "w")
+            self._h5_file = h5py.File(
+                self.output_dir / f"{trajectory_name}.h5", "w"
+            )
+            self._compression = CompressionPolicy(h5_compression)
+            self._trajectory_store: Optional[ChunkedTrajectoryStore] = None
+            if trajectory_storage == "chunked":
+                self._trajectory_store = ChunkedTrajectoryStore(
+                    self._h5_file, self._compression
+                )
 
             # Use a separate json to store non-array data
             self._json_path = self._h5_file.filename.replace(".h5", ".json")
@@ -289,12 +889,21 @@ class RecordEpisode(gym.Wrapper):
                 self._json_data["source_type"] = source_type
             if source_desc is not None:
                 self._json_data["source_desc"] = source_desc
+            self._episode_index = EpisodeIndex(self._json_path, self._json_data)
+        self._writer: Optional[BackgroundWriter] = None
+        if self.save_trajectory and async_write:
+            self._writer = BackgroundWriter(max_pending=max_pending_writes)
         self._save_video = save_video
         self.info_on_video = info_on_video
         self.render_images = []
         if info_on_video and self.num_envs > 1:
             raise ValueError(
-                "Cannot turn info_on_video=True when the number of environments parallelized is > 1"
+                "Cannot turn info_on_video=True when the number of "
+                + "environments parallelized is > 1"
+            )
+        if info_on_video and defer_rendering:
+            raise ValueError(
+                "Cannot turn info_on_video=True when rendering is deferred"
             )
         self.video_nrows = int(np.sqrt(self.unwrapped.num_envs))
 
@@ -333,9 +942,15 @@ class RecordEpisode(gym.Wrapper):
         # Convert and store the tiled image into our storage -------------------
         img_sq = np.squeeze(img)
         width = self._image_size["width"]
-        self._images_storage[0].append(img_sq[:, 0:width, :].copy())
-        self._images_storage[1].append(img_sq[:, width:2*width, :].copy())
-        self._images_storage[2].append(img_sq[:, 2*width:3*width, :].copy())
+        if self._store_frames:
+            self._store_frame(img_sq, width)
+        if self._video_sink is not None:
+            self._video_sink.append(
+                [
+                    img_sq[:, i * width : (i + 1) * width]
+                    for i in range(len(MULTI_VIEW_NAMES))
+                ]
+            )
         # ----------------------------------------------------------------------
         if len(img.shape) > 3:
             if len(img) == 1:
@@ -344,6 +959,96 @@ class RecordEpisode(gym.Wrapper):
                 img = tile_images(img, nrows=self.video_nrows)
         return img
 
+    def _store_frame(self, tiled_image: np.ndarray, width: int) -> None:
+        if self._frame_pool is not None and len(self._frame_store) == 0:
+            if self._pool_slot is None:
+                self._pool_slot = self._frame_pool.acquire()
+            if (
+                self._pool_slot is not None
+                and self._pool_frames < self._frame_pool.spec.max_frames
+                and self._frame_pool.fits(tiled_image, width)
+            ):
+                self._frame_pool.write(
+                    self._pool_slot, self._pool_frames, tiled_image, width
+                )
+                self._pool_frames += 1
+                return
+            # No free slot (the encoder is behind) or the episode doesn't fit in
+            # one, so the rest of the episode is kept and encoded in this
+            # process, without waiting for the encoder
+            if self._pool_frames > 0:
+                self._frame_store.extend(
+                    self._frame_pool.frames[
+                        self._pool_slot, : self._pool_frames
+                    ]
+                )
+                self._pool_frames = 0
+        self._frame_store.append(tiled_image, width=width)
+
+    @property
+    def num_stored_frames(self) -> int:
+        """The number of frames of each view stored for the images and the
+        videos of each view"""
+        return self._pool_frames + len(self._frame_store)
+
+    def _submit_frame_job(self) -> None:
+        """Hands the frames in the slot of the pool over to the encoder if they
+        have outputs to write, otherwise keeps the slot for the next episode"""
+        if self._pending_job and self._pool_frames > 0:
+            self._frame_jobs.put(
+                FrameJob(
+                    slot=self._pool_slot,
+                    num_frames=self._pool_frames,
+                    output_dir=str(self.output_dir),
+                    video_fps=self.video_fps,
+                    video_quality=self._video_quality,
+                    video_layout=self._multi_video_layout,
+                    **self._pending_job,
+                )
+            )
+            self._pool_slot = None
+        self._pool_frames = 0
+        self._pending_job = {}
+
+    def record_frame(self):
+        """Captures the frame of the current env state, or only records the
+        state when rendering is deferred"""
+        if self._defer_rendering:
+            self._deferred_states.append(
+                common.to_numpy(self.base_env.get_state_dict())
+            )
+        else:
+            self.render_images.append(self.capture_image())
+
+    @property
+    def num_deferred_pending(self) -> int:
+        """The number of recorded env states whose frames haven't been rendered
+        yet"""
+        return len(self._deferred_states) - self._num_deferred_rendered
+
+    def render_deferred(self) -> int:
+        """Renders the frames of the env states recorded with deferred
+        rendering, by setting each state and capturing its image, then restores
+        the current env state
+
+        Returns:
+            The number of frames that were rendered
+        """
+        states = self._deferred_states[self._num_deferred_rendered :]
+        if len(states) == 0:
+            return 0
+        current_state = self.base_env.get_state_dict()
+        for state in states:
+            self.base_env.set_state_dict(state)
+            self.render_images.append(self.capture_image())
+        self.base_env.set_state_dict(current_state)
+        self._num_deferred_rendered = len(self._deferred_states)
+        return len(states)
+
+    def _clear_deferred(self) -> None:
+        self._deferred_states = []
+        self._num_deferred_rendered = 0
+
     def reset(
         self,
         *args,
@@ -356,10 +1061,13 @@ class RecordEpisode(gym.Wrapper):
             if self.save_video and self.num_envs == 1:
                 self.flush_video()
                 self.flush_video_multi()
-            # if doing a full reset then we flush all trajectories including incompleted ones
+            # if doing a full reset then we flush all trajectories including
+            # incompleted ones
             if self._trajectory_buffer is not None:
                 if "env_idx" not in options:
-                    self.flush_trajectory(env_idxs_to_flush=np.arange(self.num_envs))
+                    self.flush_trajectory(
+                        env_idxs_to_flush=np.arange(self.num_envs)
+                    )
                 else:
                     self.flush_trajectory(
                         env_idxs_to_flush=common.to_numpy(options["env_idx"])
@@ -367,26 +1075,39 @@ class RecordEpisode(gym.Wrapper):
 
         obs, info = super().reset(*args, seed=seed, options=options, **kwargs)
         if info["reconfigure"]:
-            # if we reconfigure, there is the possibility that state dictionary looks different now
-            # so trajectory buffer must be wiped
+            # if we reconfigure, there is the possibility that state dictionary
+            # looks different now so trajectory buffer must be wiped
             self._trajectory_buffer = None
         if self.save_trajectory:
             state_dict = self.base_env.get_state_dict()
             action = common.batch(self.single_action_space.sample())
             first_step = Step(
-                state=common.to_numpy(common.batch(state_dict)),
+                state=(
+                    common.to_numpy(common.batch(state_dict))
+                    if self.record_env_state
+                    else None
+                ),
                 observation=common.to_numpy(common.batch(obs)),
-                # note first reward/action etc. are ignored when saving trajectories to disk
-                action=common.to_numpy(common.batch(action.repeat(self.num_envs, 0))),
-                reward=np.zeros(
-                    (
-                        1,
-                        self.num_envs,
-                    ),
-                    dtype=float,
+                # note first reward/action etc. are ignored when saving
+                # trajectories to disk
+                action=common.to_numpy(
+                    common.batch(action.repeat(self.num_envs, 0))
                 ),
-                # terminated and truncated are fixed to be True at the start to indicate the start of an episode.
-                # an episode is done when one of these is True otherwise the trajectory is incomplete / a partial episode
+                reward=(
+                    np.zeros(
+                        (
+                            1,
+                            self.num_envs,
+                        ),
+                        dtype=float,
+                    )
+                    if self.record_reward
+                    else None
+                ),
+                # terminated and truncated are fixed to be True at the start to
+                # indicate the start of an episode. an episode is done when one
+                # of these is True otherwise the trajectory is incomplete / a
+                # partial episode
                 terminated=np.ones((1, self.num_envs), dtype=bool),
                 truncated=np.ones((1, self.num_envs), dtype=bool),
                 done=np.ones((1, self.num_envs), dtype=bool),
@@ -398,8 +1119,10 @@ class RecordEpisode(gym.Wrapper):
             if "env_idx" in options:
                 env_idx = common.to_numpy(options["env_idx"])
             if self._trajectory_buffer is None:
-                # Initialize trajectory buffer on the first episode based on given observation (which should be generated after all wrappers)
-                self._trajectory_buffer = first_step
+                # Initialize trajectory buffer on the first episode based on
+                # given observation (which should be generated after all
+                # wrappers)
+                self._trajectory_buffer = TrajectoryBuffer(first_step)
             else:
 
                 def recursive_replace(x, y):
@@ -409,16 +1132,22 @@ class RecordEpisode(gym.Wrapper):
                         for k in x.keys():
                             recursive_replace(x[k], y[k])
 
-                # TODO (stao): how do we store states from GPU sim of tasks with objects not in every sub-scene?
-                # Maybe we shouldn't?
+                # TODO (stao): how do we store states from GPU sim of tasks with
+                # objects not in every sub-scene? Maybe we shouldn't?
                 if self.record_env_state:
-                    recursive_replace(self._trajectory_buffer.state, first_step.state)
+                    recursive_replace(
+                        self._trajectory_buffer.state, first_step.state
+                    )
                 recursive_replace(
                     self._trajectory_buffer.observation, first_step.observation
                 )
-                recursive_replace(self._trajectory_buffer.action, first_step.action)
+                recursive_replace(
+                    self._trajectory_buffer.action, first_step.action
+                )
                 if self.record_reward:
-                    recursive_replace(self._trajectory_buffer.reward, first_step.reward)
+                    recursive_replace(
+                        self._trajectory_buffer.reward, first_step.reward
+                    )
                 recursive_replace(
                     self._trajectory_buffer.terminated, first_step.terminated
                 )
@@ -431,7 +1160,9 @@ class RecordEpisode(gym.Wrapper):
                         self._trajectory_buffer.success, first_step.success
                     )
                 if self._trajectory_buffer.fail is not None:
-                    recursive_replace(self._trajectory_buffer.fail, first_step.fail)
+                    recursive_replace(
+                        self._trajectory_buffer.fail, first_step.fail
+                    )
         if options is not None and "env_idx" in options:
             options["env_idx"] = common.to_numpy(options["env_idx"])
         self.last_reset_kwargs = copy.deepcopy(dict(options=options, **kwargs))
@@ -441,62 +1172,53 @@ class RecordEpisode(gym.Wrapper):
 
     def step(self, action):
         if self.save_video and self._video_steps == 0:
-            # save the first frame of the video here (s_0) instead of inside reset as user
-            # may call env.reset(...) multiple times but we want to ignore empty trajectories
-            self.render_images.append(self.capture_image())
+            if self._defer_rendering:
+                # the states (and frames rendered from them) of the previous
+                # video belong to a flushed video
+                self._clear_deferred()
+                self.render_images = []
+            # save the first frame of the video here (s_0) instead of inside
+            # reset as user may call env.reset(...) multiple times but we want
+            # to ignore empty trajectories
+            self.record_frame()
         obs, rew, terminated, truncated, info = super().step(action)
 
         if self.save_trajectory:
             state_dict = self.base_env.get_state_dict()
-            if self.record_env_state:
-                self._trajectory_buffer.state = common.append_dict_array(
-                    self._trajectory_buffer.state,
-                    common.to_numpy(common.batch(state_dict)),
-                )
-            self._trajectory_buffer.observation = common.append_dict_array(
-                self._trajectory_buffer.observation,
-                common.to_numpy(common.batch(obs)),
-            )
-
-            self._trajectory_buffer.action = common.append_dict_array(
-                self._trajectory_buffer.action,
-                common.to_numpy(common.batch(action)),
-            )
-            if self.record_reward:
-                self._trajectory_buffer.reward = common.append_dict_array(
-                    self._trajectory_buffer.reward,
-                    common.to_numpy(common.batch(rew)),
-                )
-            self._trajectory_buffer.terminated = common.append_dict_array(
-                self._trajectory_buffer.terminated,
-                common.to_numpy(common.batch(terminated)),
-            )
-            self._trajectory_buffer.truncated = common.append_dict_array(
-                self._trajectory_buffer.truncated,
-                common.to_numpy(common.batch(truncated)),
-            )
             done = terminated | truncated
-            self._trajectory_buffer.done = common.append_dict_array(
-                self._trajectory_buffer.done,
-                common.to_numpy(common.batch(done)),
+            self._trajectory_buffer.append(
+                state=(
+                    common.to_numpy(common.batch(state_dict))
+                    if self.record_env_state
+                    else None
+                ),
+                observation=common.to_numpy(common.batch(obs)),
+                action=common.to_numpy(common.batch(action)),
+                reward=(
+                    common.to_numpy(common.batch(rew))
+                    if self.record_reward
+                    else None
+                ),
+                terminated=common.to_numpy(common.batch(terminated)),
+                truncated=common.to_numpy(common.batch(truncated)),
+                done=common.to_numpy(common.batch(done)),
+                success=(
+                    common.to_numpy(common.batch(info["success"]))
+                    if "success" in info
+                    else None
+                ),
+                fail=(
+                    common.to_numpy(common.batch(info["fail"]))
+                    if "fail" in info
+                    else None
+                ),
             )
-            if "success" in info:
-                self._trajectory_buffer.success = common.append_dict_array(
-                    self._trajectory_buffer.success,
-                    common.to_numpy(common.batch(info["success"])),
-                )
-            else:
-                self._trajectory_buffer.success = None
-            if "fail" in info:
-                self._trajectory_buffer.fail = common.append_dict_array(
-                    self._trajectory_buffer.fail,
-                    common.to_numpy(common.batch(info["fail"])),
-                )
-            else:
-                self._trajectory_buffer.fail = None
             self._last_info = common.to_numpy(info)
 
-        if self.save_video:
+        if self.save_video and self._defer_rendering:
+            self._video_steps += 1
+            self.record_frame()
+        elif self.save_video:
             self._video_steps += 1
             image = self.capture_image()
 
@@ -510,9 +1232,12 @@ class RecordEpisode(gym.Wrapper):
                     f"reward: {rew:.3f}",
                     "action: {}".format(",".join([f"{x:.2f}" for x in action])),
                 ]
-                image = put_info_on_image(image, scalar_info, extras=extra_texts)
+                image = put_info_on_image(
+                    image, scalar_info, extras=extra_texts
+                )
 
             self.render_images.append(image)
+        if self.save_video:
             if (
                 self.max_steps_per_video is not None
                 and self._video_steps >= self.max_steps_per_video
@@ -528,15 +1253,21 @@ class RecordEpisode(gym.Wrapper):
         ignore_empty_transition=True,
         env_idxs_to_flush=None,
         save: bool = True,
+        extra_info: Optional[dict] = None,
     ):
         """
         Flushes a trajectory and by default saves it to disk
 
         Arguments:
-            verbose (bool): whether to print out information about the flushed trajectory
-            ignore_empty_transition (bool): whether to ignore trajectories that did not have any actions
-            env_idxs_to_flush: which environments by id to flush. If None, all environments are flushed.
+            verbose (bool): whether to print out information about the flushed
+                trajectory
+            ignore_empty_transition (bool): whether to ignore trajectories that
+                did not have any actions
+            env_idxs_to_flush: which environments by id to flush. If None, all
+                environments are flushed.
             save (bool): whether to save the trajectory to disk
+            extra_info (Optional[dict]): more metadata to store with each saved
+                episode in the JSON file
         """
         flush_count = 0
         if env_idxs_to_flush is None:
@@ -550,74 +1281,9 @@ class RecordEpisode(gym.Wrapper):
             if save:
                 self._episode_id += 1
                 traj_id = "traj_{}".format(self._episode_id)
-                group = self._h5_file.create_group(traj_id, track_order=True)
-
-                def recursive_add_to_h5py(
-                    group: h5py.Group, data: Union[dict, Array], key
-                ):
-                    """simple recursive data insertion for nested data structures into h5py, optimizing for visual data as well"""
-                    if isinstance(data, dict):
-                        subgrp = group.create_group(key, track_order=True)
-                        for k in data.keys():
-                            recursive_add_to_h5py(subgrp, data[k], k)
-                    else:
-                        if key == "rgb":
-                            # NOTE(jigu): It is more efficient to use gzip than png for a sequence of images.
-                            group.create_dataset(
-                                "rgb",
-                                data=data[start_ptr:end_ptr, env_idx],
-                                dtype=data.dtype,
-                                compression="gzip",
-                                compression_opts=5,
-                            )
-                        elif key == "depth":
-                            # NOTE (stao): By default now cameras in ManiSkill return depth values of type uint16 for numpy
-                            group.create_dataset(
-                                key,
-                                data=data[start_ptr:end_ptr, env_idx],
-                                dtype=data.dtype,
-                                compression="gzip",
-                                compression_opts=5,
-                            )
-                        elif key == "seg":
-                            group.create_dataset(
-                                key,
-                                data=data[start_ptr:end_ptr, env_idx],
-                                dtype=data.dtype,
-                                compression="gzip",
-                                compression_opts=5,
-                            )
-                        else:
-                            group.create_dataset(
-                                key,
-                                data=data[start_ptr:end_ptr, env_idx],
-                                dtype=data.dtype,
-                            )
-
-                # Observations need special processing
-                if isinstance(self._trajectory_buffer.observation, dict):
-                    recursive_add_to_h5py(
-                        group, self._trajectory_buffer.observation, "obs"
-                    )
-                elif isinstance(self._trajectory_buffer.observation, np.ndarray):
-                    if self.cpu_wrapped_env:
-                        group.create_dataset(
-                            "obs",
-                            data=self._trajectory_buffer.observation[start_ptr:end_ptr],
-                            dtype=self._trajectory_buffer.observation.dtype,
-                        )
-                    else:
-                        group.create_dataset(
-                            "obs",
-                            data=self._trajectory_buffer.observation[
-                                start_ptr:end_ptr, env_idx
-                            ],
-                            dtype=self._trajectory_buffer.observation.dtype,
-                        )
-                else:
-                    raise NotImplementedError(
-                        f"RecordEpisode wrapper does not know how to handle observation data of type {type(self._trajectory_buffer.observation)}"
-                    )
+                episode_data = self._collect_episode(
+                    env_idx, start_ptr, end_ptr
+                )
                 episode_info = dict(
                     episode_id=self._episode_id,
                     episode_seed=self.base_env._episode_seed,
@@ -627,70 +1293,41 @@ class RecordEpisode(gym.Wrapper):
                 if self.num_envs == 1:
                     episode_info.update(reset_kwargs=self.last_reset_kwargs)
                 else:
-                    # NOTE (stao): With multiple envs in GPU simulation, reset_kwargs do not make much sense
+                    # NOTE (stao): With multiple envs in GPU simulation,
+                    # reset_kwargs do not make much sense
                     episode_info.update(reset_kwargs=dict())
-
-                # slice some data to remove the first dummy frame.
-                actions = common.index_dict_array(
-                    self._trajectory_buffer.action,
-                    (slice(start_ptr + 1, end_ptr), env_idx),
-                )
-                terminated = self._trajectory_buffer.terminated[
-                    start_ptr + 1 : end_ptr, env_idx
-                ]
-                truncated = self._trajectory_buffer.truncated[
-                    start_ptr + 1 : end_ptr, env_idx
-                ]
-                if isinstance(self._trajectory_buffer.action, dict):
-                    recursive_add_to_h5py(group, actions, "actions")
-                else:
-                    group.create_dataset("actions", data=actions, dtype=np.float32)
-                group.create_dataset("terminated", data=terminated, dtype=bool)
-                group.create_dataset("truncated", data=truncated, dtype=bool)
-
                 if self._trajectory_buffer.success is not None:
-                    group.create_dataset(
-                        "success",
-                        data=self._trajectory_buffer.success[
-                            start_ptr + 1 : end_ptr, env_idx
-                        ],
-                        dtype=bool,
-                    )
                     episode_info.update(
-                        success=self._trajectory_buffer.success[end_ptr - 1, env_idx]
+                        success=self._trajectory_buffer.success[
+                            end_ptr - 1, env_idx
+                        ]
                     )
                 if self._trajectory_buffer.fail is not None:
-                    group.create_dataset(
-                        "fail",
-                        data=self._trajectory_buffer.fail[
-                            start_ptr + 1 : end_ptr, env_idx
-                        ],
-                        dtype=bool,
-                    )
                     episode_info.update(
                         fail=self._trajectory_buffer.fail[end_ptr - 1, env_idx]
                     )
-                if self.record_env_state:
-                    recursive_add_to_h5py(
-                        group, self._trajectory_buffer.state, "env_states"
-                    )
-                if self.record_reward:
-                    group.create_dataset(
-                        "rewards",
-                        data=self._trajectory_buffer.reward[
-                            start_ptr + 1 : end_ptr, env_idx
-                        ],
-                        dtype=np.float32,
+                if extra_info is not None:
+                    episode_info.update(extra_info)
+
+                if self._writer is not None:
+                    # the buffer is reused after flushing, so the writer gets
+                    # its own copy
+                    self._writer.submit(
+                        self._write_episode,
+                        traj_id,
+                        copy_dict_array(episode_data),
+                        episode_info,
                     )
-
-                self._json_data["episodes"].append(episode_info)
-                dump_json(self._json_path, self._json_data, indent=2)
+                else:
+                    self._write_episode(traj_id, episode_data, episode_info)
                 if verbose:
                     if flush_count == 1:
                         print(f"Recorded episode {self._episode_id}")
                     else:
                         print(
-                            f"Recorded episodes {self._episode_id - flush_count} to {self._episode_id}"
+                            "Recorded episodes "
+                            + f"{self._episode_id - flush_count} to "
+                            + f"{self._episode_id}"
                         )
 
         # truncate self._trajectory_buffer down to save memory
@@ -699,40 +1336,107 @@ class RecordEpisode(gym.Wrapper):
                 len(self._trajectory_buffer.done) - 1
             )
             min_env_ptr = self._trajectory_buffer.env_episode_ptr.min()
-            N = len(self._trajectory_buffer.done)
-
-            if self.record_env_state:
-                self._trajectory_buffer.state = common.index_dict_array(
-                    self._trajectory_buffer.state, slice(min_env_ptr, N)
-                )
-            self._trajectory_buffer.observation = common.index_dict_array(
-                self._trajectory_buffer.observation, slice(min_env_ptr, N)
-            )
-            self._trajectory_buffer.action = common.index_dict_array(
-                self._trajectory_buffer.action, slice(min_env_ptr, N)
+            self._trajectory_buffer.truncate(min_env_ptr)
+
+    def _collect_episode(
+        self, env_idx: int, start_ptr: int, end_ptr: int
+    ) -> Dict[str, Union[dict, np.ndarray]]:
+        """Slices the data of one episode out of the trajectory buffer, keyed by
+        the name of its h5 dataset"""
+        episode_data = dict()
+        # Observations need special processing
+        if isinstance(self._trajectory_buffer.observation, dict):
+            episode_data["obs"] = common.index_dict_array(
+                self._trajectory_buffer.observation,
+                (slice(start_ptr, end_ptr), env_idx),
+                inplace=False,
             )
-            if self.record_reward:
-                self._trajectory_buffer.reward = common.index_dict_array(
-                    self._trajectory_buffer.reward, slice(min_env_ptr, N)
-                )
-            self._trajectory_buffer.terminated = common.index_dict_array(
-                self._trajectory_buffer.terminated, slice(min_env_ptr, N)
+        elif isinstance(self._trajectory_buffer.observation, np.ndarray):
+            if self.cpu_wrapped_env:
+                episode_data["obs"] = self._trajectory_buffer.observation[
+                    start_ptr:end_ptr
+                ]
+            else:
+                episode_data["obs"] = self._trajectory_buffer.observation[
+                    start_ptr:end_ptr, env_idx
+                ]
+        else:
+            raise NotImplementedError(
+                "RecordEpisode wrapper does not know how to handle "
+                + "observation data of type "
+                + f"{type(self._trajectory_buffer.observation)}"
             )
-            self._trajectory_buffer.truncated = common.index_dict_array(
-                self._trajectory_buffer.truncated, slice(min_env_ptr, N)
+
+        # slice some data to remove the first dummy frame.
+        actions = common.index_dict_array(
+            self._trajectory_buffer.action,
+            (slice(start_ptr + 1, end_ptr), env_idx),
+            inplace=False,
+        )
+        if isinstance(actions, dict):
+            episode_data["actions"] = actions
+        else:
+            episode_data["actions"] = actions.astype(np.float32, copy=False)
+        episode_data["terminated"] = self._trajectory_buffer.terminated[
+            start_ptr + 1 : end_ptr, env_idx
+        ].astype(bool, copy=False)
+        episode_data["truncated"] = self._trajectory_buffer.truncated[
+            start_ptr + 1 : end_ptr, env_idx
+        ].astype(bool, copy=False)
+        if self._trajectory_buffer.success is not None:
+            episode_data["success"] = self._trajectory_buffer.success[
+                start_ptr + 1 : end_ptr, env_idx
+            ].astype(bool, copy=False)
+        if self._trajectory_buffer.fail is not None:
+            episode_data["fail"] = self._trajectory_buffer.fail[
+                start_ptr + 1 : end_ptr, env_idx
+            ].astype(bool, copy=False)
+        if self.record_env_state:
+            episode_data["env_states"] = common.index_dict_array(
+                self._trajectory_buffer.state,
+                (slice(start_ptr, end_ptr), env_idx),
+                inplace=False,
             )
-            self._trajectory_buffer.done = common.index_dict_array(
-                self._trajectory_buffer.done, slice(min_env_ptr, N)
+        if self.record_reward:
+            episode_data["rewards"] = self._trajectory_buffer.reward[
+                start_ptr + 1 : end_ptr, env_idx
+            ].astype(np.float32, copy=False)
+        return episode_data
+
+    def _write_episode(
+        self,
+        traj_id: str,
+        episode_data: Dict[str, Union[dict, np.ndarray]],
+        episode_info: dict,
+    ) -> None:
+        if self._trajectory_store is not None:
+            self._trajectory_store.append(
+                episode_info["episode_id"], episode_data
             )
-            if self._trajectory_buffer.success is not None:
-                self._trajectory_buffer.success = common.index_dict_array(
-                    self._trajectory_buffer.success, slice(min_env_ptr, N)
-                )
-            if self._trajectory_buffer.fail is not None:
-                self._trajectory_buffer.fail = common.index_dict_array(
-                    self._trajectory_buffer.fail, slice(min_env_ptr, N)
-                )
-            self._trajectory_buffer.env_episode_ptr -= min_env_ptr
+        else:
+            group = self._h5_file.create_group(traj_id, track_order=True)
+            for key, data in episode_data.items():
+                recursive_add_to_h5py(group, data, key, self._compression)
+        self._episode_index.append(episode_info)
+
+    def compact_episode_index(self) -> None:
+        """Writes the JSON file with the metadata of all the episodes saved so
+        far
+
+        Episodes are only appended to a log while recording, and the JSON file
+        is written when closing
+        """
+        self.drain()
+        self._episode_index.compact()
+
+    def drain(self) -> None:
+        """Waits until all trajectories handed to the background writer are on
+        disk
+
+        Raises the error of a failed write, if any
+        """
+        if self._writer is not None:
+            self._writer.drain()
 
     def flush_video(
         self,
@@ -746,17 +1450,22 @@ class RecordEpisode(gym.Wrapper):
         Flush a video of the recorded episode(s) anb by default saves it to disk
 
         Arguments:
-            name (str): name of the video file. If None, it will be named with the episode id.
+            name (str): name of the video file. If None, it will be named with
+                the episode id.
             suffix (str): suffix to add to the video file name
-            verbose (bool): whether to print out information about the flushed video
-            ignore_empty_transition (bool): whether to ignore trajectories that did not have any actions
+            verbose (bool): whether to print out information about the flushed
+                video
+            ignore_empty_transition (bool): whether to ignore trajectories that
+                did not have any actions
             save (bool): whether to save the video to disk
         """
-        if len(self.render_images) == 0:
+        num_frames = len(self.render_images) + self.num_deferred_pending
+        if num_frames == 0:
             return
-        if ignore_empty_transition and len(self.render_images) == 1:
+        if ignore_empty_transition and num_frames == 1:
             return
         if save:
+            self.render_deferred()
             self._video_id += 1
             if name is None:
                 video_name = "{}".format(self._video_id)
@@ -774,53 +1483,69 @@ class RecordEpisode(gym.Wrapper):
         self._video_steps = 0
         self.render_images = []
 
-    def flush_multi_images(self, save_path: str, save: bool = True) -> None:
-        if (len(self._images_storage[0]) == 0 or
-            len(self._images_storage[1]) == 0 or
-            len(self._images_storage[2]) == 0):
-            return
-        if save:
-            images_folder = os.path.join(self.output_dir, save_path)
-            os.makedirs(images_folder, exist_ok=True)
-            for i, np_image in enumerate(self._images_storage[0]):
-                pil_image = Image.fromarray(np_image)
-                save_folder = os.path.join(images_folder, "front")
-                os.makedirs(save_folder, exist_ok=True)
-                pil_image.save(os.path.join(save_folder, f"{i}.png"))
-
-            for i, np_image in enumerate(self._images_storage[1]):
-                pil_image = Image.fromarray(np_image)
-                save_folder = os.path.join(images_folder, "side")
-                os.makedirs(save_folder, exist_ok=True)
-                pil_image.save(os.path.join(save_folder, f"{i}.png"))
-
-            for i, np_image in enumerate(self._images_storage[2]):
-                pil_image = Image.fromarray(np_image)
-                save_folder = os.path.join(images_folder, "wrist")
-                os.makedirs(save_folder, exist_ok=True)
-                pil_image.save(os.path.join(save_folder, f"{i}.png"))
-
-    def flush_multi_images_pack(self, save_path: str, save: bool = True) -> None:
-        if (len(self._images_storage[0]) == 0 or
-            len(self._images_storage[1]) == 0 or
-            len(self._images_storage[2]) == 0):
-            return
-        if save:
-            images_folder = os.path.join(self.output_dir, save_path)
-            os.makedirs(images_folder, exist_ok=True)
-            start_idx = 0
-            end_idx = len(self._images_storage[0])
-            n_groups = floor((end_idx - start_idx) / 5)
-
-            for k in range(n_groups):
-                img_pack = create_image_pack(
-                    self._images_storage[0],
-                    self._images_storage[1],
-                    self._images_storage[2],
-                    start_idx=0 + k,
-                    end_idx=len(self._images_storage[0])
+    def flush_multi_images(
+        self, save_path: str, save: bool = True, verbose: bool = False
+    ) -> Optional[SaveStats]:
+        """
+        Saves the frames of each camera view into
+        `<save_path>/<view>/<index>.<format>`, encoding them in parallel
+
+        Returns:
+            The number of images and bytes saved and the time it took, or None
+            if nothing was saved
+        """
+        if not save:
+            return None
+        self.render_deferred()
+        images_folder = os.path.join(self.output_dir, save_path)
+        if self._pool_frames > 0:
+            # written by the encoder once the episode is flushed with
+            # `flush_video_multi`
+            self._pending_job["images_folder"] = images_folder
+            return None
+        if len(self._frame_store) == 0:
+            return None
+        stats = self._image_sink.save(
+            {
+                os.path.join(images_folder, view_name): view_images
+                for view_name, view_images in zip(
+                    MULTI_VIEW_NAMES, self._frame_store.views
                 )
-                img_pack.save(os.path.join(images_folder, f"{k}.png"))
+            }
+        )
+        if verbose:
+            print(f"Images of {save_path}: {stats}")
+        return stats
+
+    def flush_multi_images_pack(
+        self, save_path: str, save: bool = True, verbose: bool = False
+    ) -> Optional[SaveStats]:
+        if not save:
+            return None
+        self.render_deferred()
+        images_folder = os.path.join(self.output_dir, save_path)
+        if self._pool_frames > 0:
+            # written by the encoder once the episode is flushed with
+            # `flush_video_multi`
+            self._pending_job["packs_folder"] = images_folder
+            return None
+        if len(self._frame_store) == 0:
+            return None
+        start_idx = 0
+        end_idx = len(self._frame_store)
+        n_groups = floor((end_idx - start_idx) / 5)
+
+        img_packs = create_image_packs(
+            *self._frame_store.views,
+            start_indices=[start_idx + k for k in range(n_groups)],
+            end_idx=end_idx,
+        )
+        stats = self._image_sink.save(
+            {images_folder: img_packs}, image_format="png"
+        )
+        if verbose:
+            print(f"Image packs of {save_path}: {stats}")
+        return stats
 
     def flush_video_multi(
         self,
@@ -830,13 +1555,33 @@ class RecordEpisode(gym.Wrapper):
         ignore_empty_transition=True,
         save: bool = True,
     ):
-        if (len(self._images_storage[0]) == 0 or
-            len(self._images_storage[1]) == 0 or
-            len(self._images_storage[2]) == 0):
+        """
+        Flush the videos of each camera view of the recorded episode and by
+        default saves them to disk
+
+        Arguments:
+            name (str): name of the video files, followed by the name of the
+                view. If None, it will be named with the video id.
+            suffix (str): suffix to add to the video file names
+            verbose (bool): whether to print out information about the flushed
+                videos
+            ignore_empty_transition (bool): whether to ignore trajectories that
+                did not have any actions
+            save (bool): whether to save the videos to disk
+        """
+        num_frames = (
+            self._video_sink.num_frames
+            if self._video_sink is not None
+            else self.num_stored_frames
+        )
+        num_frames += self.num_deferred_pending
+        if num_frames == 0:
             return
-        if ignore_empty_transition and len(self._images_storage[0]) == 1:
+        if ignore_empty_transition and num_frames == 1:
             return
+        video_name = None
         if save:
+            self.render_deferred()
             self._multi_video_id += 1
             if name is None:
                 video_name = "{}".format(self._multi_video_id)
@@ -844,33 +1589,31 @@ class RecordEpisode(gym.Wrapper):
                     video_name += "_" + suffix
             else:
                 video_name = name
-            images_to_video(
-                self._images_storage[0],
-                str(self.output_dir),
-                video_name=f"{video_name}_front",
-                fps=self.video_fps,
-                verbose=verbose,
-            )
-            images_to_video(
-                self._images_storage[1],
-                str(self.output_dir),
-                video_name=f"{video_name}_side",
-                fps=self.video_fps,
-                verbose=verbose,
-            )
-            images_to_video(
-                self._images_storage[2],
+        if self._video_sink is not None:
+            # the frames were already encoded as they were captured
+            self._video_sink.close(video_name=video_name, verbose=verbose)
+        elif self._pool_frames > 0:
+            if video_name is not None:
+                self._pending_job["video_name"] = video_name
+            self._submit_frame_job()
+        elif save:
+            write_multi_view_videos(
+                self._frame_store.views,
                 str(self.output_dir),
-                video_name=f"{video_name}_wrist",
+                video_name,
+                MULTI_VIEW_NAMES,
                 fps=self.video_fps,
+                quality=self._video_quality,
+                layout=self._multi_video_layout,
                 verbose=verbose,
             )
         self._video_steps = 0
-        self._images_storage = [[],[],[]]
+        self._frame_store.reset()
 
     def close(self) -> None:
         if self._closed:
-            # There is some strange bug when vector envs using record wrapper are closed/deleted, this code runs twice
+            # There is some strange bug when vector envs using record wrapper
+            # are closed/deleted, this code runs twice
             return
         self._closed = True
         if self.save_trajectory:
@@ -880,12 +1623,26 @@ class RecordEpisode(gym.Wrapper):
                     ignore_empty_transition=True,
                     env_idxs_to_flush=np.arange(self.num_envs),
                 )
-            if self.clean_on_close:
+            if self._writer is not None:
+                try:
+                    self._writer.close()
+                except BaseException:
+                    self._h5_file.close()
+                    raise
+            if self.clean_on_close and self._trajectory_store is None:
                 clean_trajectories(self._h5_file, self._json_data)
-                dump_json(self._json_path, self._json_data, indent=2)
+            self._episode_index.close()
             self._h5_file.close()
         if self.save_video:
             if self.save_on_reset:
                 self.flush_video()
                 self.flush_video_multi()
+        if self._video_sink is not None and self._video_sink.is_open:
+            self._video_sink.close()
+        if self._frame_pool is not None:
+            self._submit_frame_job()
+            if self._pool_slot is not None:
+                self._frame_pool.release(self._pool_slot)
+                self._pool_slot = None
+        self._image_sink.close()
         return super().close()
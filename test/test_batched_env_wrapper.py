@@ -0,0 +1,73 @@
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from failgen.batched_env_wrapper import (
+    AttemptResult,
+    BatchedFailgenWrapper,
+    FailurePlan,
+)
+
+
+class SimulatedBatchedWrapper(BatchedFailgenWrapper):
+    """Runs the plans without sub-environments, `num_envs` at a time,
+    finishing the oldest attempt first. The seeds in `successes` don't fail"""
+
+    def __init__(self, num_envs: int, successes: Set[int]) -> None:
+        self._task_name = "FailPickCube-v1"
+        self._num_envs = num_envs
+        self._seed = 0
+        self._successes = successes
+        # the episode indices of the failures saved, by (fail_type, stage)
+        self.saved: Dict[Tuple[str, int], List[int]] = {}
+
+    def run(self, plans: Iterable[FailurePlan]) -> Iterator[AttemptResult]:
+        plans_iter = iter(plans)
+        busy: List[FailurePlan] = []
+        exhausted = False
+        while True:
+            while len(busy) < self._num_envs and not exhausted:
+                try:
+                    plan = next(plans_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if plan is None:
+                    break
+                busy.append(plan)
+            if not busy:
+                return
+            plan = busy.pop(0)
+            success = plan.seed in self._successes
+            if not success:
+                unit = (plan.fail_type, plan.fail_stage)
+                self.saved.setdefault(unit, []).append(plan.ep_idx)
+            yield AttemptResult(
+                env_idx=0,
+                plan=plan,
+                success=success,
+                ep_idx=None if success else plan.ep_idx,
+                duration=0.0,
+            )
+
+
+def test_collect_numbers_failures_per_pair() -> None:
+    # the attempts of seeds 0 and 3 don't fail, while others are running
+    wrapper = SimulatedBatchedWrapper(num_envs=2, successes={0, 3})
+    wrapper.collect(["trans_x"], {"trans_x": [0]}, 3, verbose=False)
+
+    # numbered from 1 like `FailgenWrapper.collect`, the indices of the
+    # attempts that didn't fail are given to the next ones
+    assert sorted(wrapper.saved[("trans_x", 0)]) == [1, 2, 3]
+
+
+def test_collect_numbers_each_pair_from_one() -> None:
+    wrapper = SimulatedBatchedWrapper(num_envs=3, successes={1, 4, 5})
+    stages = {"trans_x": [0, 1], "trans_y": [0]}
+    wrapper.collect(list(stages), stages, 3, verbose=False)
+
+    assert set(wrapper.saved) == {
+        ("trans_x", 0),
+        ("trans_x", 1),
+        ("trans_y", 0),
+    }
+    for ep_indices in wrapper.saved.values():
+        assert sorted(ep_indices) == [1, 2, 3]
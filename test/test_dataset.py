@@ -0,0 +1,177 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+h5py = pytest.importorskip("h5py")
+
+from failgen.dataset import (  # noqa: E402
+    VIEW_NAMES,
+    FailureDataset,
+    FrameBatchSampler,
+    build_dataset,
+    scan_collection,
+)
+from failgen.scheduler import (  # noqa: E402
+    LEDGER_FILENAME,
+    OUTCOME_FAIL,
+    AttemptRecord,
+    Ledger,
+)
+
+TASK_NAME = "FailPickCube-v1"
+# (fail_type, fail_stage, ep_idx, seed, num_frames) of the saved episodes
+EPISODES = [
+    ("trans_x", 0, 1, 0, 6),
+    ("trans_x", 1, 1, 0, 3),
+    # collected by the scheduler, its folder is named with its seed
+    ("trans_y", 0, 4, 4, 5),
+]
+
+
+def frame_value(episode: int, t: int, view: int) -> int:
+    return 50 * episode + 10 * t + view
+
+
+def write_collection(collection_dir, extra_info: bool = True) -> None:
+    """A collection saved like `FailgenWrapper(save_dataset=True)` does, with
+    frames of 4x2 pixels"""
+    task_dir = os.path.join(collection_dir, TASK_NAME)
+    json_episodes = []
+    os.makedirs(task_dir)
+    with h5py.File(os.path.join(task_dir, "run.h5"), "w") as h5_file:
+        for i, (fail_type, stage, ep_idx, seed, num_frames) in enumerate(
+            EPISODES
+        ):
+            episode_dir = os.path.join(
+                task_dir, f"{ep_idx}_{fail_type}_{stage}"
+            )
+            for v, view in enumerate(VIEW_NAMES):
+                os.makedirs(os.path.join(episode_dir, view))
+                for t in range(num_frames):
+                    frame = np.full((2, 4, 3), frame_value(i, t, v), np.uint8)
+                    Image.fromarray(frame).save(
+                        os.path.join(episode_dir, view, f"{t}.png")
+                    )
+            group = h5_file.create_group(f"traj_{i + 1}")
+            group.create_dataset(
+                "actions", data=np.full((num_frames - 1, 2), i, np.float32)
+            )
+            info = dict(episode_id=i + 1, episode_seed=seed, success=False)
+            if extra_info:
+                info.update(
+                    fail_type=fail_type, fail_stage=stage, ep_idx=ep_idx
+                )
+            json_episodes.append(info)
+    with open(os.path.join(task_dir, "run.json"), "w") as f:
+        json.dump(dict(env_info={}, episodes=json_episodes), f)
+
+
+def test_scan_collection_matches_trajectories(tmp_path) -> None:
+    write_collection(str(tmp_path))
+    episodes = scan_collection(str(tmp_path))
+
+    assert [(e.fail_type, e.fail_stage) for e in episodes] == [
+        ("trans_x", 0),
+        ("trans_x", 1),
+        ("trans_y", 0),
+    ]
+    # the first two episodes have the same seed, they are told apart by the
+    # failure recorded with their trajectory
+    for i, episode in enumerate(episodes):
+        assert episode.num_frames == EPISODES[i][4]
+        assert np.array_equal(
+            episode.actions, np.full((EPISODES[i][4] - 1, 2), i)
+        )
+
+
+def test_scan_collection_matches_seeds_with_ledger(tmp_path) -> None:
+    write_collection(str(tmp_path), extra_info=False)
+
+    # without a ledger, the folders aren't named with the seeds
+    episodes = scan_collection(str(tmp_path))
+    assert all(e.actions is None for e in episodes)
+
+    # with a ledger they are, and the seeds of a single trajectory match
+    ledger = Ledger(str(tmp_path / LEDGER_FILENAME))
+    ledger.append(AttemptRecord(TASK_NAME, "trans_y", 0, 4, OUTCOME_FAIL))
+    ledger.close()
+    episodes = scan_collection(str(tmp_path))
+    assert episodes[0].actions is None
+    assert episodes[1].actions is None
+    assert np.array_equal(episodes[2].actions, np.full((4, 2), 2))
+
+
+def test_scan_collection_checks_the_layout(tmp_path) -> None:
+    # the episodes nested in the task folder a second time
+    write_collection(str(tmp_path))
+    task_dir = tmp_path / TASK_NAME
+    nested_dir = task_dir / "data" / TASK_NAME
+    nested_dir.mkdir(parents=True)
+    for name in os.listdir(task_dir):
+        if name != "data" and os.path.isdir(task_dir / name):
+            os.rename(task_dir / name, nested_dir / name)
+
+    with pytest.raises(ValueError, match="1_trans_x_0"):
+        scan_collection(str(tmp_path))
+
+
+def test_build_dataset(tmp_path) -> None:
+    write_collection(str(tmp_path / "collection"))
+    build_dataset(str(tmp_path / "collection"), str(tmp_path / "dataset"))
+
+    dataset = FailureDataset(str(tmp_path / "dataset"))
+    assert len(dataset) == 3
+    assert dataset.frames.shape == (14, 3, 2, 4, 3)
+    assert dataset.fail_types == ["trans_x", "trans_y"]
+    for i, (fail_type, stage, ep_idx, _, num_frames) in enumerate(EPISODES):
+        episode = dataset[i]
+        assert episode["task_name"] == TASK_NAME
+        assert episode["fail_type"] == fail_type
+        assert episode["fail_stage"] == stage
+        assert episode["episode_index"] == ep_idx
+        assert not episode["success"]
+        assert episode["frames"].shape == (num_frames, 3, 2, 4, 3)
+        assert episode["frames"][-1, 2, 0, 0, 0] == frame_value(
+            i, num_frames - 1, 2
+        )
+        assert np.array_equal(
+            episode["actions"], np.full((num_frames - 1, 2), i)
+        )
+    assert dataset[-1]["fail_type"] == "trans_y"
+    with pytest.raises(IndexError):
+        dataset[3]
+
+
+def test_frame_batch_sampler(tmp_path) -> None:
+    write_collection(str(tmp_path / "collection"))
+    dataset = build_dataset(
+        str(tmp_path / "collection"), str(tmp_path / "dataset")
+    )
+    # the second episode is shorter than the clips
+    sampler = FrameBatchSampler(dataset, batch_size=2, clip_length=4, seed=0)
+
+    assert len(sampler) == 1
+    batches = list(sampler)
+    assert len(batches) == 1
+    batch = batches[0]
+    assert sorted(batch["episode"].tolist()) == [0, 2]
+    assert batch["frames"].shape == (2, 4, 3, 2, 4, 3)
+    for n, episode in enumerate(batch["episode"]):
+        # clips of consecutive frames of their episode
+        for k, t in enumerate(batch["frame_index"][n]):
+            assert batch["frames"][n, k, 1, 0, 0, 0] == frame_value(
+                episode, t, 1
+            )
+        assert np.array_equal(np.diff(batch["frame_index"][n]), [1, 1, 1])
+    assert np.array_equal(
+        batch["fail_type"], dataset.fail_type[batch["episode"]]
+    )
+
+    sampler = FrameBatchSampler(
+        dataset, batch_size=2, clip_length=1, drop_last=True
+    )
+    assert len(sampler) == 1
+    assert [len(b["episode"]) for b in sampler] == [2]
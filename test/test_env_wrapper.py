@@ -0,0 +1,65 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+env_wrapper = pytest.importorskip("failgen.env_wrapper")
+
+from failgen.dataset import VIEW_NAMES, scan_collection  # noqa: E402
+
+TASK_NAME = "FailPickCube-v1"
+
+
+class Recorder:
+    """Saves the frames of each view under its output folder, like
+    `RecordEpisode` does, without running an environment"""
+
+    def __init__(self, output_dir: str) -> None:
+        self.output_dir = output_dir
+
+    def flush_trajectory(self, save=True, extra_info=None) -> None:
+        pass
+
+    def flush_video(self, save=True, suffix="") -> None:
+        pass
+
+    def flush_multi_images(self, save_path: str, save: bool = True) -> None:
+        if not save:
+            return
+        for view in VIEW_NAMES:
+            folder = os.path.join(self.output_dir, save_path, view)
+            os.makedirs(folder)
+            Image.fromarray(np.zeros((2, 4, 3), np.uint8)).save(
+                os.path.join(folder, "0.png")
+            )
+
+    def flush_multi_images_pack(self, save_path: str, save=True) -> None:
+        pass
+
+    def flush_video_multi(self, save=True, suffix="") -> None:
+        pass
+
+
+def make_wrapper(save_path: str) -> "env_wrapper.FailgenWrapper":
+    wrapper = env_wrapper.FailgenWrapper.__new__(env_wrapper.FailgenWrapper)
+    wrapper._task_name = TASK_NAME
+    wrapper._save_path = save_path
+    wrapper._save_dataset = True
+    wrapper._env = Recorder(os.path.join(save_path, TASK_NAME))
+    wrapper._fail_plan_wrapper = SimpleNamespace(
+        _active_fail=SimpleNamespace(type="trans_x"), _fail_stage=0
+    )
+    return wrapper
+
+
+def test_save_video_with_relative_save_path(tmp_path, monkeypatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    make_wrapper("data").save_video(save=True, ep_idx=1)
+
+    # the episode folder isn't nested in the save path a second time
+    assert os.listdir(os.path.join("data", TASK_NAME)) == ["1_trans_x_0"]
+    episodes = scan_collection("data")
+    assert [(e.fail_type, e.fail_stage) for e in episodes] == [("trans_x", 0)]
+    assert episodes[0].num_frames == 1
@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("mani_skill")
+
+from failgen.wrappers.record import (  # noqa: E402
+    EpisodeIndex,
+    episode_log_path,
+    load_episode_index,
+)
+
+
+def make_index(tmp_path) -> EpisodeIndex:
+    json_path = str(tmp_path / "trajectory.json")
+    data = dict(env_info=dict(env_id="FailPickCube-v1"), episodes=[])
+    index = EpisodeIndex(json_path, data)
+    for episode_id in range(3):
+        index.append(dict(episode_id=episode_id, elapsed_steps=10))
+    return index
+
+
+def test_episode_log_path() -> None:
+    # only the suffix of the JSON file is replaced
+    assert (
+        episode_log_path("/data/run.json/trajectory.json")
+        == "/data/run.json/trajectory.episodes.jsonl"
+    )
+
+
+def test_episode_index_close(tmp_path) -> None:
+    index = make_index(tmp_path)
+    index.close()
+
+    with open(index.json_path, "r") as f:
+        data = json.load(f)
+    assert data["env_info"]["env_id"] == "FailPickCube-v1"
+    assert [e["episode_id"] for e in data["episodes"]] == [0, 1, 2]
+    # the JSON file holds everything, so the log is removed
+    assert not os.path.exists(index.log_path)
+    assert load_episode_index(index.json_path) == data
+
+
+def test_load_episode_index_after_crash(tmp_path) -> None:
+    index = make_index(tmp_path)
+    # the process died before compacting the index, and while writing the
+    # last line of the log
+    index._log.write('{"episode": {"episode_id": 3, "elaps')
+    index._log.flush()
+    assert not os.path.exists(index.json_path)
+
+    data = load_episode_index(index.json_path)
+    assert data["env_info"]["env_id"] == "FailPickCube-v1"
+    assert [e["episode_id"] for e in data["episodes"]] == [0, 1, 2]
+    assert not os.path.exists(index.json_path)
+
+    load_episode_index(index.json_path, compact=True)
+    with open(index.json_path, "r") as f:
+        assert json.load(f) == data
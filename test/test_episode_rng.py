@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("mani_skill")
+
+from failgen.fail_planner_wrapper import episode_rng  # noqa: E402
+
+EPISODE = ("FailPickCube-v1", "trans_x", 1, 7)
+
+
+def test_episode_rng_is_deterministic() -> None:
+    first = episode_rng(*EPISODE).uniform(size=8)
+    second = episode_rng(*EPISODE).uniform(size=8)
+
+    assert np.array_equal(first, second)
+
+
+def test_episode_rng_depends_on_the_episode() -> None:
+    draws = {
+        episode: tuple(episode_rng(*episode).uniform(size=4))
+        for episode in [
+            EPISODE,
+            ("FailStackCube-v1", "trans_x", 1, 7),
+            ("FailPickCube-v1", "trans_y", 1, 7),
+            ("FailPickCube-v1", "trans_x", 2, 7),
+            ("FailPickCube-v1", "trans_x", 1, 8),
+        ]
+    }
+
+    assert len(set(draws.values())) == len(draws)
+
+
+def test_episode_rng_across_processes() -> None:
+    # the hash of strings changes between processes, the draws must not
+    code = (
+        "from failgen.fail_planner_wrapper import episode_rng; "
+        + f"print(episode_rng(*{EPISODE!r}).integers(1 << 30))"
+    )
+    draws = set()
+    for hash_seed in ("1", "2"):
+        env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        draws.add(int(output.split()[-1]))
+
+    assert draws == {int(episode_rng(*EPISODE).integers(1 << 30))}
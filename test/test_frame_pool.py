@@ -0,0 +1,100 @@
+import os
+import queue
+
+import numpy as np
+
+from failgen.utils.frame_pool import (
+    MULTI_VIEW_NAMES,
+    FrameJob,
+    FramePoolSpec,
+    SharedFramePool,
+    write_frame_job,
+)
+from failgen.utils.image_sink import ImageSink
+
+
+def make_tiled_image(value: int, height: int = 4, width: int = 5):
+    # each view is filled with `value` plus its index, and the image has some
+    # extra columns on the right like the rendered images do
+    views = [
+        np.full((height, width, 3), value + i, dtype=np.uint8)
+        for i in range(len(MULTI_VIEW_NAMES))
+    ]
+    extra = np.zeros((height, 2, 3), dtype=np.uint8)
+    return np.concatenate(views + [extra], axis=1)
+
+
+def make_pool(num_slots: int, max_frames: int) -> SharedFramePool:
+    # the free slots in a queue of this process, the one of `create` is for
+    # the processes it starts
+    free_slots = queue.Queue()
+    for slot in range(num_slots):
+        free_slots.put(slot)
+    spec = FramePoolSpec("", num_slots, max_frames, height=4, width=5)
+    return SharedFramePool(spec, free_slots, create=True)
+
+
+def test_shared_frame_pool_slots() -> None:
+    pool = make_pool(num_slots=2, max_frames=3)
+    try:
+        slots = [pool.acquire(), pool.acquire()]
+        assert sorted(slots) == [0, 1]
+        # no slot left, the recorders don't wait for one
+        assert pool.acquire() is None
+
+        assert pool.fits(make_tiled_image(0), width=5)
+        assert not pool.fits(make_tiled_image(0, height=6), width=5)
+        for t in range(3):
+            pool.write(slots[1], t, make_tiled_image(10 * t), width=5)
+        frames = pool.frames[slots[1]]
+        assert frames.shape == (3, 3, 4, 5, 3)
+        for i in range(len(MULTI_VIEW_NAMES)):
+            assert np.array_equal(frames[:, i, 0, 0, 0], [i, 10 + i, 20 + i])
+
+        pool.release(slots[0])
+        assert pool.acquire() == slots[0]
+    finally:
+        pool.close()
+
+
+def test_shared_frame_pool_attaches_to_the_same_memory() -> None:
+    pool = make_pool(num_slots=1, max_frames=2)
+    try:
+        # like the processes started with the pool, from its spec
+        attached = SharedFramePool(pool.spec, free_slots=None)
+        assert pool.spec.name != ""
+        attached.write(0, 1, make_tiled_image(7), width=5)
+        assert np.array_equal(pool.frames[0, 1, :, 0, 0, 0], [7, 8, 9])
+        attached.close()
+        # only the owner unlinks the memory
+        assert pool.frames[0, 1, 0, 0, 0, 0] == 7
+    finally:
+        pool.close()
+
+
+def test_write_frame_job(tmp_path) -> None:
+    frames = np.stack(
+        [
+            np.stack(
+                [np.full((4, 5, 3), 10 * t + i, np.uint8) for i in range(3)]
+            )
+            for t in range(6)
+        ]
+    )
+    job = FrameJob(
+        slot=0,
+        num_frames=6,
+        output_dir=str(tmp_path),
+        images_folder=str(tmp_path / "images"),
+        packs_folder=str(tmp_path / "packs"),
+    )
+    image_sink = ImageSink(num_workers=2)
+    try:
+        write_frame_job(job, frames, image_sink)
+    finally:
+        image_sink.close()
+
+    for view in MULTI_VIEW_NAMES:
+        assert len(os.listdir(tmp_path / "images" / view)) == 6
+    # one pack per window of 5 frames
+    assert len(os.listdir(tmp_path / "packs")) == 1
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("mani_skill")
+
+from failgen.wrappers.record import FrameStore  # noqa: E402
+
+
+def make_tiled_image(
+    value: int, num_views: int = 3, height: int = 4, width: int = 5
+) -> np.ndarray:
+    # each view is filled with `value` plus its index, and the image has some
+    # extra columns on the right like the rendered images do
+    views = [
+        np.full((height, width, 3), value + i, dtype=np.uint8)
+        for i in range(num_views)
+    ]
+    extra = np.zeros((height, 2, 3), dtype=np.uint8)
+    return np.concatenate(views + [extra], axis=1)
+
+
+def test_frame_store_splits_views() -> None:
+    store = FrameStore(num_views=3, capacity=2)
+    for t in range(5):
+        store.append(make_tiled_image(10 * t), width=5)
+
+    assert len(store) == 5
+    # the buffer doubled twice to fit the frames
+    assert store.capacity == 8
+    for i, view in enumerate(store.views):
+        assert view.shape == (5, 4, 5, 3)
+        assert np.array_equal(view[:, 0, 0, 0], 10 * np.arange(5) + i)
+
+
+def test_frame_store_reset_reuses_buffer() -> None:
+    store = FrameStore(num_views=3, capacity=4)
+    store.append(make_tiled_image(1), width=5)
+    store.append(make_tiled_image(2), width=5)
+    front = store.view(0)
+
+    store.reset()
+    assert len(store) == 0
+    store.append(make_tiled_image(7), width=5)
+
+    assert len(store) == 1
+    assert store.view(0)[0, 0, 0, 0] == 7
+    # the views share the memory of the buffer
+    assert np.shares_memory(front, store.view(0))
+
+
+def test_frame_store_new_image_size() -> None:
+    store = FrameStore(num_views=3)
+    store.append(make_tiled_image(1), width=5)
+    store.append(make_tiled_image(2, height=6, width=3), width=3)
+
+    # frames of another size start a new episode
+    assert len(store) == 1
+    assert store.view(2).shape == (1, 6, 3, 3)
+    assert store.view(2)[0, 0, 0, 0] == 4
+
+
+def test_frame_store_extend() -> None:
+    store = FrameStore(num_views=3, capacity=2)
+    store.append(make_tiled_image(0), width=5)
+    frames = np.arange(3, dtype=np.uint8).reshape(3, 1, 1, 1, 1)
+    frames = np.broadcast_to(frames, (3, 3, 4, 5, 3))
+    store.extend(frames)
+
+    assert len(store) == 4
+    assert np.array_equal(store.view(1)[:, 0, 0, 0], [1, 0, 1, 2])
+
+
+def test_frame_store_empty() -> None:
+    store = FrameStore()
+
+    assert len(store) == 0
+    assert store.view(0).shape == (0, 0, 0, 3)
@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+
+from failgen.utils.h5_storage import (  # noqa: E402
+    IMAGE_CHUNK_FRAMES,
+    ChunkedTrajectoryStore,
+    CompressionPolicy,
+    chunk_shape,
+    is_chunked_storage,
+    iter_leaves,
+    load_trajectory,
+    recursive_add_to_h5py,
+)
+
+
+def make_episode(rng: np.random.Generator, T: int, with_rgb: bool) -> dict:
+    episode = dict(
+        actions=rng.standard_normal((T, 8)).astype(np.float32),
+        terminated=np.zeros(T, dtype=bool),
+        env_states=dict(
+            actors=dict(cube=rng.standard_normal((T + 1, 13))),
+        ),
+    )
+    if with_rgb:
+        episode["obs"] = dict(
+            sensor_data=dict(
+                base_camera=dict(
+                    rgb=rng.integers(0, 255, (T + 1, 8, 6, 3), dtype=np.uint8)
+                )
+            )
+        )
+    return episode
+
+
+def assert_episodes_equal(actual: dict, expected: dict) -> None:
+    actual_leaves = dict(iter_leaves(actual))
+    expected_leaves = dict(iter_leaves(expected))
+    assert actual_leaves.keys() == expected_leaves.keys()
+    for path, array in expected_leaves.items():
+        assert actual_leaves[path].dtype == array.dtype
+        assert np.array_equal(actual_leaves[path], array)
+
+
+def test_chunked_store_round_trip(tmp_path) -> None:
+    rng = np.random.default_rng(0)
+    # the camera only appears in the second episode
+    episodes = {
+        3: make_episode(rng, 5, with_rgb=False),
+        7: make_episode(rng, 40, with_rgb=True),
+        8: make_episode(rng, 1, with_rgb=True),
+    }
+    path = str(tmp_path / "trajectory.h5")
+    with h5py.File(path, "w") as h5_file:
+        store = ChunkedTrajectoryStore(h5_file, CompressionPolicy())
+        for episode_id, episode in episodes.items():
+            store.append(episode_id, episode)
+
+    with h5py.File(path, "r") as h5_file:
+        assert is_chunked_storage(h5_file)
+        store = ChunkedTrajectoryStore(h5_file)
+        assert store.episode_ids == [3, 7, 8]
+        assert len(store) == 3
+        for episode_id, episode in episodes.items():
+            assert_episodes_equal(store.read_episode(episode_id), episode)
+            assert_episodes_equal(load_trajectory(h5_file, episode_id), episode)
+        assert np.array_equal(
+            store.read_episode(7, paths=["actions"])["actions"],
+            episodes[7]["actions"],
+        )
+        rgb = h5_file["episodes/obs/sensor_data/base_camera/rgb"]
+        assert rgb.compression == "gzip"
+
+
+def test_chunked_store_continues_file(tmp_path) -> None:
+    rng = np.random.default_rng(1)
+    first, second = make_episode(rng, 4, True), make_episode(rng, 6, True)
+    path = str(tmp_path / "trajectory.h5")
+    with h5py.File(path, "w") as h5_file:
+        ChunkedTrajectoryStore(h5_file).append(0, first)
+    with h5py.File(path, "a") as h5_file:
+        ChunkedTrajectoryStore(h5_file).append(1, second)
+
+    with h5py.File(path, "r") as h5_file:
+        store = ChunkedTrajectoryStore(h5_file)
+        assert_episodes_equal(store.read(0), first)
+        assert_episodes_equal(store.read(1), second)
+
+
+def test_chunked_store_rejects_other_shapes(tmp_path) -> None:
+    rng = np.random.default_rng(2)
+    episode = make_episode(rng, 4, with_rgb=False)
+    with h5py.File(str(tmp_path / "trajectory.h5"), "w") as h5_file:
+        store = ChunkedTrajectoryStore(h5_file)
+        store.append(0, episode)
+        episode["actions"] = np.zeros((4, 7), dtype=np.float32)
+        with pytest.raises(ValueError):
+            store.append(1, episode)
+        # nothing of the rejected episode is written
+        assert len(store) == 1
+        assert h5_file["episodes/terminated"].shape == (4,)
+
+
+def test_load_trajectory_of_groups(tmp_path) -> None:
+    episode = make_episode(np.random.default_rng(3), 4, with_rgb=True)
+    with h5py.File(str(tmp_path / "trajectory.h5"), "w") as h5_file:
+        group = h5_file.create_group("traj_2", track_order=True)
+        for key, data in episode.items():
+            recursive_add_to_h5py(group, data, key)
+
+        assert not is_chunked_storage(h5_file)
+        assert_episodes_equal(load_trajectory(h5_file, 2), episode)
+
+
+def test_chunk_shape() -> None:
+    # strips of consecutive frames of the images, 7 strips of about the same
+    # height fit the 256 lines
+    assert chunk_shape((256, 256, 3), np.uint8, 1 << 20) == (
+        IMAGE_CHUNK_FRAMES,
+        37,
+        256,
+        3,
+    )
+    assert chunk_shape((8, 6, 3), np.uint8, 1 << 20) == (
+        IMAGE_CHUNK_FRAMES,
+        8,
+        6,
+        3,
+    )
+    # whole rows of the other arrays
+    assert chunk_shape((8,), np.float32, 1 << 20) == (1 << 15, 8)
@@ -4,7 +4,10 @@ from pathlib import Path
 import numpy as np
 from PIL import Image
 
-from failgen.utils.image_manipulation import create_image_pack
+from failgen.utils.image_manipulation import (
+    create_image_pack,
+    create_image_packs,
+)
 
 
 def test_create_image_pack() -> None:
@@ -68,6 +71,45 @@ def test_create_full_pack() -> None:
     res_image.save("image_pack_full_result.png")
 
 
+def test_create_image_packs_matches_create_image_pack() -> None:
+    # read in the test data ---------------------
+    current_dir = Path(__file__).parent.resolve()
+    test_data_dir = (current_dir.parent / "resources" / "test_data").resolve()
+
+    views = [
+        np.stack(
+            [
+                np.array(Image.open(test_data_dir / view / f"{i}.png"))
+                for i in range(12)
+            ]
+        )
+        for view in ("front", "side", "wrist")
+    ]
+    # -------------------------------------------
+
+    # The last windows have less than 5 frames, which leaves empty slots
+    start_indices = list(range(12))
+    for use_annotations in (True, False):
+        res_packs = create_image_packs(
+            front_view_images=views[0],
+            side_view_images=views[1],
+            wrist_view_images=views[2],
+            start_indices=start_indices,
+            use_annotations=use_annotations,
+        )
+        assert res_packs.shape[0] == len(start_indices)
+        for n, start_idx in enumerate(start_indices):
+            res_image = create_image_pack(
+                front_view_images=list(views[0]),
+                side_view_images=list(views[1]),
+                wrist_view_images=list(views[2]),
+                start_idx=start_idx,
+                end_idx=12,
+                use_annotations=use_annotations,
+            )
+            assert np.array_equal(res_packs[n], np.array(res_image))
+
+
 
 if __name__ == "__main__":
     # test_create_image_pack()
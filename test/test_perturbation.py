@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("mani_skill")
+
+from failgen.fail_planner_wrapper import Perturbation  # noqa: E402
+
+
+def test_compile_translation() -> None:
+    perturbation = Perturbation.compile("trans_y", noise=0.1)
+
+    assert np.allclose(perturbation.directions, [[0, 0.1, 0, 0, 0, 0]])
+    assert np.array_equal(perturbation.offsets, [0.0])
+    assert not perturbation.is_empty
+    assert not perturbation.rotates
+
+
+def test_compile_composite() -> None:
+    perturbation = Perturbation.compile("trans_x+rot_z", noise=2.0)
+
+    assert np.allclose(
+        perturbation.directions,
+        [[2.0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 2.0]],
+    )
+    # the rotations are centered on zero
+    assert np.array_equal(perturbation.offsets, [0.0, -0.5])
+    assert perturbation.rotates
+
+
+def test_compile_without_pose_kinds() -> None:
+    # the failures of the gripper don't perturb the poses
+    perturbation = Perturbation.compile("grasp", noise=0.1)
+
+    assert perturbation.is_empty
+    deltas, fractions = perturbation.sample(np.random.default_rng(0), 3)
+    assert np.array_equal(deltas, np.zeros((3, 6)))
+    assert fractions.shape == (3, 0)
+
+
+def test_sample() -> None:
+    perturbation = Perturbation.compile("trans_z+rot_x", noise=0.5)
+    deltas, fractions = perturbation.sample(
+        np.random.default_rng(0), 100, noise_range=(0.2, 0.4)
+    )
+
+    assert deltas.shape == (100, 6)
+    assert np.all((fractions >= 0.2) & (fractions < 0.4))
+    assert np.allclose(deltas[:, 2], 0.5 * fractions[:, 0])
+    assert np.allclose(deltas[:, 3], 0.5 * (fractions[:, 1] - 0.5))
+    assert np.array_equal(deltas[:, [0, 1, 4, 5]], np.zeros((100, 4)))
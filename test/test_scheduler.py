@@ -0,0 +1,125 @@
+from failgen.scheduler import (
+    OUTCOME_ERROR,
+    OUTCOME_FAIL,
+    OUTCOME_SUCCESS,
+    AttemptRecord,
+    Ledger,
+    OutcomeCache,
+    SeedScheduler,
+)
+
+KEY = ("FailPickCube-v1", "translation", 0)
+
+
+def record(seed: int, outcome: str) -> AttemptRecord:
+    return AttemptRecord(*KEY, seed=seed, outcome=outcome)
+
+
+def test_ledger_round_trip(tmp_path) -> None:
+    path = str(tmp_path / "ledger.tsv")
+    ledger = Ledger(path)
+    ledger.append(record(0, OUTCOME_SUCCESS))
+    ledger.append(
+        AttemptRecord(*KEY, seed=1, outcome=OUTCOME_FAIL, noise_bucket=3)
+    )
+    ledger.close()
+
+    assert Ledger(path).load() == [
+        record(0, OUTCOME_SUCCESS),
+        AttemptRecord(*KEY, seed=1, outcome=OUTCOME_FAIL, noise_bucket=3),
+    ]
+
+
+def test_ledger_drops_partial_line(tmp_path) -> None:
+    path = str(tmp_path / "ledger.tsv")
+    ledger = Ledger(path)
+    ledger.append(record(0, OUTCOME_FAIL))
+    ledger.close()
+    # a crash cut the last line short
+    with open(path, "a") as f:
+        f.write("FailPickCube-v1\ttranslation\t0\t1\tfa")
+
+    ledger = Ledger(path)
+    assert ledger.load() == [record(0, OUTCOME_FAIL)]
+    ledger.append(record(1, OUTCOME_SUCCESS))
+    ledger.close()
+    assert Ledger(path).load() == [
+        record(0, OUTCOME_FAIL),
+        record(1, OUTCOME_SUCCESS),
+    ]
+
+
+def test_seed_scheduler_resumes(tmp_path) -> None:
+    path = str(tmp_path / "ledger.tsv")
+    scheduler = SeedScheduler(Ledger(path))
+    seeds = [scheduler.next_seed(KEY) for _ in range(4)]
+    assert seeds == [0, 1, 2, 3]
+    scheduler.record(record(0, OUTCOME_SUCCESS))
+    scheduler.record(record(1, OUTCOME_ERROR))
+    scheduler.record(record(3, OUTCOME_FAIL))
+    # the attempt of seed 2 was in flight when the run stopped
+    scheduler.close()
+
+    scheduler = SeedScheduler(Ledger(path))
+    # the seeds that errored or were in flight are attempted again
+    assert [scheduler.next_seed(KEY) for _ in range(3)] == [1, 2, 4]
+    stats = scheduler.stats(KEY)
+    assert (stats.attempts, stats.failures) == (2, 1)
+    assert stats.consecutive_successes == 0
+    assert scheduler.remaining_seeds(KEY, range(6)) == [5]
+    scheduler.close()
+
+
+def test_seed_scheduler_release(tmp_path) -> None:
+    scheduler = SeedScheduler(Ledger(str(tmp_path / "ledger.tsv")), 10)
+    assert scheduler.next_seed(KEY) == 10
+    assert scheduler.next_seed(KEY) == 11
+    scheduler.release(KEY, 10)
+
+    assert scheduler.next_seed(KEY) == 10
+    assert scheduler.next_seed(KEY) == 12
+
+
+def test_outcome_cache_persists(tmp_path) -> None:
+    path = str(tmp_path / "outcomes.tsv")
+    cache = OutcomeCache(path)
+    cache.add(AttemptRecord(*KEY, 0, OUTCOME_FAIL, noise_bucket=2))
+    cache.add(AttemptRecord(*KEY, 1, OUTCOME_SUCCESS, noise_bucket=2))
+    cache.add(AttemptRecord(*KEY, 1, OUTCOME_FAIL, noise_bucket=7))
+    cache.add(AttemptRecord(*KEY, 2, OUTCOME_SUCCESS, noise_bucket=7))
+    # errors say nothing about the seed
+    cache.add(AttemptRecord(*KEY, 3, OUTCOME_ERROR))
+    cache.close()
+
+    cache = OutcomeCache(path)
+    # the seeds that failed, the ones with the highest yield first
+    assert cache.failed_seeds(KEY) == [0, 1]
+    assert cache.seed_stats(KEY, 1).failure_yield == 0.5
+    assert cache.seed_stats(KEY, 3).attempts == 0
+    buckets = cache.bucket_stats(KEY)
+    assert (buckets[2].attempts, buckets[2].failures) == (2, 1)
+    assert cache.never_fails(KEY, 2, min_attempts=1)
+    assert not cache.never_fails(KEY, 2, min_attempts=2)
+    cache.close()
+
+
+def test_seed_scheduler_with_cache(tmp_path) -> None:
+    cache = OutcomeCache()
+    for seed in range(4):
+        outcome = OUTCOME_FAIL if seed in (2, 3) else OUTCOME_SUCCESS
+        for _ in range(2):
+            cache.add(AttemptRecord(*KEY, seed, outcome, noise_bucket=5))
+    scheduler = SeedScheduler(
+        Ledger(str(tmp_path / "ledger.tsv")), cache=cache, skip_after=2
+    )
+
+    # the seeds that failed come first, the ones that never failed in two
+    # attempts are skipped
+    assert [scheduler.next_seed(KEY) for _ in range(3)] == [2, 3, 4]
+    # the noise bucket that failed is the most likely to be picked
+    for bucket in range(cache.num_buckets):
+        outcome = OUTCOME_FAIL if bucket == 5 else OUTCOME_SUCCESS
+        for _ in range(10):
+            cache.add(AttemptRecord(*KEY, 100, outcome, noise_bucket=bucket))
+    ranges = [scheduler.noise_range(KEY) for _ in range(20)]
+    assert ranges.count((0.5, 0.6)) > 10
@@ -0,0 +1,70 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("omegaconf")
+
+from failgen import task_config  # noqa: E402
+from failgen.task_config import load_task_config  # noqa: E402
+
+TASK_NAME = "FailPickCube-v1"
+
+
+@pytest.fixture
+def configs_dir(tmp_path, monkeypatch):
+    shutil.copy(
+        os.path.join(task_config.CONFIGS_DIR, f"{TASK_NAME}.yaml"), tmp_path
+    )
+    monkeypatch.setattr(task_config, "CONFIGS_DIR", str(tmp_path))
+    monkeypatch.setattr(task_config, "_COMPILED_CONFIGS", {})
+    monkeypatch.setenv("USER", "failgen")
+    return tmp_path
+
+
+def test_load_task_config(configs_dir) -> None:
+    config = load_task_config(TASK_NAME)
+
+    assert config.save_path == "/home/failgen/data/failgen_data"
+    assert config.image_size == (256, 256)
+    assert config.fail_stages()["trans_x"] == [0, 1, 3]
+    assert config.failures["trans_x"].noise == 0.1
+    assert 3 in config.failures["trans_x"].stage_set
+    # the compiled values can't be changed by the callers sharing them
+    with pytest.raises(ValueError):
+        config.stages[0] = 1
+
+
+def test_load_task_config_is_cached(configs_dir) -> None:
+    assert load_task_config(TASK_NAME) is load_task_config(TASK_NAME)
+
+
+def test_load_task_config_reloads_changed_file(configs_dir) -> None:
+    config = load_task_config(TASK_NAME)
+    path = str(configs_dir / f"{TASK_NAME}.yaml")
+    with open(path, "r") as f:
+        text = f.read()
+    with open(path, "w") as f:
+        f.write(text.replace("image_size: [256, 256]", "image_size: [64, 64]"))
+    # make sure the modification time changes on coarse clocks
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    reloaded = load_task_config(TASK_NAME)
+    assert reloaded is not config
+    assert reloaded.image_size == (64, 64)
+    assert load_task_config(TASK_NAME) is reloaded
+
+
+def test_failures_check_the_stage_set(configs_dir) -> None:
+    pytest.importorskip("mani_skill")
+    from failgen.fail_planner_wrapper import FailPlannerWrapper
+
+    config = load_task_config(TASK_NAME)
+    failure = FailPlannerWrapper(config, TASK_NAME)._failures["trans_x"]
+    failure.enabled = True
+
+    assert failure.stage_set is config.failures["trans_x"].stage_set
+    assert failure.check_active(3, "trans_x")
+    assert not failure.check_active(2, "trans_x")
+    assert not failure.check_active(3, "trans_y")
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("mani_skill")
+
+from failgen.wrappers.record import Step, TrajectoryBuffer  # noqa: E402
+
+
+def make_rows(start: int, num_rows: int, with_state: bool = True) -> dict:
+    t = np.arange(start, start + num_rows)
+    return dict(
+        state=t[:, None].astype(np.float32) if with_state else None,
+        observation=dict(qpos=np.stack([t, -t], axis=1).astype(np.float32)),
+        action=t[:, None].astype(np.float32),
+        reward=t.astype(np.float32),
+        terminated=np.zeros(num_rows, dtype=bool),
+        truncated=np.zeros(num_rows, dtype=bool),
+        done=np.zeros(num_rows, dtype=bool),
+        success=None,
+        fail=None,
+    )
+
+
+def concatenate_rows(rows: list, key: str) -> np.ndarray:
+    return np.concatenate([r[key] for r in rows])
+
+
+def test_trajectory_buffer_appends() -> None:
+    first = make_rows(0, 1)
+    buffer = TrajectoryBuffer(
+        Step(**first, env_episode_ptr=np.zeros(1, dtype=int)), capacity=2
+    )
+    rows = [first] + [make_rows(t, 1) for t in range(1, 9)]
+    for r in rows[1:]:
+        buffer.append(**r)
+
+    assert len(buffer) == 9
+    assert buffer.capacity == 16
+    assert np.array_equal(buffer.reward, concatenate_rows(rows, "reward"))
+    assert np.array_equal(
+        buffer.observation["qpos"],
+        np.concatenate([r["observation"]["qpos"] for r in rows]),
+    )
+    # the fields that aren't recorded read as None
+    assert buffer.success is None
+    assert buffer.fail is None
+
+
+def test_trajectory_buffer_promotes_dtypes() -> None:
+    first = make_rows(0, 1)
+    buffer = TrajectoryBuffer(
+        Step(**first, env_episode_ptr=np.zeros(1, dtype=int))
+    )
+    rows = make_rows(1, 1)
+    rows["reward"] = rows["reward"].astype(np.float64)
+    buffer.append(**rows)
+
+    # like concatenating the arrays would
+    assert buffer.reward.dtype == np.float64
+    assert np.array_equal(buffer.reward, [0, 1])
+
+
+def test_trajectory_buffer_drops_missing_fields() -> None:
+    first = make_rows(0, 1)
+    buffer = TrajectoryBuffer(
+        Step(**first, env_episode_ptr=np.zeros(1, dtype=int))
+    )
+    buffer.append(**make_rows(1, 1, with_state=False))
+
+    assert buffer.state is None
+    assert len(buffer) == 2
+
+
+def test_trajectory_buffer_truncate() -> None:
+    first = make_rows(0, 4)
+    buffer = TrajectoryBuffer(
+        Step(**first, env_episode_ptr=np.array([3])), capacity=4
+    )
+    buffer.append(**make_rows(4, 3))
+    buffer.truncate(3)
+
+    assert len(buffer) == 4
+    assert np.array_equal(buffer.reward, [3, 4, 5, 6])
+    assert np.array_equal(buffer.observation["qpos"][:, 1], [-3, -4, -5, -6])
+    assert np.array_equal(buffer.env_episode_ptr, [0])
+
+    # the rows freed by the truncation are reused
+    buffer.append(**make_rows(7, 4))
+    assert buffer.capacity == 8
+    assert np.array_equal(buffer.reward, np.arange(3, 11))